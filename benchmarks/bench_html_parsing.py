@@ -0,0 +1,66 @@
+"""Compares the BeautifulSoup and lxml page parsers on the saved page fixtures.
+
+Usage:
+    python benchmarks/bench_html_parsing.py [--iterations 50] [--rows 250]
+"""
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT / "src"))
+
+from models import discogs_objects
+from models.discogs_objects import DiscogsRelease, DiscogsStatsPage, DiscogsSellerPageRelease
+
+FIXTURES = ROOT / "tests" / "fixtures"
+
+
+def load_fixtures(rows):
+    release = (FIXTURES / "release.html").read_text(encoding="utf-8")
+    stats = (FIXTURES / "stats.html").read_text(encoding="utf-8")
+    sellers = (FIXTURES / "sellers.html").read_text(encoding="utf-8")
+
+    # Grow the fixtures to the size of a busy page: a full 250 row listing
+    # table and a few thousand have/want members.
+    body = re.search(r"<tbody>(.*)</tbody>", sellers, re.S).group(1)
+    row_html = re.findall(r'<tr class="shortcut_navigable.*?</tr>', body, re.S)
+    grown_rows = "".join(row_html[i % len(row_html)] for i in range(rows))
+    sellers = sellers.replace(body, grown_rows)
+    members = "".join(f'<li><a href="/user/member{i}">member{i}</a></li>' for i in range(2000))
+    stats = stats.replace('<li><a href="/user/frank">frank</a></li>', members)
+    return release, stats, sellers
+
+
+def run_parsers(release, stats, sellers):
+    DiscogsRelease.parse_stats(release)
+    DiscogsStatsPage.parse_members_data(stats)
+    DiscogsSellerPageRelease.parse_items_for_sale(sellers)
+
+
+def bench(backend, iterations, pages):
+    discogs_objects.HTML_PARSER = backend
+    run_parsers(*pages)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        run_parsers(*pages)
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=250)
+    args = parser.parse_args()
+
+    pages = load_fixtures(args.rows)
+    timings = {backend: bench(backend, args.iterations, pages) for backend in ("bs4", "lxml")}
+    for backend, seconds in timings.items():
+        print(f"{backend:>5}: {seconds * 1000:8.2f} ms per release ({1 / seconds:7.1f} releases/sec)")
+    print(f"speedup: {timings['bs4'] / timings['lxml']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
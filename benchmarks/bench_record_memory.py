@@ -0,0 +1,73 @@
+"""Measures the memory held by a batch of scrape results as slotted records and as the dicts they replaced.
+
+Usage:
+    python benchmarks/bench_record_memory.py [--releases 1000] [--rows 25] [--members 200]
+"""
+import argparse
+import re
+import sys
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT / "src"))
+
+from models.records import RELEASE_STAT_FIELDS
+from scraper.scraper import parse_release_pages
+
+FIXTURES = ROOT / "tests" / "fixtures"
+STAT_LABELS = {field: label for label, field in RELEASE_STAT_FIELDS.items()}
+
+
+def load_pages(rows, members):
+    release = (FIXTURES / "release.html").read_text(encoding="utf-8")
+    stats = (FIXTURES / "stats.html").read_text(encoding="utf-8")
+    sellers = (FIXTURES / "sellers.html").read_text(encoding="utf-8")
+
+    body = re.search(r"<tbody>(.*)</tbody>", sellers, re.S).group(1)
+    row_html = re.findall(r'<tr class="shortcut_navigable.*?</tr>', body, re.S)
+    sellers = sellers.replace(body, "".join(row_html[i % len(row_html)] for i in range(rows)))
+    member_html = "".join(f'<li><a href="/user/member{i}">member{i}</a></li>' for i in range(members))
+    stats = stats.replace('<li><a href="/user/frank">frank</a></li>', member_html)
+    return {"release": release, "stats": stats, "sellers": [sellers], "watermark": None}
+
+
+def as_dicts(result):
+    """The nested dict layout results had before they became records."""
+    return {
+        "release_id": result.release_id,
+        "release": {STAT_LABELS[field]: value for field, value in result.release.to_dict().items()},
+        "stats": result.stats.to_dict(),
+        "sellers": [listing.to_dict() for listing in result.sellers],
+    }
+
+
+def measure(pages, releases, convert):
+    tracemalloc.start()
+    results = [convert(parse_release_pages(dict(pages, release_id=release_id))) for release_id in range(releases)]
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del results
+    return held
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--releases", type=int, default=1000)
+    parser.add_argument("--rows", type=int, default=25)
+    parser.add_argument("--members", type=int, default=200)
+    args = parser.parse_args()
+
+    pages = load_pages(args.rows, args.members)
+    parse_release_pages(dict(pages, release_id=0))
+    sizes = {
+        "dicts": measure(pages, args.releases, as_dicts),
+        "records": measure(pages, args.releases, lambda result: result),
+    }
+    for layout, size in sizes.items():
+        print(f"{layout:>7}: {size / 1024**2:7.2f} MiB held, {size / args.releases / 1024:6.1f} KiB per release")
+    print(f"saving: {1 - sizes['records'] / sizes['dicts']:.0%}")
+
+
+if __name__ == "__main__":
+    main()
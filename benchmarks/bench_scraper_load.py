@@ -0,0 +1,80 @@
+"""Load-tests the scraper end to end against a local stub Discogs server.
+
+Scraper, SessionManager and ProxyManager run unmodified. The proxy list and
+the fake proxies come from the stub server (tests/stub_discogs.py), which
+injects latency, server errors and 429 responses.
+
+Usage:
+    python benchmarks/bench_scraper_load.py [--releases 200] [--workers 16] [--proxies 8]
+        [--latency 0.05] [--jitter 0.02] [--error-rate 0.02] [--rate-limit-rate 0.02]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT / "src"))
+sys.path.append(str(ROOT))
+
+from models import discogs_objects
+from scraper.scraper import Scraper
+from tests.stub_discogs import StubDiscogs
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--releases", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--parse-workers", type=int, default=0)
+    parser.add_argument("--proxies", type=int, default=8)
+    parser.add_argument("--rate-limit", type=int, default=6000, help="requests per minute per proxy")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per stub response")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.02, help="share of 500 responses")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.02, help="share of 429 responses")
+    parser.add_argument("--backoff", type=float, default=0.01, help="retry backoff base in seconds")
+    args = parser.parse_args()
+
+    stub = StubDiscogs(args.latency, args.jitter, args.error_rate, args.rate_limit_rate, args.proxies, seed=1)
+    with stub:
+        discogs_objects.DISCOGS_BASE_URL = stub.base_url
+        discogs_objects.RETRY_BACKOFF_SECONDS = args.backoff
+        discogs_objects.fetch_stats.reset()
+        scraper = Scraper(stub.proxy_list_url, max_workers=args.workers, parse_workers=args.parse_workers)
+        scraper.session_manager.rate_limit_per_minute = args.rate_limit
+
+        latencies = []
+        fetch_release_pages = scraper.fetch_release_pages
+
+        def timed_fetch(release_id, watermark=None):
+            start = time.perf_counter()
+            pages = fetch_release_pages(release_id, watermark)
+            latencies.append(time.perf_counter() - start)
+            return pages
+
+        scraper.fetch_release_pages = timed_fetch
+        start = time.perf_counter()
+        try:
+            results = scraper.run(list(range(1, args.releases + 1)))
+        finally:
+            scraper.close()
+        wall_seconds = time.perf_counter() - start
+
+    stats = discogs_objects.fetch_stats
+    complete = sum(1 for result in results if result.release and result.stats.have is not None and result.sellers)
+    print(f"releases: {len(results)} scraped, {complete} complete in {wall_seconds:.2f}s "
+          f"({len(results) / wall_seconds:.1f} releases/sec)")
+    print(f"release latency: p50 {percentile(latencies, 0.5) * 1000:.0f} ms, p99 {percentile(latencies, 0.99) * 1000:.0f} ms")
+    print(f"requests: {stats.requests}, retries: {stats.retries}, "
+          f"429s: {stats.rate_limited}, failed fetches: {stats.failures}")
+    print(f"stub served: {dict(stub.counts)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Benchmarks loading Discogs XML dumps on synthetic data, offline.
+
+Dumps are generated with tests/dump_generator.py (and kept in --workdir). For
+each dump type it measures:
+
+    iterparse/<kind>      XMLDataHandler.parse_xml with a parser that does nothing
+    parse_xml/<kind>      XMLDataHandler.parse_xml with the dump's parser, discarding records
+    filtered/<kind>       the same, loading only Electronic records (releases and masters)
+    sink/<sink>/<kind>    the same, writing into a data store (postgres and redis
+                          only when --database-url / --redis-host are given)
+    cache/<kind>          the same, writing the parse cache (ShardedFileStore)
+    replay/<kind>         replaying that cache into a data store that discards records
+
+and reports records/sec, MB/sec of uncompressed XML and peak memory. Every case
+runs in its own process so peak memory isn't shared between cases. Results can
+be saved and compared against an earlier run, e.g. on another commit:
+
+    python benchmarks/bench_xml_loading.py --records 20000 --save before.json
+    git checkout my-branch
+    python benchmarks/bench_xml_loading.py --records 20000 --compare before.json
+"""
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT / "src"))
+sys.path.append(str(ROOT))
+
+from models.sinks.db import BaseDataStore
+from models.sinks.shard_cache import ShardedFileStore, ShardReader
+from tests.dump_generator import DumpGenerator
+from utils import xml_handler
+from utils.xml_handler import PARSERS, RecordFilter, XMLDataHandler
+
+
+class NullDataStore(BaseDataStore):
+    """Counts inserted records and drops them."""
+
+    def __init__(self):
+        self.count = 0
+
+    def connect(self):
+        pass
+
+    def insert(self, records):
+        self.count += len(records)
+
+
+def noop_parser(kind):
+    return type("NoopParser", (), {"name": kind, "parse": staticmethod(lambda elem: None)})()
+
+
+def make_sink(name, kind, args):
+    if name == "null":
+        return NullDataStore()
+    if name == "postgres":
+        import psycopg2
+        from models.sinks.postgres import PostgresDataStore
+        table_name = f"bench_{kind}s"
+        with psycopg2.connect(args.database_url) as conn, conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+            cursor.execute(f"CREATE TABLE {table_name} (id SERIAL PRIMARY KEY, data JSONB NOT NULL)")
+        return PostgresDataStore(args.database_url, table_name)
+    if name == "redis":
+        from models.sinks.redis import RedisDataStore
+        return RedisDataStore(host=args.redis_host, port=args.redis_port)
+    raise ValueError(f"Unknown sink {name}")
+
+
+def run_case(case, path, args, queue):
+    stage, *sink, kind = case.split("/")
+    xml_handler.BATCH_SIZE = args.batch_size
+    cache_dir = os.path.join(args.workdir, f"cache-{kind}")
+    if stage == "replay":
+        start = time.perf_counter()
+        ShardReader(cache_dir).replay(NullDataStore, workers=args.replay_workers, batch_size=args.batch_size)
+        seconds = time.perf_counter() - start
+        queue.put({"seconds": seconds, "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024})
+        return
+    parser = noop_parser(kind) if stage == "iterparse" else PARSERS[kind]()
+    if stage == "cache":
+        data_store = ShardedFileStore(cache_dir, shards=args.replay_workers)
+    else:
+        data_store = make_sink(sink[0], kind, args) if sink else NullDataStore()
+    record_filter = RecordFilter(genres=["Electronic"]) if stage == "filtered" else None
+    handler = XMLDataHandler(f"file://{path}", os.path.dirname(path), data_store=data_store,
+                             parser_class=parser, keep_file=True, record_filter=record_filter)
+    start = time.perf_counter()
+    handler.parse_xml()
+    if stage == "cache":
+        data_store.finish()
+    seconds = time.perf_counter() - start
+    queue.put({"seconds": seconds, "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024})
+
+
+def measure(case, dump, args):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=run_case, args=(case, dump["path"], args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return {
+        "records_per_sec": dump["records"] / result["seconds"],
+        "mb_per_sec": dump["mb"] / result["seconds"],
+        "peak_mb": result["peak_mb"],
+    }
+
+
+def prepare_dump(kind, args):
+    path = os.path.join(args.workdir, f"{kind}s-{args.records}-{args.seed}.xml.gz")
+    if not os.path.exists(path):
+        print(f"Generating {args.records} {kind}s into {path}")
+        DumpGenerator(kind, seed=args.seed).write(path, records=args.records)
+    with gzip.open(path, "rb") as f:
+        size = sum(len(chunk) for chunk in iter(lambda: f.read(1 << 20), b""))
+    return {"path": path, "records": args.records, "mb": size / 1024**2}
+
+
+def compare(results, baseline, threshold):
+    """Prints the change from a saved run; returns the cases that got slower or bigger than threshold."""
+    regressions = []
+    print(f"\nCompared with {baseline.get('commit', 'baseline')}:")
+    for case, result in results.items():
+        before = baseline["results"].get(case)
+        if before is None:
+            continue
+        speed = result["records_per_sec"] / before["records_per_sec"] - 1
+        memory = result["peak_mb"] / before["peak_mb"] - 1
+        flag = ""
+        if speed < -threshold or memory > threshold:
+            regressions.append(case)
+            flag = "  REGRESSION"
+        print(f"{case:<28} records/sec {speed:+7.1%}   peak memory {memory:+7.1%}{flag}")
+    return regressions
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kinds", default=",".join(PARSERS), help="comma separated dump types")
+    parser.add_argument("--records", type=int, default=20000, help="records per generated dump")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=xml_handler.BATCH_SIZE)
+    parser.add_argument("--workdir", default=os.path.join(os.getenv("TMPDIR", "/tmp"), "discogs-bench"))
+    parser.add_argument("--database-url", help="also benchmark the Postgres sink (creates bench_* tables)")
+    parser.add_argument("--redis-host", help="also benchmark the Redis sink")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with results saved by --save")
+    parser.add_argument("--replay-workers", type=int, default=os.cpu_count(), help="parse cache shards and replay processes")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change reported as a regression")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    sinks = ["null"] + (["postgres"] if args.database_url else []) + (["redis"] if args.redis_host else [])
+    results = {}
+    for kind in args.kinds.split(","):
+        dump = prepare_dump(kind, args)
+        cases = [f"iterparse/{kind}", f"parse_xml/{kind}"] + [f"sink/{sink}/{kind}" for sink in sinks]
+        cases += [f"cache/{kind}", f"replay/{kind}"]
+        if kind in ("release", "master"):
+            cases.insert(2, f"filtered/{kind}")
+        for case in cases:
+            result = results[case] = measure(case, dump, args)
+            print(f"{case:<28} {result['records_per_sec']:10.0f} records/sec {result['mb_per_sec']:8.2f} MB/sec "
+                  f"{result['peak_mb']:8.1f} MB peak")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"commit": current_commit(), "records": args.records, "results": results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
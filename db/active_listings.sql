@@ -0,0 +1,19 @@
+-- release_sellers keeps every listing ever scraped, but sold and withdrawn
+-- listings drop off the marketplace. Each upsert stamps last_seen, and a
+-- scrape that fetched every listing page of a release records its time in
+-- release_listing_fetches: listings of the release not seen since then are
+-- gone. active_release_sellers holds the rest, which is what market
+-- summaries are computed from.
+ALTER TABLE release_sellers ADD COLUMN last_seen TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+UPDATE release_sellers SET last_seen = COALESCE(created_time, CURRENT_TIMESTAMP);
+
+CREATE TABLE release_listing_fetches (
+    release_id INT PRIMARY KEY,
+    full_fetch_time TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+CREATE VIEW active_release_sellers AS
+SELECT s.*
+FROM release_sellers s
+LEFT JOIN release_listing_fetches f ON f.release_id = s.release_id
+WHERE f.full_fetch_time IS NULL OR s.last_seen >= f.full_fetch_time;
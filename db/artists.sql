@@ -1,3 +1,7 @@
+-- Normalizes the artists dump table (artist_id, data), see TABLE_COLUMNS in
+-- managers/load_orchestrator.py. Reruns after the dump is loaded again start over.
+DROP TABLE IF EXISTS artist_aliases, artist_groups, artist_name_variations, artist_websites;
+
 CREATE TABLE artist_aliases (
     artist_id INTEGER NOT NULL,
     alias_id INTEGER NOT NULL,
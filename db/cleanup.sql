@@ -1,27 +1,20 @@
+-- Copies the electronic releases out of the releases dump table and splits out
+-- their labels, videos, artists and formats. Reruns after the dump is loaded again
+-- rebuild the split out tables and update electronic_releases in place, since the
+-- scraped tables of init.sql reference it.
+DROP TABLE IF EXISTS release_labels, release_videos, release_artists, release_formats;
 
-CREATE TABLE electronic_releases (
+CREATE TABLE IF NOT EXISTS electronic_releases (
     id INT PRIMARY KEY,
     data JSONB
 );
 
-INSERT INTO electronic_releases (id, data)
-SELECT (data->>'id')::INT AS id,
-       data
-FROM releases
-WHERE data->'genres' ? 'Electronic';
-
-
-ALTER TABLE electronic_releases ADD COLUMN master_id BOOLEAN;
-
-UPDATE electronic_releases
-SET master_id = CASE
-    WHEN data->>'master_id' = 'true' THEN True
-    WHEN data->>'master_id' = 'false' THEN False
-    ELSE NULL
-END;
-
-
-ALTER TABLE electronic_releases ADD COLUMN release_date TEXT;
+-- ReleaseParser stores the master's id in "master_id" and its is_main_release
+-- flag in "is_main_release". Releases loaded before that have the flag in
+-- "master_id" and no master id.
+ALTER TABLE electronic_releases ADD COLUMN IF NOT EXISTS master_id INT;
+ALTER TABLE electronic_releases ADD COLUMN IF NOT EXISTS is_main_release BOOLEAN;
+ALTER TABLE electronic_releases ADD COLUMN IF NOT EXISTS release_date TEXT;
 
 CREATE OR REPLACE FUNCTION parse_release_date(release_text TEXT) RETURNS DATE AS $$
 DECLARE
@@ -44,11 +37,29 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
-UPDATE electronic_releases
-SET release_date = parse_release_date(data->>'released');
+INSERT INTO electronic_releases (id, data, master_id, is_main_release, release_date)
+SELECT (data->>'id')::INT AS id,
+       data,
+       CASE
+           WHEN data->>'master_id' ~ '^[0-9]+$' THEN (data->>'master_id')::INT
+           ELSE NULL
+       END AS master_id,
+       CASE COALESCE(data->>'is_main_release', data->>'master_id')
+           WHEN 'true' THEN True
+           WHEN 'false' THEN False
+           ELSE NULL
+       END AS is_main_release,
+       parse_release_date(data->>'released') AS release_date
+FROM releases
+WHERE data->'genres' ? 'Electronic'
+ON CONFLICT (id) DO UPDATE
+SET data = EXCLUDED.data,
+    master_id = EXCLUDED.master_id,
+    is_main_release = EXCLUDED.is_main_release,
+    release_date = EXCLUDED.release_date;
 
 CREATE TABLE release_labels (
-    release_id TEXT NOT NULL,
+    release_id INT NOT NULL,
     label_id TEXT,
     label_name TEXT,
     catno TEXT
@@ -56,7 +67,7 @@ CREATE TABLE release_labels (
 
 INSERT INTO release_labels (release_id, label_id, label_name, catno)
 SELECT
-    er.data->>'id' AS release_id,
+    er.id AS release_id,
     jsonb_label->>'id' AS label_id,
     jsonb_label->>'name' AS label_name,
     jsonb_label->>'catno' AS catno
@@ -65,7 +76,7 @@ FROM
     jsonb_array_elements(er.data->'labels') AS jsonb_label;
 
 CREATE TABLE release_videos (
-    release_id TEXT NOT NULL,
+    release_id INT NOT NULL,
     video_src TEXT,
     video_title TEXT,
     video_description TEXT
@@ -73,7 +84,7 @@ CREATE TABLE release_videos (
 
 INSERT INTO release_videos (release_id, video_src, video_title, video_description)
 SELECT
-    er.data->>'id' AS release_id,
+    er.id AS release_id,
     jsonb_video->>'src' AS video_src,
     jsonb_video->>'title' AS video_title,
     jsonb_video->>'description' AS video_description
@@ -113,12 +124,13 @@ FROM
     electronic_releases er,
     jsonb_array_elements(er.data->'formats') AS jsonb_format;
 
+-- YouTube video id of the watch URL, NULL for other URLs
 ALTER TABLE release_videos ADD COLUMN video_id CHAR(11);
 
 UPDATE release_videos
-SET video_id = REGEXP_REPLACE(src, '.*[?&]v=([^&]+).*', '\1', 'g');
+SET video_id = SUBSTRING(video_src FROM '[?&]v=([^&]{11})');
 
-ALTER TABLE release_videos DROP COLUMN src;
+ALTER TABLE release_videos DROP COLUMN video_src;
 
 ALTER TABLE release_formats
 ADD CONSTRAINT fk_release_formats_release_id
@@ -132,18 +144,6 @@ ALTER TABLE release_labels
 ADD CONSTRAINT fk_release_labels_release_id
 FOREIGN KEY (release_id) REFERENCES electronic_releases(id);
 
-ALTER TABLE release_companies
-ADD CONSTRAINT fk_release_companies_release_id
-FOREIGN KEY (release_id) REFERENCES electronic_releases(id);
-
-ALTER TABLE release_styles
-ADD CONSTRAINT fk_release_styles_release_id
-FOREIGN KEY (release_id) REFERENCES electronic_releases(id);
-
-ALTER TABLE release_tracklist
-ADD CONSTRAINT fk_release_tracklist_release_id
-FOREIGN KEY (release_id) REFERENCES electronic_releases(id);
-
 ALTER TABLE release_videos
 ADD CONSTRAINT fk_release_videos_release_id
 FOREIGN KEY (release_id) REFERENCES electronic_releases(id);
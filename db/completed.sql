@@ -0,0 +1,2 @@
+SELECT DISTINCT release_id
+FROM release_sellers
@@ -0,0 +1,38 @@
+CREATE TABLE scrape_frontier (
+    release_id INT PRIMARY KEY,
+    release_class TEXT NOT NULL DEFAULT 'new',
+    priority DOUBLE PRECISION,
+    last_scraped TIMESTAMP WITH TIME ZONE,
+    next_due TIMESTAMP WITH TIME ZONE,
+    listing_count INT,
+    listing_churn FLOAT
+);
+
+CREATE INDEX scrape_frontier_due_priority_idx ON scrape_frontier (priority DESC NULLS LAST, next_due);
+
+-- Seed the frontier with every release we load, marking releases that already
+-- have marketplace data as scraped at the time of their latest listing.
+INSERT INTO scrape_frontier (release_id, last_scraped)
+SELECT er.id, s.last_scraped
+FROM electronic_releases er
+LEFT JOIN (
+    SELECT release_id, MAX(created_time) AS last_scraped
+    FROM release_sellers
+    GROUP BY release_id
+) s ON s.release_id = er.id
+ON CONFLICT (release_id) DO NOTHING;
+
+-- Leased claims let several scraper nodes share the frontier: a node owns the
+-- releases it claimed until lease_expires, after which others may reclaim them.
+ALTER TABLE scrape_frontier ADD COLUMN claimed_by TEXT;
+ALTER TABLE scrape_frontier ADD COLUMN lease_expires TIMESTAMP WITH TIME ZONE;
+
+CREATE TABLE scrape_nodes (
+    node_id TEXT PRIMARY KEY,
+    hostname TEXT,
+    started_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    heartbeat TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    claimed INT DEFAULT 0,
+    completed INT DEFAULT 0,
+    failed INT DEFAULT 0
+);
@@ -0,0 +1,28 @@
+-- Recrawl class and priority of a release in the scrape frontier, so
+-- ScrapeFrontier.refresh() updates the whole table in one statement instead
+-- of round-tripping every row through Python. They mirror classify_release()
+-- and compute_priority() in scraper/frontier.py. Safe to re-run after editing.
+CREATE OR REPLACE FUNCTION frontier_release_class(
+    last_scraped TIMESTAMP WITH TIME ZONE, want INT, have INT, last_sold DATE, churn FLOAT,
+    now TIMESTAMP WITH TIME ZONE
+) RETURNS TEXT AS $$
+    SELECT CASE
+        WHEN last_scraped IS NULL THEN 'new'
+        WHEN (now AT TIME ZONE 'UTC')::DATE - last_sold <= 30 OR COALESCE(churn, 0) >= 0.3 OR COALESCE(want, 0) >= 500 THEN 'hot'
+        WHEN (now AT TIME ZONE 'UTC')::DATE - last_sold <= 365 OR COALESCE(want, 0) >= 50 THEN 'warm'
+        ELSE 'cold'
+    END
+$$ LANGUAGE SQL IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION frontier_priority(
+    last_scraped TIMESTAMP WITH TIME ZONE, want INT, have INT, last_sold DATE, churn FLOAT,
+    interval_seconds FLOAT, now TIMESTAMP WITH TIME ZONE
+) RETURNS DOUBLE PRECISION AS $$
+    SELECT CASE
+               WHEN last_scraped IS NULL THEN 10.0
+               ELSE EXTRACT(EPOCH FROM now - last_scraped) / COALESCE(NULLIF(interval_seconds, 0), 1.0)
+           END
+           * (1.0 + ln(1.0 + COALESCE(want, 0)) + 0.5 * ln(1.0 + COALESCE(have, 0)))
+           * (1.0 + COALESCE(1.0 / (1.0 + ((now AT TIME ZONE 'UTC')::DATE - last_sold) / 30.0), 0.0))
+           * (1.0 + COALESCE(churn, 0.0))
+$$ LANGUAGE SQL IMMUTABLE;
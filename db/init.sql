@@ -52,6 +52,11 @@ ALTER TABLE release_details ADD COLUMN created_time TIMESTAMP WITH TIME ZONE DEF
 ALTER TABLE release_wants ADD COLUMN created_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
 ALTER TABLE release_haves ADD COLUMN created_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
 
+-- Marketplace listing ids increase over time; the highest one stored per release
+-- is the watermark that lets re-scrapes stop once they reach already seen listings.
+ALTER TABLE release_sellers ADD COLUMN listing_id BIGINT;
+CREATE INDEX release_sellers_release_listing_idx ON release_sellers (release_id, listing_id);
+
 ALTER TABLE release_wants
 ADD CONSTRAINT fk_release_wants_release_id
 FOREIGN KEY (release_id) REFERENCES electronic_releases(id);
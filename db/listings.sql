@@ -0,0 +1,7 @@
+-- A seller can list several copies of a release and relist it later, so
+-- release_sellers is keyed by marketplace listing id rather than by seller:
+-- re-scrapes update listings in place instead of failing on the seller key.
+-- Rows stored before listing ids were recorded have none and stay unkeyed.
+ALTER TABLE release_sellers DROP CONSTRAINT IF EXISTS release_sellers_pkey;
+DROP INDEX IF EXISTS release_sellers_release_listing_idx;
+CREATE UNIQUE INDEX release_sellers_release_listing_key ON release_sellers (release_id, listing_id);
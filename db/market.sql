@@ -0,0 +1,41 @@
+-- Marketplace summary of each release per currency: listing and seller counts,
+-- min/median/max price and listings per media condition. The scraper
+-- recomputes the rows of the releases it writes listings for, so dashboards
+-- read this table instead of aggregating release_sellers.
+CREATE TABLE release_market_summary (
+    release_id INT NOT NULL,
+    currency CHAR(3) NOT NULL,
+    listing_count INT NOT NULL,
+    seller_count INT NOT NULL,
+    min_price FLOAT,
+    median_price FLOAT,
+    max_price FLOAT,
+    conditions JSONB NOT NULL DEFAULT '{}',
+    updated_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (release_id, currency)
+);
+
+-- Summaries of the listings stored so far.
+INSERT INTO release_market_summary (
+    release_id, currency, listing_count, seller_count, min_price, median_price, max_price, conditions
+)
+SELECT p.release_id, p.currency, p.listing_count, p.seller_count, p.min_price, p.median_price, p.max_price,
+       COALESCE(c.conditions, '{}')
+FROM (
+    SELECT release_id, currency, COUNT(*) AS listing_count, COUNT(DISTINCT seller_id) AS seller_count,
+           MIN(price) AS min_price, percentile_cont(0.5) WITHIN GROUP (ORDER BY price) AS median_price,
+           MAX(price) AS max_price
+    FROM release_sellers
+    WHERE currency IS NOT NULL AND price IS NOT NULL
+    GROUP BY release_id, currency
+) p
+LEFT JOIN (
+    SELECT release_id, currency, jsonb_object_agg(media_condition, listings) AS conditions
+    FROM (
+        SELECT release_id, currency, media_condition, COUNT(*) AS listings
+        FROM release_sellers
+        WHERE currency IS NOT NULL AND price IS NOT NULL AND media_condition IS NOT NULL
+        GROUP BY release_id, currency, media_condition
+    ) t
+    GROUP BY release_id, currency
+) c USING (release_id, currency);
@@ -0,0 +1,20 @@
+-- release_wants and release_haves hold the current members of each release.
+-- Every scrape only writes what changed: added members are inserted, removed
+-- members deleted, and both are appended here as timestamped events.
+CREATE TABLE release_membership_events (
+    release_id INT NOT NULL,
+    kind TEXT NOT NULL CHECK (kind IN ('want', 'have')),
+    username TEXT NOT NULL,
+    added BOOLEAN NOT NULL,
+    event_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX release_membership_events_release_idx
+ON release_membership_events (release_id, kind, event_time);
+
+-- Existing members become the first "added" events.
+INSERT INTO release_membership_events (release_id, kind, username, added, event_time)
+SELECT release_id, 'want', username, TRUE, created_time FROM release_wants;
+
+INSERT INTO release_membership_events (release_id, kind, username, added, event_time)
+SELECT release_id, 'have', username, TRUE, created_time FROM release_haves;
@@ -1,3 +1,2 @@
 SELECT DISTINCT release_id
 FROM release_sellers_backup
-WHERE release_id NOT IN (SELECT release_id FROM release_sellers)
\ No newline at end of file
@@ -0,0 +1,10 @@
+-- Highest listing id seen by the last inventory crawl of each seller
+-- (SCRAPE_MODE=sellers). Kept apart from release_sellers, whose rows mostly
+-- come from per-release crawls: their newest listing id would stop a seller's
+-- first inventory crawl on page 1, before the older listings of releases that
+-- were never crawled. Sellers without a row get their whole inventory walked.
+CREATE TABLE seller_inventory_watermarks (
+    seller_id INT PRIMARY KEY REFERENCES users (user_id),
+    listing_id BIGINT NOT NULL,
+    crawled_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,5 @@
+SELECT u.username
+FROM release_sellers s
+JOIN users u ON u.user_id = s.seller_id
+GROUP BY u.username
+ORDER BY COUNT(*) DESC
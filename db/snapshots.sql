@@ -0,0 +1,51 @@
+-- release_details holds the latest statistics of each release. Every scrape
+-- that changes them also appends a snapshot here, so have/want counts, ratings
+-- and prices can be followed over time. Unchanged statistics aren't written
+-- again, and ReleaseDetailsStore.downsample() thins out old snapshots.
+-- Partitioned by month; release_detail_snapshot_partition() creates them.
+CREATE TABLE release_detail_snapshots (
+    release_id INT NOT NULL,
+    snapshot_time TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    have INT,
+    want INT,
+    avg_rating FLOAT,
+    ratings INT,
+    last_sold DATE,
+    low FLOAT,
+    median FLOAT,
+    high FLOAT,
+    PRIMARY KEY (release_id, snapshot_time)
+) PARTITION BY RANGE (snapshot_time);
+
+-- Creates the partition of the month holding ts if it doesn't exist yet and returns its name.
+CREATE OR REPLACE FUNCTION release_detail_snapshot_partition(ts TIMESTAMP WITH TIME ZONE) RETURNS TEXT AS $$
+DECLARE
+    month_start TIMESTAMP := date_trunc('month', ts AT TIME ZONE 'UTC');
+    partition_name TEXT := 'release_detail_snapshots_' || to_char(month_start, 'YYYY_MM');
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF release_detail_snapshots FOR VALUES FROM (%L) TO (%L)',
+        partition_name, month_start AT TIME ZONE 'UTC', (month_start + INTERVAL '1 month') AT TIME ZONE 'UTC'
+    );
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- How far back ReleaseDetailsStore.downsample() has thinned snapshots out to one
+-- per unit (day or week), so each run only reads the snapshots aged since.
+CREATE TABLE release_detail_snapshot_downsampling (
+    unit TEXT PRIMARY KEY,
+    downsampled_until TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+ALTER TABLE release_details ADD COLUMN updated_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+
+-- The stored statistics become the first snapshots.
+SELECT release_detail_snapshot_partition(month)
+FROM (SELECT DISTINCT date_trunc('month', COALESCE(created_time, now())) AS month FROM release_details) m;
+
+INSERT INTO release_detail_snapshots (
+    release_id, snapshot_time, have, want, avg_rating, ratings, last_sold, low, median, high
+)
+SELECT release_id, COALESCE(created_time, now()), have, want, avg_rating, ratings, last_sold, low, median, high
+FROM release_details;
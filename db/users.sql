@@ -0,0 +1,30 @@
+-- Usernames are stored once in users; release_wants, release_haves,
+-- release_membership_events and release_sellers refer to them by integer id.
+CREATE TABLE users (
+    user_id SERIAL PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE
+);
+
+INSERT INTO users (username)
+SELECT username FROM release_wants
+UNION SELECT username FROM release_haves
+UNION SELECT username FROM release_membership_events
+UNION SELECT seller FROM release_sellers WHERE seller IS NOT NULL;
+
+ALTER TABLE release_wants ADD COLUMN user_id INT REFERENCES users (user_id);
+UPDATE release_wants t SET user_id = u.user_id FROM users u WHERE u.username = t.username;
+ALTER TABLE release_wants DROP COLUMN username, ALTER COLUMN user_id SET NOT NULL, ADD PRIMARY KEY (release_id, user_id);
+
+ALTER TABLE release_haves ADD COLUMN user_id INT REFERENCES users (user_id);
+UPDATE release_haves t SET user_id = u.user_id FROM users u WHERE u.username = t.username;
+ALTER TABLE release_haves DROP COLUMN username, ALTER COLUMN user_id SET NOT NULL, ADD PRIMARY KEY (release_id, user_id);
+
+ALTER TABLE release_membership_events ADD COLUMN user_id INT REFERENCES users (user_id);
+UPDATE release_membership_events t SET user_id = u.user_id FROM users u WHERE u.username = t.username;
+ALTER TABLE release_membership_events DROP COLUMN username, ALTER COLUMN user_id SET NOT NULL;
+
+ALTER TABLE release_sellers ADD COLUMN seller_id INT REFERENCES users (user_id);
+UPDATE release_sellers t SET seller_id = u.user_id FROM users u WHERE u.username = t.seller;
+-- Listings are keyed by release and listing id (db/listings.sql), not by seller.
+ALTER TABLE release_sellers DROP COLUMN seller;
+CREATE INDEX release_sellers_seller_listing_idx ON release_sellers (seller_id, listing_id);
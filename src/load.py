@@ -1,14 +1,44 @@
 import os
 import logging
+from functools import partial
 from dotenv import load_dotenv
-from utils.xml_handler import XMLDataHandler, ArtistParser
+from utils.xml_handler import XMLDataHandler, ArtistParser, RecordFilter
 from models.sinks.postgres import PostgresDataStore
+from models.sinks.shard_cache import ShardedFileStore, ShardReader, TeeDataStore
+from utils.metrics import instrumented
+from utils.dump_index import build_index
+from utils.artist_graph import ArtistGraphBuilder
+from utils.name_index import NameIndexBuilder
+from managers.load_orchestrator import LoadOrchestrator, dump_url
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 POSTGRES_TABLE_NAME = os.getenv("POSTGRES_TABLE_NAME", "releases_db")
 DATA_URL = os.getenv("DATA_URL")
 DESTINATION_DIR = os.getenv("DESTINATION_DIR", "./")
+# Also write a seekable copy of the dump indexed by record id (utils/dump_index.py)
+INDEX_DUMP = os.getenv("INDEX_DUMP", "false").lower() == "true"
+# Only load records matching these comma separated values, e.g. FILTER_GENRES=Electronic,
+# and FILTER_YEARS=first-last; they're checked before records are parsed
+FILTER_LISTS = {name: os.getenv(f"FILTER_{name.upper()}") for name in ("genres", "styles", "formats", "countries")}
+FILTER_YEARS = os.getenv("FILTER_YEARS")
+# Load several dumps concurrently, e.g. LOAD_DUMPS=artist,label,master,release. Each is
+# downloaded from DATA_URL_<KIND>, or the monthly dump of DUMP_DATE (YYYYMMDD), into <kind>s.
+LOAD_DUMPS = [kind for kind in os.getenv("LOAD_DUMPS", "").split(",") if kind]
+DUMP_DATE = os.getenv("DUMP_DATE")
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 2))
+DOWNLOAD_BYTES_PER_SECOND = int(os.getenv("DOWNLOAD_BYTES_PER_SECOND", 0))
+LOAD_CPU_WORKERS = int(os.getenv("LOAD_CPU_WORKERS", 2))
+LOAD_DB_CONNECTIONS = int(os.getenv("LOAD_DB_CONNECTIONS", 4))
+LOAD_STATUS_PATH = os.getenv("LOAD_STATUS_PATH", "load_status.json")
+# Parsed records are also cached here, and later loads of the same dump replay the
+# cache on PARSE_CACHE_WORKERS processes instead of parsing the XML again
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR")
+PARSE_CACHE_WORKERS = int(os.getenv("PARSE_CACHE_WORKERS", os.cpu_count() or 1))
+# Also build the artist alias/group graph while loading artists (utils/artist_graph.py)
+ARTIST_GRAPH_PATH = os.getenv("ARTIST_GRAPH_PATH")
+# Also build the fuzzy artist name search index while loading artists (utils/name_index.py)
+NAME_INDEX_PATH = os.getenv("NAME_INDEX_PATH")
 
 
 def setup_logging():
@@ -24,21 +54,92 @@ def setup_data_store():
     return data_store
 
 
+def setup_record_filter():
+    criteria = {name: value.split(",") for name, value in FILTER_LISTS.items() if value}
+    if FILTER_YEARS:
+        first, _, last = FILTER_YEARS.partition("-")
+        criteria["years"] = (int(first), int(last or first))
+    if not criteria:
+        return None
+    logging.info(f"Loading only records matching {criteria}")
+    return RecordFilter(**criteria)
+
+
+def load_dumps():
+    dumps = {kind: os.getenv(f"DATA_URL_{kind.upper()}") or dump_url(kind, DUMP_DATE) for kind in LOAD_DUMPS}
+    orchestrator = LoadOrchestrator(dumps,
+                                    DATABASE_URL,
+                                    DESTINATION_DIR,
+                                    download_workers=DOWNLOAD_WORKERS,
+                                    cpu_workers=LOAD_CPU_WORKERS,
+                                    db_connections=LOAD_DB_CONNECTIONS,
+                                    bandwidth=DOWNLOAD_BYTES_PER_SECOND or None,
+                                    status_path=LOAD_STATUS_PATH,
+                                    record_filter=setup_record_filter())
+    with instrumented():
+        status = orchestrator.run()
+    for kind, dump in status["dumps"].items():
+        logging.info(f"{kind}: {dump['status']}, {dump['records']} records")
+
+
+def replay_parse_cache(cache_dir, cache_info):
+    """Loads the records cached by an earlier load of the same dump; returns False if there is no such cache."""
+    if not ShardReader.complete(cache_dir):
+        return False
+    reader = ShardReader(cache_dir)
+    if any(reader.manifest.get(key) != value for key, value in cache_info.items()):
+        logging.info(f"Parse cache in {cache_dir} is for another dump or filter, parsing again")
+        return False
+    with instrumented():
+        count = reader.replay(partial(PostgresDataStore, DATABASE_URL, POSTGRES_TABLE_NAME), PARSE_CACHE_WORKERS)
+    logging.info(f"Loaded {count} records from the parse cache in {cache_dir}")
+    return True
+
+
 def main():
     setup_logging()
+    if LOAD_DUMPS:
+        load_dumps()
+        return
+
+    cache, cache_dir = None, None
+    cache_info = {"url": DATA_URL, "filter": {**FILTER_LISTS, "years": FILTER_YEARS}}
+    if PARSE_CACHE_DIR:
+        cache_dir = os.path.join(PARSE_CACHE_DIR, os.path.basename(DATA_URL).split(".")[0])
+        if replay_parse_cache(cache_dir, cache_info):
+            return
+        cache = ShardedFileStore(cache_dir)
 
     # Initialize the data store
     data_store = setup_data_store()
+    if cache:
+        data_store = TeeDataStore(data_store, cache)
+    graph = ArtistGraphBuilder(ARTIST_GRAPH_PATH) if ARTIST_GRAPH_PATH else None
+    if graph:
+        data_store = TeeDataStore(data_store, graph)
+    name_index = NameIndexBuilder(NAME_INDEX_PATH) if NAME_INDEX_PATH else None
+    if name_index:
+        data_store = TeeDataStore(data_store, name_index)
 
     # Initialize XMLDataHandler with the URL, destination directory, and data store
     handler = XMLDataHandler(DATA_URL,
                              DESTINATION_DIR,
                              data_store=data_store,
                              parser_class=ArtistParser(),
-                             keep_file=True)
+                             keep_file=True,
+                             record_filter=setup_record_filter())
     try:
         handler.download_file()
-        handler.parse_xml()
+        if INDEX_DUMP:
+            build_index(handler.filepath, handler.parser_class.name).close()
+        with instrumented():
+            count = handler.parse_xml()
+        if cache and count is not None:
+            cache.finish(**cache_info)
+        if graph and count is not None:
+            graph.finish().close()
+        if name_index and count is not None:
+            name_index.finish().close()
     except Exception as e:
         logging.error(f"An error occurred: {e}")
 
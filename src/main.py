@@ -1,17 +1,60 @@
 import logging
 from scraper.scraper import Scraper
+from scraper.frontier import ScrapeFrontier
+from scraper.claims import WorkClaimer
+import time
 from models.sinks.postgres import PostgresDataStore
+from models.membership import MembershipStore
+from models.listings import ListingStore
+from models.market import MarketSummaryStore
+from models.users import UserDirectory
+from models.snapshots import ReleaseDetailsStore
+from utils.page_cache import PageCache
+from utils.id_bitmap import IdBitmap
+from utils.metrics import metrics, instrumented
 import os
+from urllib.parse import parse_qsl
 from dotenv import load_dotenv
 
 load_dotenv()
 
 URL = os.getenv("PROXIES_URL")
 MAX_WORKERS = int(os.getenv("MAX_WORKERS", 5))
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", 0))
+PAGE_WORKERS = int(os.getenv("PAGE_WORKERS", 4))
+LISTING_FILTERS = dict(parse_qsl(os.getenv("LISTING_FILTERS", "genre=Electronic&format=Vinyl")))
+INCREMENTAL_LISTINGS = os.getenv("INCREMENTAL_LISTINGS", "true").lower() == "true"
+# Incremental scrapes only see new listings, so a release's listings are walked in full
+# at least this often to find the ones sold or withdrawn since (db/active_listings.sql)
+FULL_LISTINGS_INTERVAL_DAYS = float(os.getenv("FULL_LISTINGS_INTERVAL_DAYS", 7))
 DATABASE_URL = os.getenv("DATABASE_URL")
 TABLE_NAME = os.getenv("TABLE_NAME")
 QUERY_PATH = "../db/releases.sql"
+SELLERS_QUERY_PATH = "../db/sellers.sql"
+# Bitmap of releases already scraped, skipped in "releases" mode. A missing
+# file is seeded from COMPLETED_QUERY_PATH. Leave empty to disable.
+COMPLETED_IDS_PATH = os.getenv("COMPLETED_IDS_PATH", "completed_releases.bin")
+COMPLETED_QUERY_PATH = "../db/completed.sql"
+# "releases" scrapes the ids from QUERY_PATH, "frontier" scrapes due releases by
+# priority from scrape_frontier, "distributed" does the same while sharing the
+# frontier with other nodes, "sellers" walks whole seller inventories
+SCRAPE_MODE = os.getenv("SCRAPE_MODE", "releases")
+NODE_ID = os.getenv("NODE_ID")
+LEASE_SECONDS = int(os.getenv("LEASE_SECONDS", 600))
+IDLE_WAIT_SECONDS = int(os.getenv("IDLE_WAIT_SECONDS", 30))
+# Priorities in the frontier are recomputed after this many batches
+FRONTIER_REFRESH_BATCHES = int(os.getenv("FRONTIER_REFRESH_BATCHES", 20))
 BATCH_SIZE = int(os.getenv("BATCH_SIZE", 500))
+# Number of username -> user id mappings kept in memory
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 100_000))
+PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR")
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", 10 * 1024**3))
+PAGE_CACHE_OFFLINE = os.getenv("PAGE_CACHE_OFFLINE", "false").lower() == "true"
+PAGE_CACHE_TTLS = {
+    "release": int(os.getenv("PAGE_CACHE_TTL_RELEASE", 7 * 24 * 3600)),
+    "stats": int(os.getenv("PAGE_CACHE_TTL_STATS", 24 * 3600)),
+    "sellers": int(os.getenv("PAGE_CACHE_TTL_SELLERS", 6 * 3600)),
+}
 
 logging.basicConfig(
     level=logging.INFO,
@@ -23,118 +66,270 @@ logging.basicConfig(
 )
 
 
-def write_to_postgres(p, releases):
+def write_to_postgres(p, releases, users):
+    """Writes a batch of scraped releases; returns whether every write succeeded."""
     if not releases:
         logging.warning("No releases to write to Postgres.")
-        return
+        return True
 
-    insert_release_sellers(p, releases)
-    insert_release_details(p, releases)
-    insert_release_wants_haves(p, releases, "want")
-    insert_release_wants_haves(p, releases, "have")
-    
+    # Every writer runs even if an earlier one failed
+    written = [
+        insert_release_sellers(p, releases, users),
+        update_market_summary(p, releases),
+        insert_release_details(p, releases),
+        insert_release_wants_haves(p, releases, "want", users),
+        insert_release_wants_haves(p, releases, "have", users),
+    ]
+    return all(written)
 
-def insert_release_sellers(p, releases):
-    """Insert release sellers data into the release_sellers table."""
+
+@metrics.timed("db_write_sellers")
+def insert_release_sellers(p, releases, users, known_only=False, inventories=False):
+    """Upsert the marketplace listings of releases into the release_sellers table.
+
+    With known_only, listings of releases that aren't in electronic_releases are skipped.
+    With inventories, the listings come from seller inventory crawls and move their sellers' watermarks.
+    """
     logging.info(f"Inserting {len(releases)} release sellers data.")
     try:
-        sellers_data = [
-        (
-            release["release_id"],
-            seller.get("image_url"),
-            seller.get("rating"),
-            seller.get("have"),
-            seller.get("want"),
-            seller.get("title"),
-            seller.get("label"),
-            seller.get("catno"),
-            seller.get("media_condition"),
-            seller.get("media_condition_description"),
-            seller.get("seller"),
-            seller.get("seller_rating"),
-            seller.get("ships_from"),
-            seller.get("currency"),
-            seller.get("price"),
-        )
-        for release in releases
-        for seller in release.get("sellers", [])
-        ]
-        query = """
-        INSERT INTO release_sellers (
-            release_id, image_url, rating, have, want, title, label, catno, media_condition, 
-            media_condition_description, seller, seller_rating, ships_from, currency, price
-        ) VALUES %s
-        """
-        p.bulk_insert(query, sellers_data)
-        logging.info("Successfully inserted release sellers data.")
+        rows = ListingStore(p, users).write(releases, known_only=known_only, inventories=inventories)
+        logging.info(f"Successfully wrote {rows} release sellers rows.")
+        return True
     except Exception as e:
         logging.error(f"Failed to insert {len(releases)} release sellers data: {e}")
+        return False
+
 
+@metrics.timed("db_write_market_summary")
+def update_market_summary(p, releases):
+    """Recompute the release_market_summary rows of the releases whose listings were just written."""
+    release_ids = {release.release_id for release in releases if release.sellers}
+    logging.info(f"Updating the market summaries of {len(release_ids)} releases.")
+    try:
+        rows = MarketSummaryStore(p).write(release_ids)
+        logging.info(f"Successfully wrote {rows} market summary rows.")
+        return True
+    except Exception as e:
+        logging.error(f"Failed to update the market summaries of {len(release_ids)} releases: {e}")
+        return False
 
 
+@metrics.timed("db_write_details")
 def insert_release_details(p, releases):
-    """Insert release details data into the release_details table."""
-    logging.info(f"Inserting {len(releases)} release details data.")
+    """Write changed release details to release_details and append them to release_detail_snapshots."""
+    logging.info(f"Writing {len(releases)} release details data.")
     try:
-        details_data = [
-            (
-                release["release_id"],
-                release.get("release", {}).get("Have"),
-                release.get("release", {}).get("Want"),
-                release.get("release", {}).get("Avg Rating"),
-                release.get("release", {}).get("Ratings"),
-                release.get("release", {}).get("Last Sold"),
-                release.get("release", {}).get("Low"),
-                release.get("release", {}).get("Median"),
-                release.get("release", {}).get("High"),
-            )
-            for release in releases
-        ]
-
-        query = """
-        INSERT INTO release_details (
-            release_id, have, want, avg_rating, ratings, last_sold, low, median, high
-        ) VALUES %s
-        """
-        p.bulk_insert(query, details_data)
-        logging.info(f"Successfully inserted {len(releases)} release details data.")
+        changed = ReleaseDetailsStore(p).write(releases)
+        logging.info(f"Successfully wrote release details: {changed} of {len(releases)} changed.")
+        return True
     except Exception as e:
-        logging.error(f"Failed to insert {len(releases)} release details data: {e}")
+        logging.error(f"Failed to write {len(releases)} release details data: {e}")
+        return False
 
 
-def insert_release_wants_haves(p, releases, type_):
-    """Insert release wants/haves data into the release_wants or release_haves table."""
-    logging.info(f"Inserting {len(releases)} release want/haves data.")
+@metrics.timed("db_downsample_snapshots")
+def downsample_release_snapshots(p):
+    """Thin out old release_detail_snapshots rows under the retention policy."""
     try:
-        table_name = f"release_{type_}s"
-        data = [
-            (release["release_id"], user)
-            for release in releases
-            for user in release.get("stats", {}).get(type_, [])
-        ]
-        query = f"INSERT INTO {table_name} (release_id, username) VALUES %s"
-        p.bulk_insert(query, data)
-        logging.info(f"Successfully inserted {len(releases)} release want/haves data.")
+        deleted = ReleaseDetailsStore(p).downsample()
+        logging.info(f"Downsampled release detail snapshots: {deleted} deleted.")
     except Exception as e:
-        logging.error(f"Failed to insert {len(releases)} release want/haves data: {e}")
+        logging.error(f"Failed to downsample release detail snapshots: {e}")
 
 
-def main():
-    p = PostgresDataStore(DATABASE_URL, TABLE_NAME)
-    release_ids = p.fetch_ids_from_file(QUERY_PATH)
-    
-    # Initialize the Scraper object
-    scraper = Scraper(URL, max_workers=MAX_WORKERS)
+def insert_release_wants_haves(p, releases, type_, users):
+    """Apply the changes in release wants/haves to release_wants or release_haves and log them as events."""
+    logging.info(f"Writing {len(releases)} release want/haves deltas.")
+    try:
+        with metrics.timer(f"db_write_{type_}s"):
+            added, removed = MembershipStore(p, users).write(releases, type_)
+        logging.info(f"Successfully wrote release {type_}s deltas: {added} added, {removed} removed.")
+        return True
+    except Exception as e:
+        logging.error(f"Failed to write {len(releases)} release want/haves deltas: {e}")
+        return False
+
+
+def fetch_listing_watermarks(p, release_ids):
+    """Returns the highest listing id already stored per release, so re-scrapes only fetch new listings.
+
+    Releases whose listings weren't walked in full within FULL_LISTINGS_INTERVAL_DAYS get none.
+    """
+    if not INCREMENTAL_LISTINGS:
+        return {}
+    rows = p.fetch_all("""
+        SELECT s.release_id, MAX(s.listing_id)
+        FROM release_sellers s
+        JOIN release_listing_fetches f ON f.release_id = s.release_id
+        WHERE s.release_id = ANY(%s) AND f.full_fetch_time > now() - %s * INTERVAL '1 day'
+        GROUP BY s.release_id
+    """, (list(release_ids), FULL_LISTINGS_INTERVAL_DAYS))
+    return {release_id: listing_id for release_id, listing_id in rows if listing_id is not None}
+
+
+def fetch_inventory_watermarks(p, users, usernames):
+    """Returns the highest listing id seen by each seller's last inventory crawl; first crawls walk everything."""
+    if not INCREMENTAL_LISTINGS:
+        return {}
+    seller_ids = users.ids(usernames)
+    seller_watermarks = ListingStore(p, users).inventory_watermarks(seller_ids.values())
+    return {
+        username: seller_watermarks[seller_id]
+        for username, seller_id in seller_ids.items()
+        if seller_id in seller_watermarks
+    }
+
+
+def setup_page_cache():
+    if not PAGE_CACHE_DIR:
+        return None
+    return PageCache(PAGE_CACHE_DIR,
+                     ttls=PAGE_CACHE_TTLS,
+                     max_bytes=PAGE_CACHE_MAX_BYTES,
+                     offline=PAGE_CACHE_OFFLINE)
+
+
+def setup_completed_ids(p):
+    if SCRAPE_MODE != "releases" or not COMPLETED_IDS_PATH:
+        return None
+    seed = not os.path.exists(COMPLETED_IDS_PATH)
+    completed = IdBitmap(COMPLETED_IDS_PATH)
+    if seed:
+        completed.update(p.fetch_ids_from_file(COMPLETED_QUERY_PATH))
+        completed.save()
+    logging.info(f"{len(completed)} releases already scraped.")
+    return completed
 
+
+def mark_completed(scraper, releases):
+    """Records releases in the scraper's completed ids, if it has any.
+
+    Only call it once every write of the batch succeeded: completed releases are never scraped again.
+    """
+    if scraper.completed is None:
+        return
+    scraper.completed.update(release.release_id for release in releases)
+    scraper.completed.save()
+
+
+def scrape_releases(p, scraper, users):
+    release_ids = p.fetch_ids_from_file(QUERY_PATH)
     logging.info(f"Processing {len(release_ids)} release IDs in batches of {BATCH_SIZE}.")
     for i in range(0, len(release_ids), BATCH_SIZE):
         batch_ids = release_ids[i : i + BATCH_SIZE]
         logging.info(f"Processing batch {i//BATCH_SIZE + 1}/{len(release_ids)//BATCH_SIZE + 1}.")
         try:
-            releases = scraper.run(batch_ids)
-            write_to_postgres(p, releases)
+            releases = scraper.run(batch_ids, fetch_listing_watermarks(p, batch_ids))
+            if write_to_postgres(p, releases, users):
+                mark_completed(scraper, releases)
+            else:
+                logging.warning(f"Batch {i//BATCH_SIZE + 1} wasn't fully written; its releases will be scraped again.")
         except Exception as e:
             logging.error(f"Error processing batch {i//BATCH_SIZE}: {e}")
 
+
+def scrape_frontier(p, scraper, users):
+    """Scrapes releases from the scrape frontier, most urgent first, until none are due."""
+    frontier = ScrapeFrontier(p)
+    batch_number = 0
+    while True:
+        if batch_number % FRONTIER_REFRESH_BATCHES == 0:
+            frontier.refresh()
+        batch_ids = frontier.next_batch(BATCH_SIZE)
+        if not batch_ids:
+            logging.info("No releases are due in the scrape frontier.")
+            break
+        batch_number += 1
+        logging.info(f"Processing frontier batch {batch_number} of {len(batch_ids)} releases.")
+        stored = []
+        try:
+            releases = scraper.run(batch_ids, fetch_listing_watermarks(p, batch_ids))
+            if write_to_postgres(p, releases, users):
+                stored = releases
+        except Exception as e:
+            logging.error(f"Error processing frontier batch {batch_number}: {e}")
+        # Releases that weren't stored, or had a page that couldn't be fetched (and so aren't in
+        # releases), are retried soon rather than after their interval. Raises if that can't be
+        # recorded, rather than claiming the same releases again forever.
+        frontier.mark_scraped(batch_ids, stored)
+
+
+def scrape_distributed(p, scraper, users):
+    """Scrapes frontier releases claimed with leases, so several nodes can share the work."""
+    frontier = ScrapeFrontier(p)
+    claimer = WorkClaimer(p, node_id=NODE_ID, lease_seconds=LEASE_SECONDS)
+    claimer.register()
+    batch_number = 0
+    # Refreshed before the first claim, then after every FRONTIER_REFRESH_BATCHES
+    # batches scraped (not while waiting); nodes skip it while another one refreshes.
+    batches_since_refresh = FRONTIER_REFRESH_BATCHES
+    while True:
+        if batches_since_refresh >= FRONTIER_REFRESH_BATCHES:
+            frontier.refresh()
+            batches_since_refresh = 0
+        batch_ids = claimer.claim(BATCH_SIZE)
+        if not batch_ids:
+            # Other nodes may still crash and leave leases to reclaim.
+            if claimer.outstanding():
+                logging.info(f"Nothing to claim, waiting {IDLE_WAIT_SECONDS}s for other nodes' leases.")
+                time.sleep(IDLE_WAIT_SECONDS)
+                continue
+            logging.info("No releases are due or leased, node is done.")
+            break
+        batch_number += 1
+        batches_since_refresh += 1
+        stored = []
+        with claimer.keep_alive(batch_ids):
+            try:
+                releases = scraper.run(batch_ids, fetch_listing_watermarks(p, batch_ids))
+                if write_to_postgres(p, releases, users):
+                    stored = releases
+            except Exception as e:
+                logging.error(f"Error processing claimed batch {batch_number}: {e}")
+        frontier.mark_scraped(batch_ids, stored)
+        claimer.release(batch_ids, completed=len(stored))
+
+
+def scrape_sellers(p, scraper, users):
+    """Walks the inventories of sellers already seen in release_sellers and stores their listings by release."""
+    usernames = p.fetch_ids_from_file(SELLERS_QUERY_PATH)
+    logging.info(f"Processing {len(usernames)} seller inventories in batches of {BATCH_SIZE}.")
+    for i in range(0, len(usernames), BATCH_SIZE):
+        batch_usernames = usernames[i : i + BATCH_SIZE]
+        logging.info(f"Processing seller batch {i//BATCH_SIZE + 1}/{len(usernames)//BATCH_SIZE + 1}.")
+        try:
+            watermarks = fetch_inventory_watermarks(p, users, batch_usernames)
+            releases = scraper.run_sellers(batch_usernames, watermarks)
+            insert_release_sellers(p, releases, users, known_only=True, inventories=True)
+            update_market_summary(p, releases)
+        except Exception as e:
+            logging.error(f"Error processing seller batch {i//BATCH_SIZE}: {e}")
+
+
+def main():
+    p = PostgresDataStore(DATABASE_URL, TABLE_NAME)
+    users = UserDirectory(p, cache_size=USER_CACHE_SIZE)
+    
+    # Initialize the Scraper object
+    scraper = Scraper(URL,
+                      max_workers=MAX_WORKERS,
+                      page_cache=setup_page_cache(),
+                      parse_workers=PARSE_WORKERS,
+                      listing_filters=LISTING_FILTERS,
+                      page_workers=PAGE_WORKERS,
+                      completed=setup_completed_ids(p))
+
+    with instrumented():
+        if SCRAPE_MODE == "sellers":
+            scrape_sellers(p, scraper, users)
+        elif SCRAPE_MODE == "frontier":
+            scrape_frontier(p, scraper, users)
+        elif SCRAPE_MODE == "distributed":
+            scrape_distributed(p, scraper, users)
+        else:
+            scrape_releases(p, scraper, users)
+        downsample_release_snapshots(p)
+    scraper.close()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,261 @@
+"""Loads several dumps at once under shared limits on bandwidth, CPU workers and database connections.
+
+Each dump is downloaded on a download thread (all of them together held to
+one bandwidth limit), then parsed and inserted by a pool of worker processes,
+whose inserts share a fixed number of database connection slots. The SQL
+normalization steps that depend on a dump run as soon as all of their input
+dumps are loaded, while the other dumps carry on. The status of every dump and
+step is written to a JSON file, so a rerun skips what already finished.
+"""
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from models.sinks.db import BaseDataStore
+from models.sinks.postgres import PostgresDataStore
+from utils.metrics import METRICS_PATH, PROFILE_PATH, instrumented, metrics, suffixed
+from utils.xml_handler import PARSERS, XMLDataHandler
+
+DUMP_URL_TEMPLATE = os.getenv(
+    "DUMP_URL_TEMPLATE",
+    "https://discogs-data-dumps.s3.us-west-2.amazonaws.com/data/{year}/discogs_{date}_{kind}s.xml.gz",
+)
+# SQL scripts and the dumps they need loaded first
+NORMALIZATION_STEPS = [
+    ("../db/artists.sql", {"artist"}),
+    ("../db/cleanup.sql", {"release"}),
+]
+
+# Columns of each dump's table, where the normalization steps need more than the JSONB records
+TABLE_COLUMNS = {
+    # db/artists.sql references artists(artist_id)
+    "artist": "artist_id INTEGER GENERATED ALWAYS AS ((data->>'id')::INTEGER) STORED PRIMARY KEY, data JSONB NOT NULL",
+}
+DEFAULT_TABLE_COLUMNS = "id SERIAL PRIMARY KEY, data JSONB NOT NULL"
+
+
+def dump_url(kind, date):
+    """URL of the monthly dump of kind for date (YYYYMMDD)."""
+    return DUMP_URL_TEMPLATE.format(year=date[:4], date=date, kind=kind)
+
+
+class TokenBucket:
+    """Holds a shared rate (e.g. bytes/sec across download threads) to rate, allowing bursts of capacity."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Going into debt books the tokens; later callers wait for it to be paid off too
+            self.tokens -= amount
+            wait_seconds = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait_seconds:
+            time.sleep(wait_seconds)
+
+
+class LimitedDataStore(BaseDataStore):
+    """Takes one of a shared number of database connection slots for each insert."""
+
+    def __init__(self, data_store, slots):
+        self.data_store = data_store
+        self.slots = slots
+
+    def connect(self):
+        self.data_store.connect()
+
+    def insert(self, records):
+        with self.slots:
+            self.data_store.insert(records)
+
+
+class DumpLoad:
+    """Status of one dump: pending, downloading, loading, loaded or failed."""
+
+    def __init__(self, kind, url, table_name, status="pending", records=None, error=None, finished=None):
+        self.kind = kind
+        self.url = url
+        self.table_name = table_name
+        self.status = status
+        self.records = records
+        self.error = error
+        self.finished = finished
+
+    def to_dict(self):
+        return {"url": self.url, "table_name": self.table_name, "status": self.status,
+                "records": self.records, "error": self.error, "finished": self.finished}
+
+
+# Set in each load worker process by _init_worker
+_db_slots = None
+
+
+def _init_worker(db_slots):
+    global _db_slots
+    _db_slots = db_slots
+
+
+def _load_dump(kind, url, destination_dir, database_url, table_name, keep_file, record_filter):
+    """Parses and inserts one dump in a worker process.
+
+    Worker processes have their own metrics registry, so each dump's metrics
+    and profile go to METRICS_PATH and PROFILE_PATH suffixed with the dump
+    type, e.g. metrics.release.prom. Workers are reused, hence the reset.
+    """
+    data_store = LimitedDataStore(PostgresDataStore(database_url, table_name), _db_slots)
+    handler = XMLDataHandler(url, destination_dir, data_store=data_store, parser_class=PARSERS[kind](),
+                             keep_file=keep_file, record_filter=record_filter)
+    metrics.reset()
+    with instrumented(suffixed(METRICS_PATH, kind), suffixed(PROFILE_PATH, kind)):
+        return handler.parse_xml()
+
+
+class LoadOrchestrator:
+    def __init__(self, dumps, database_url, destination_dir="./", download_workers=2, cpu_workers=2,
+                 db_connections=4, bandwidth=None, steps=NORMALIZATION_STEPS, status_path=None,
+                 keep_files=True, record_filter=None):
+        """dumps maps dump types (artist, label, master, release) to their URLs; bandwidth is in bytes/sec."""
+        self.database_url = database_url
+        self.destination_dir = destination_dir
+        self.download_workers = download_workers
+        self.cpu_workers = cpu_workers
+        self.db_connections = db_connections
+        self.bandwidth = TokenBucket(bandwidth) if bandwidth else None
+        self.status_path = status_path
+        self.keep_files = keep_files
+        self.record_filter = record_filter
+        self.status_lock = threading.Lock()
+        self.loads = {kind: DumpLoad(kind, url, f"{kind}s") for kind, url in dumps.items()}
+        # Steps needing a dump that isn't being loaded don't apply
+        self.steps = {path: {"inputs": set(inputs), "status": "pending"}
+                      for path, inputs in steps if set(inputs) <= set(dumps)}
+        self._resume()
+
+    def _resume(self):
+        """Keeps dumps loaded from the same URLs, and steps done, by a previous run."""
+        if not self.status_path or not os.path.exists(self.status_path):
+            return
+        with open(self.status_path) as f:
+            previous = json.load(f)
+        for kind, load in self.loads.items():
+            state = previous["dumps"].get(kind)
+            if state and state["status"] == "loaded" and state["url"] == load.url:
+                self.loads[kind] = DumpLoad(kind, **state)
+                logging.info(f"Skipping {kind} dump, already loaded from {load.url}")
+        for path, step in self.steps.items():
+            # A dump loaded again replaces its table, so the steps normalizing it run again too
+            reloaded = any(self.loads[kind].status != "loaded" for kind in step["inputs"])
+            if previous["steps"].get(path, {}).get("status") == "done" and not reloaded:
+                step["status"] = "done"
+
+    def run(self):
+        """Loads every pending dump and runs the normalization steps; returns the final status."""
+        context = multiprocessing.get_context("spawn")
+        db_slots = context.BoundedSemaphore(self.db_connections)
+        pending = [load for load in self.loads.values() if load.status != "loaded"]
+        for load in pending:
+            # Replaced rather than appended to, so reloading a dump doesn't duplicate the records of a partial load
+            PostgresDataStore(self.database_url, load.table_name).create_table(
+                TABLE_COLUMNS.get(load.kind, DEFAULT_TABLE_COLUMNS), replace=True)
+
+        futures = {}
+        with (
+            ThreadPoolExecutor(max_workers=self.download_workers, thread_name_prefix="Download") as downloads,
+            ProcessPoolExecutor(max_workers=self.cpu_workers, mp_context=context,
+                                initializer=_init_worker, initargs=(db_slots,)) as workers,
+            ThreadPoolExecutor(max_workers=self.db_connections, thread_name_prefix="Normalize") as step_runner,
+        ):
+            for load in pending:
+                self._set_status(load, "downloading")
+                futures[downloads.submit(self._download, load)] = ("download", load)
+            self._start_ready_steps(step_runner, db_slots, futures)
+
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, item = futures.pop(future)
+                    try:
+                        result, error = future.result(), None
+                    except Exception as e:
+                        result, error = None, e
+                    if stage == "download":
+                        if error:
+                            self._set_status(item, "failed", error=f"download failed: {error}")
+                        else:
+                            self._set_status(item, "loading")
+                            future = workers.submit(_load_dump, item.kind, item.url, self.destination_dir,
+                                                    self.database_url, item.table_name, self.keep_files,
+                                                    self.record_filter)
+                            futures[future] = ("load", item)
+                    elif stage == "load":
+                        if result is None:
+                            self._set_status(item, "failed", error=f"load failed: {error or 'see the log'}")
+                        else:
+                            self._set_status(item, "loaded", records=result)
+                    else:
+                        self._set_step_status(item, "done" if result else "failed")
+                self._start_ready_steps(step_runner, db_slots, futures)
+        return self.status()
+
+    def _download(self, load):
+        handler = XMLDataHandler(load.url, self.destination_dir, parser_class=PARSERS[load.kind](),
+                                 bandwidth=self.bandwidth)
+        handler.download_file()
+
+    def _start_ready_steps(self, step_runner, db_slots, futures):
+        for path, step in self.steps.items():
+            if step["status"] != "pending":
+                continue
+            statuses = {self.loads[kind].status for kind in step["inputs"]}
+            if "failed" in statuses:
+                self._set_step_status(path, "skipped")
+            elif statuses == {"loaded"}:
+                self._set_step_status(path, "running")
+                futures[step_runner.submit(self._run_step, path, db_slots)] = ("step", path)
+
+    def _run_step(self, path, db_slots):
+        with db_slots:
+            return PostgresDataStore(self.database_url, None).execute_file(path)
+
+    def _set_status(self, load, status, records=None, error=None):
+        load.status = status
+        if records is not None:
+            load.records = records
+        if error is not None:
+            load.error = str(error)
+        if status in ("loaded", "failed"):
+            load.finished = datetime.now(timezone.utc).isoformat()
+        logging.info(f"{load.kind} dump {status}" + (f": {error}" if error else ""))
+        self._write_status()
+
+    def _set_step_status(self, path, status):
+        self.steps[path]["status"] = status
+        logging.info(f"Normalization step {path} {status}")
+        self._write_status()
+
+    def status(self):
+        return {
+            "dumps": {kind: load.to_dict() for kind, load in self.loads.items()},
+            "steps": {path: {"inputs": sorted(step["inputs"]), "status": step["status"]}
+                      for path, step in self.steps.items()},
+        }
+
+    def _write_status(self):
+        if not self.status_path:
+            return
+        with self.status_lock:
+            tmp_path = f"{self.status_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.status(), f, indent=2)
+            os.replace(tmp_path, self.status_path)
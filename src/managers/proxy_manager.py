@@ -1,7 +1,6 @@
 import logging
 import requests
 from random import choice
-import threading
 
 class ProxyManager:
     def __init__(self, proxy_list_url):
@@ -20,7 +19,7 @@ class ProxyManager:
 
     def get_proxy(self):
         proxy = choice(self.proxies) if self.proxies else None
-        logging.debug(f"Selected proxy {proxy['http']} for thread: {threading.current_thread().name}")
+        logging.debug("Selected proxy %s", proxy['http'] if proxy else None)
         return proxy
 
     def replace_proxy(self, old_proxy):
@@ -29,7 +28,8 @@ class ProxyManager:
 
     def remove_proxy(self, proxy):
         if proxy in self.proxies:
-            self.proxies.remove(proxy)
+            # Swap in a new list rather than mutating it under threads picking from it in get_proxy()
+            self.proxies = [other for other in self.proxies if other != proxy]
             logging.debug(f"Removed proxy {proxy['http']} from the list.")
 
     def validate_proxy(self, proxy):
@@ -1,101 +1,190 @@
 import cloudscraper
-from threading import Lock, current_thread
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from threading import Lock
+import requests
 import time
 import logging
+import os
+
+# urllib3 connection pool sizes of each pooled session
+SESSION_POOL_CONNECTIONS = int(os.getenv("SESSION_POOL_CONNECTIONS", 10))
+SESSION_POOL_MAXSIZE = int(os.getenv("SESSION_POOL_MAXSIZE", 10))
+# Sessions unused for this long are closed; their challenge cookies are kept
+SESSION_IDLE_SECONDS = int(os.getenv("SESSION_IDLE_SECONDS", 300))
+# Page requested by warm_up() so each proxy's session solves the Cloudflare challenge up front
+SESSION_WARM_URL = os.getenv("SESSION_WARM_URL")
+
+
+def proxy_key(proxy):
+    """Proxies are {"http": url} dicts or plain url strings; either way the pool is keyed by the url."""
+    if not proxy:
+        return None
+    return proxy if isinstance(proxy, str) else proxy.get("http")
+
 
 class SessionManager:
-    def __init__(self, proxy_manager, rate_limit_per_minute=30):
+    """Pool of cloudscraper sessions, one per proxy and thread.
+
+    Every get_session() call rotates to a proxy picked by the ProxyManager and
+    hands out the calling thread's session for that proxy, so its open
+    connections are reused each time the proxy comes round again. A requests
+    Session isn't safe to share between threads, so threads don't share
+    them. What is shared per proxy is the rate limit (requests through a proxy
+    are spaced by it whichever thread makes them) and the solved Cloudflare
+    challenge cookies new sessions start from. Each thread closes its own
+    sessions once idle for idle_seconds, keeping their cookies for the proxy.
+    """
+
+    def __init__(self, proxy_manager, rate_limit_per_minute=30, pool_connections=SESSION_POOL_CONNECTIONS,
+                 pool_maxsize=SESSION_POOL_MAXSIZE, idle_seconds=SESSION_IDLE_SECONDS, warm_url=SESSION_WARM_URL):
         logging.info("Initializing SessionManager with rate limit per minute: %d", rate_limit_per_minute)
         self.proxy_manager = proxy_manager
         self.rate_limit_per_minute = rate_limit_per_minute
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.idle_seconds = idle_seconds
+        self.warm_url = warm_url
         self.sessions_lock = Lock()
-        self.thread_sessions = {}
-        self.proxy_failures = {} 
-        
+        # Per proxy: rate limit bookkeeping and challenge cookies, shared by all threads
+        self.sessions = {}
+        # Per thread: {proxy key: {'session', 'last_used'}}, only touched by the owning thread
+        self.local = threading.local()
+
     def get_session(self, use_proxy=True):
-        thread_id = current_thread().ident
+        proxy = self.proxy_manager.get_proxy() if use_proxy else None
         with self.sessions_lock:
-            if thread_id not in self.thread_sessions or not self._can_make_request(thread_id):
-                self._create_or_recycle_session(thread_id, use_proxy)
-            session_info = self.thread_sessions.get(thread_id, {})
-            return session_info['session'], session_info.get('proxy')
-        
-    def _create_or_recycle_session(self, thread_id, use_proxy):
-        # Check if a session exists and can be reused.
-        if thread_id in self.thread_sessions:
-            session_info = self.thread_sessions[thread_id]
-            # Check if proxy requirements have changed or session needs a new proxy.
-            if use_proxy:
-                new_proxy = self.proxy_manager.get_proxy()
-                # Update the session's proxy if a new one is obtained.
-                if new_proxy and (not session_info['proxy'] or session_info['proxy'] != new_proxy):
-                    session_info['session'].proxies = new_proxy
-                    session_info['proxy'] = new_proxy
-                    logging.info(f"Updated proxy for thread {thread_id} to {new_proxy['http']}.")
-            else:
-                # Clear the proxy if not using one anymore.
-                session_info['session'].proxies = {}
-                session_info['proxy'] = None
-            
-            # Reset the request count and update the last used timestamp.
-            session_info['last_used'] = time.time()
-            session_info['request_count'] = 0
-        else:
-            # Create a new session if one does not exist.
-            logging.debug(f"Creating new session for thread {thread_id}.")
-            session = cloudscraper.create_scraper()
-            proxy = self.proxy_manager.get_proxy() if use_proxy else None
-            if proxy:
-                session.proxies = proxy
-            self.thread_sessions[thread_id] = {
-                'session': session, 
-                'last_used': time.time(), 
-                'request_count': 0, 
-                'proxy': proxy
+            proxy_info = self._proxy_info(proxy)
+            wait = self._reserve_request(proxy_info)
+        self._evict_idle_sessions()
+        session = self._thread_session(proxy_key(proxy), proxy_info)
+        if wait > 0:
+            logging.debug("Rate limited on proxy %s, waiting %.2fs.", proxy_key(proxy), wait)
+            time.sleep(wait)
+        return session, proxy
+
+    def warm_up(self, max_workers=8):
+        """Solves every known proxy's challenge by requesting warm_url; sessions created later start from its cookies."""
+        if not self.warm_url:
+            return
+        proxies = list(self.proxy_manager.proxies)
+
+        def warm(proxy):
+            key = proxy_key(proxy)
+            with self.sessions_lock:
+                proxy_info = self._proxy_info(proxy)
+            session = self._thread_session(key, proxy_info)
+            try:
+                session.get(self.warm_url, timeout=30)
+            except Exception as e:
+                logging.debug(f"Failed to warm session through {key}: {e}")
+            self._close_session(key)
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="SessionWarmUp") as executor:
+            list(executor.map(warm, proxies))
+        logging.info(f"Warmed up {len(proxies)} sessions.")
+
+    def _proxy_info(self, proxy):
+        key = proxy_key(proxy)
+        proxy_info = self.sessions.get(key)
+        if proxy_info is None:
+            proxy_info = {
+                'proxy': proxy,
+                'last_used': 0.0,
+                'request_count': 0,
+                'cookies': requests.cookies.RequestsCookieJar(),
             }
-            logging.debug(f"New session created at {proxy['http']}.")
-
-        
-    def _can_make_request(self, identifier):
-        """Check if the session can make a request based on the rate limit."""
-        logging.debug("Checking if can make request for identifier: %s", identifier)
-        min_interval = self._get_min_interval()
-        session_info = self.thread_sessions.get(identifier, {})
-        elapsed_time = time.time() - session_info.get('last_used', 0)
-        return elapsed_time >= min_interval and session_info.get('request_count', 0) < self.rate_limit_per_minute
-
-    def _update_request_time(self, identifier):
-        if identifier in self.thread_sessions:
-            self.thread_sessions[identifier]['last_used'] = time.time()
-            self.thread_sessions[identifier]['request_count'] += 1
-        else:
-            logging.error(f"Session identifier {identifier} not found in thread_sessions.")
-                
+            self.sessions[key] = proxy_info
+        return proxy_info
+
+    def _thread_sessions(self):
+        if not hasattr(self.local, 'sessions'):
+            self.local.sessions = {}
+            self.local.last_eviction = time.time()
+        return self.local.sessions
+
+    def _thread_session(self, key, proxy_info):
+        sessions = self._thread_sessions()
+        entry = sessions.get(key)
+        if entry is None:
+            with self.sessions_lock:
+                cookies = proxy_info['cookies'].copy()
+            entry = sessions[key] = {'session': self._create_session(key, cookies), 'last_used': 0.0}
+        entry['last_used'] = time.time()
+        return entry['session']
+
+    def _create_session(self, key, cookies=None):
+        logging.debug(f"Creating new session for proxy {key}.")
+        session = cloudscraper.create_scraper()
+        if key:
+            session.proxies = {"http": key, "https": key}
+        # cloudscraper mounts its own TLS adapter for https, so resize the existing adapters' pools
+        for adapter in session.adapters.values():
+            adapter._pool_connections = self.pool_connections
+            adapter._pool_maxsize = self.pool_maxsize
+            adapter.init_poolmanager(self.pool_connections, self.pool_maxsize, block=adapter._pool_block)
+        # Challenge cookies are tied to the proxy's IP, so they stay valid for every session through it
+        if cookies:
+            session.cookies.update(cookies)
+        return session
+
+    def _reserve_request(self, proxy_info):
+        """Books the next request slot on a proxy and returns how long to wait for it."""
+        now = time.time()
+        start = now
+        if proxy_info['request_count']:
+            start = max(now, proxy_info['last_used'] + self._get_min_interval())
+        proxy_info['last_used'] = start
+        proxy_info['request_count'] += 1
+        return start - now
+
+    def back_off(self, proxy, seconds):
+        """Books no requests through proxy for the next seconds, e.g. after it was rate limited."""
+        with self.sessions_lock:
+            proxy_info = self._proxy_info(proxy)
+            proxy_info['last_used'] = max(proxy_info['last_used'], time.time() + seconds - self._get_min_interval())
+            proxy_info['request_count'] = max(proxy_info['request_count'], 1)
+
+    def _evict_idle_sessions(self):
+        """Closes the calling thread's sessions that it hasn't used for idle_seconds."""
+        sessions = self._thread_sessions()
+        now = time.time()
+        if now - self.local.last_eviction < self.idle_seconds:
+            return
+        self.local.last_eviction = now
+        for key, entry in list(sessions.items()):
+            if now - entry['last_used'] > self.idle_seconds:
+                self._close_session(key)
+                logging.debug(f"Evicted idle session for proxy {key}.")
+
+    def _close_session(self, key):
+        """Closes the calling thread's session for a proxy, keeping its cookies for the proxy's next sessions."""
+        entry = self._thread_sessions().pop(key, None)
+        if entry is None:
+            return
+        with self.sessions_lock:
+            proxy_info = self.sessions.get(key)
+            if proxy_info is not None:
+                proxy_info['cookies'].update(entry['session'].cookies)
+        entry['session'].close()
+
     def _get_min_interval(self):
         return 60.0 / self.rate_limit_per_minute
 
-    def _get_valid_proxy(self):
-        logging.debug("Attempting to get a valid proxy")
-        for _ in range(len(self.proxy_manager.proxies)):
-            proxy = self.proxy_manager.get_proxy()
-            if proxy and self.proxy_manager.validate_proxy(proxy):
-                logging.debug("Valid proxy found: %s", proxy)
-                return proxy['http']
-            self.proxy_manager.remove_proxy(proxy)
-            logging.debug("Removing invalid proxy: %s", proxy)
-        logging.warning("No valid proxy found.")
-        return None
+    def replace_proxy(self, proxy):
+        """Takes a banned or unreachable proxy out of the rotation and returns a session on another one.
 
-    def replace_proxy(self, identifier):
+        The calling thread's session for it is closed; other threads' sessions
+        for it go unused and are closed by their own thread once idle. The
+        last remaining proxy is kept.
+        """
+        key = proxy_key(proxy)
         with self.sessions_lock:
-            if identifier in self.thread_sessions:
-                old_proxy = self.thread_sessions[identifier]['proxy']
-                new_proxy = self._get_valid_proxy()
-                if new_proxy:
-                    self.thread_sessions[identifier]['proxy'] = {"http": new_proxy, "https": new_proxy}
-                    self.thread_sessions[identifier]['session'].proxies = {"http": new_proxy, "https": new_proxy}
-                    logging.info(f"Replaced proxy for {identifier} from {old_proxy} to {new_proxy}")
-                else:
-                    logging.warning(f"Could not find a valid proxy to replace for {identifier}.")
-            else:
-                logging.error(f"Tried to replace proxy for non-existent session identifier {identifier}.")
\ No newline at end of file
+            if proxy and key in self.sessions and len(self.proxy_manager.proxies) > 1:
+                del self.sessions[key]
+                self.proxy_manager.remove_proxy(proxy)
+                logging.info(f"Removed proxy {key} from the rotation.")
+        entry = self._thread_sessions().pop(key, None)
+        if entry is not None:
+            entry['session'].close()
+        return self.get_session()
@@ -1,30 +1,150 @@
 from urllib.parse import urlencode
 from bs4 import BeautifulSoup
 import logging
-from datetime import datetime
+import os
 import re
+import requests
+import sys
+import threading
+import time
+from utils import html_parser
+from models.records import Listing, ReleaseStats, RELEASE_STAT_FIELDS
+from utils.metrics import metrics
+from utils.parser_utils import safe_parse_int, safe_parse_float, safe_parse_date, safe_parse_price
+
+# "lxml" uses the fast extractors in utils/html_parser.py, "bs4" the BeautifulSoup parsers below.
+HTML_PARSER = os.getenv("HTML_PARSER", "lxml")
+# Overridable so the scraper can be pointed at a local stub server
+DISCOGS_BASE_URL = os.getenv("DISCOGS_BASE_URL", "https://www.discogs.com")
+# Rate limited (429) and server error responses are retried with exponential
+# backoff, or after the response's Retry-After header when it has one.
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", 5))
+RETRY_BACKOFF_SECONDS = float(os.getenv("RETRY_BACKOFF_SECONDS", 1.0))
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Cloudflare blocks the proxy's IP; the proxy is dropped and the request retried through another one
+BANNED_STATUS_CODES = {403}
+
+
+class FetchStats:
+    """Counts page requests, retries and failed fetches across all fetch threads.
+
+    The counts are also kept in the metrics registry as http_<name>.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.proxies_replaced = 0
+
+    def record(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+        metrics.inc(f"http_{name}")
+
+
+fetch_stats = FetchStats()
+
+
+def _retry_delay(response, attempt):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return RETRY_BACKOFF_SECONDS * 2 ** attempt
 
 
 class DiscogsPageBase:
-    def __init__(self, url, session_manager):
+    page_type = None
+
+    def __init__(self, url, session_manager, cache=None):
         self.url = url
         self.session_manager = session_manager
-        self.session, self.proxy = self.session_manager.get_session() 
+        self.cache = cache
+        if self.cache and self.cache.offline:
+            # Cache-only mode never touches the network, so don't tie up a session or proxy.
+            self.session, self.proxy = None, None
+        else:
+            self.session, self.proxy = self.session_manager.get_session()
     
     def fetch_page_content(self):
-        logging.debug(f"Fetching page content for {self.url}")
-        try:
-            response = self.session.get(self.url)
-            response.raise_for_status()
-            return response.text
-        except Exception as e:
-            logging.error(f"Failed to fetch page content for {self.url}: {e}")
+        if self.cache:
+            cached = self.cache.get(self.url, self.page_type)
+            if cached is not None:
+                logging.debug("Serving %s from page cache", self.url)
+                return cached
+            if self.cache.offline:
+                logging.warning(f"Page not in cache and cache is offline: {self.url}")
+                return None
+
+        logging.debug("Fetching page content for %s", self.url)
+        response = self._get_with_retries()
+        if response is None:
             return None
 
+        if self.cache:
+            self.cache.set(self.url, response.text, self.page_type)
+        return response.text
+
+    def _get_with_retries(self):
+        for attempt in range(MAX_RETRIES + 1):
+            response = None
+            fetch_stats.record("requests")
+            try:
+                with metrics.timer("http_request"):
+                    response = self.session.get(self.url)
+                if response.status_code not in RETRY_STATUS_CODES and response.status_code not in BANNED_STATUS_CODES:
+                    response.raise_for_status()
+                    return response
+                if response.status_code == 429:
+                    fetch_stats.record("rate_limited")
+                error = f"HTTP {response.status_code}"
+            except Exception as e:
+                if response is not None:
+                    # Not a retryable status, e.g. 404
+                    logging.error(f"Failed to fetch page content for {self.url}: {e}")
+                    fetch_stats.record("failures")
+                    return None
+                error = e
+            banned = response is not None and response.status_code in BANNED_STATUS_CODES
+            if banned or isinstance(error, requests.exceptions.ProxyError):
+                self._replace_proxy(error)
+            if attempt < MAX_RETRIES:
+                delay = _retry_delay(response, attempt)
+                if response is not None and response.status_code == 429:
+                    # The rate limit is per IP: retry through another proxy, which
+                    # only waits it out if the same proxy comes round again
+                    self._rotate_proxy(delay)
+                    delay = 0
+                logging.debug("Retrying %s in %.2fs after %s", self.url, delay, error)
+                fetch_stats.record("retries")
+                time.sleep(delay)
+        logging.error(f"Failed to fetch page content for {self.url} after {MAX_RETRIES + 1} attempts: {error}")
+        fetch_stats.record("failures")
+        return None
+
+    def _rotate_proxy(self, delay):
+        """Holds a rate limited proxy back for delay seconds and moves on to the next proxy."""
+        self.session_manager.back_off(self.proxy, delay)
+        self.session, self.proxy = self.session_manager.get_session()
+
+    def _replace_proxy(self, error):
+        """Drops a banned or unreachable proxy from the rotation and continues on another one."""
+        logging.warning(f"Replacing proxy {self.proxy} after {error} fetching {self.url}")
+        fetch_stats.record("proxies_replaced")
+        self.session, self.proxy = self.session_manager.replace_proxy(self.proxy)
+
+
 class DiscogsRelease(DiscogsPageBase):
-    def __init__(self, release_id, session_manager):
-        url = f'https://www.discogs.com/release/{release_id}'
-        super().__init__(url, session_manager)
+    page_type = 'release'
+
+    def __init__(self, release_id, session_manager, cache=None):
+        url = f'{DISCOGS_BASE_URL}/release/{release_id}'
+        super().__init__(url, session_manager, cache)
         self.release_id = release_id
         self.stats = None
     
@@ -33,17 +153,23 @@ class DiscogsRelease(DiscogsPageBase):
         if html_content:
             self.stats = self.parse_stats(html_content)
     
-    def parse_stats(self, html_content):
+    @staticmethod
+    def parse_stats(html_content):
+        if HTML_PARSER == 'lxml':
+            return html_parser.parse_release_stats(html_content)
         soup = BeautifulSoup(html_content, 'html.parser')
         stats_section = soup.find('section', id='release-stats')
         if not stats_section:
             logging.warning("Stats section not found in HTML content")
-            return {}
-        stats = {}
+            return ReleaseStats()
+        stats = ReleaseStats()
 
         for li in stats_section.find_all('li'):
             key_element = li.find('span')
             key = key_element.text.strip(':').strip()
+            field = RELEASE_STAT_FIELDS.get(key)
+            if field is None:
+                continue
             value_element = key_element.next_sibling
 
             if key == 'Last Sold':
@@ -52,23 +178,23 @@ class DiscogsRelease(DiscogsPageBase):
             elif key in ['Have', 'Want', 'Ratings']:
                 value = safe_parse_int(value_element.text.strip())
 
-            elif key in ['Avg Rating', 'Low', 'Median', 'High']:
+            else:
                 value_text = value_element.text.strip()
                 if key == 'Avg Rating':
                     value = safe_parse_float(value_text.split('/')[0].strip())
                 else:
                     value = safe_parse_price(value_text)[1]
-            else:
-                value = value_element.strip()
 
-            stats[key] = value
+            setattr(stats, field, value)
 
         return stats
     
 class DiscogsStatsPage(DiscogsPageBase):
-    def __init__(self, release_id, session_manager):
-        url = f'https://www.discogs.com/release/stats/{release_id}'
-        super().__init__(url, session_manager)
+    page_type = 'stats'
+
+    def __init__(self, release_id, session_manager, cache=None):
+        url = f'{DISCOGS_BASE_URL}/release/stats/{release_id}'
+        super().__init__(url, session_manager, cache)
         self.release_id = release_id
         self.stats = None
         self.members_have = [] 
@@ -77,30 +203,37 @@ class DiscogsStatsPage(DiscogsPageBase):
     def fetch_and_parse(self):
         html_content = self.fetch_page_content()
         if html_content:
-            self.parse_members_data(html_content)
+            self.members_have, self.members_want = self.parse_members_data(html_content)
     
-    def parse_members_data(self, html_content):
+    @staticmethod
+    def parse_members_data(html_content):
+        """Returns the (have, want) member username lists."""
+        if HTML_PARSER == 'lxml':
+            return html_parser.parse_members_data(html_content)
         soup = BeautifulSoup(html_content, 'html.parser')
         stats_groups = soup.find_all('div', class_='release_stats_group')
+        members_have, members_want = [], []
 
         if len(stats_groups) >= 2:
-            self.members_have = self.parse_members(stats_groups[1])
+            members_have = DiscogsStatsPage.parse_members(stats_groups[1])
             if len(stats_groups) >= 3:
-                self.members_want = self.parse_members(stats_groups[2])
+                members_want = DiscogsStatsPage.parse_members(stats_groups[2])
+        return members_have, members_want
 
-    def parse_members(self, stats_group):
+    @staticmethod
+    def parse_members(stats_group):
         members_list = stats_group.find('ul', role='list').find_all('li')
-        return [member.find('a').text.strip() for member in members_list]
+        # Interned, as the same users recur across many releases in a batch
+        return [sys.intern(member.find('a').text.strip()) for member in members_list]
     
 
 class DiscogsSellerPageBase(DiscogsPageBase):
-    def __init__(self, url, session_manager, query_params=None):
+    page_type = 'sellers'
+
+    def __init__(self, url, session_manager, query_params=None, cache=None):
         if query_params:
-            query_string = urlencode(query_params)
-            self.url = f"{url}?{query_string}"
-        else:
-            self.url = url
-        super().__init__(url, session_manager)
+            url = f"{url}?{urlencode(query_params)}"
+        super().__init__(url, session_manager, cache)
         self.items_for_sale = []
 
     def fetch_and_parse(self):
@@ -108,40 +241,53 @@ class DiscogsSellerPageBase(DiscogsPageBase):
         if html_content:
             self.items_for_sale = self.parse_items_for_sale(html_content)
 
-    def parse_items_for_sale(self, html_content):
+    @classmethod
+    def parse_items_for_sale(cls, html_content):
+        if HTML_PARSER == 'lxml':
+            return html_parser.parse_items_for_sale(html_content)
         soup = BeautifulSoup(html_content, 'html.parser')
         table = soup.find('table', class_='table_block mpitems push_down table_responsive')
         items = []
 
         for row in table.find('tbody').find_all('tr', class_='shortcut_navigable'):
-            item = self.parse_item_row(row)
+            item = cls.parse_item_row(row)
             items.append(item)
         
         return items
     
-    def parse_item_row(self, row):
-        item = {}
+    @staticmethod
+    def parse_item_row(row):
+        item = Listing()
         # Parsing image and community data
         item_picture_cell = row.find('td', class_='item_picture')
         image_tag = item_picture_cell.find('img')
-        item['image_url'] = image_tag['src'] if image_tag else None
+        item.image_url = image_tag['src'] if image_tag else None
+
+        # Release the listing belongs to, needed when parsing a seller's inventory
+        release_match = re.search(r'(\d+)', row.get('data-release-id', ''))
+        if not release_match:
+            release_link = item_picture_cell.find('a', href=re.compile(r'^/release/\d+'))
+            release_match = re.search(r'/release/(\d+)', release_link['href']) if release_link else None
+        item.release_id = int(release_match.group(1)) if release_match else None
 
         # Community ratings, have, want
         community_data = item_picture_cell.find('div', class_='community_data_text')
         if community_data:
             rating_strong = community_data.find('strong')
-            item['rating'] = float(rating_strong.text) if rating_strong else None
+            item.rating = float(rating_strong.text) if rating_strong else None
             community_results = community_data.find_all('div', class_='community_result')
-            item['have'] = int(community_results[0].find('span', class_='community_number').text.strip()) if len(community_results) > 0 else None
-            item['want'] = int(community_results[1].find('span', class_='community_number').text.strip()) if len(community_results) > 1 else None
+            item.have = int(community_results[0].find('span', class_='community_number').text.strip()) if len(community_results) > 0 else None
+            item.want = int(community_results[1].find('span', class_='community_number').text.strip()) if len(community_results) > 1 else None
 
         # Description, label, cat#, media condition, seller info, price
         item_description_cell = row.find('td', class_='item_description')
         title_link = item_description_cell.find('a', class_='item_description_title')
-        item['title'] = title_link.text if title_link else None
+        item.title = title_link.text if title_link else None
+        listing_match = re.search(r'/sell/item/(\d+)', title_link.get('href', '')) if title_link else None
+        item.listing_id = int(listing_match.group(1)) if listing_match else None
         label_and_cat = item_description_cell.find('p', class_='label_and_cat')
-        item['label'] = label_and_cat.find('a').text if label_and_cat and label_and_cat.find('a') else None
-        item['catno'] = label_and_cat.find('span', class_='item_catno').text if label_and_cat and label_and_cat.find('span', class_='item_catno') else None
+        item.label = label_and_cat.find('a').text if label_and_cat and label_and_cat.find('a') else None
+        item.catno = label_and_cat.find('span', class_='item_catno').text if label_and_cat and label_and_cat.find('span', class_='item_catno') else None
         
         # Extracting Media Condition
         # Find all spans with "mplabel" class within the item description cell
@@ -154,35 +300,35 @@ class DiscogsSellerPageBase(DiscogsPageBase):
 
             if media_condition_span:
                 media_condition = media_condition_span.text.strip().split('\n')[0]
-                item['media_condition'] = media_condition
+                item.media_condition = media_condition
 
                 # Attempting to extract description from a possible tooltip within the media condition span
                 description_span = media_condition_span.find('span', {'class': 'has-tooltip'})
                 if description_span:
                     description_text = description_span.get('title') or description_span.find('span', {'class': 'tooltip-inner'}).text.strip()
-                    item['media_condition_description'] = description_text
+                    item.media_condition_description = description_text
                 else:
-                    item['media_condition_description'] = None
+                    item.media_condition_description = None
             else:
-                item['media_condition'] = None
-                item['media_condition_description'] = None
+                item.media_condition = None
+                item.media_condition_description = None
         else:
-            item['media_condition'] = None
-            item['media_condition_description'] = None
+            item.media_condition = None
+            item.media_condition_description = None
 
         # Seller info
         seller_info_cell = row.find('td', class_='seller_info')
         seller_link = seller_info_cell.find('a')
-        item['seller'] = seller_link.text if seller_link else None
+        item.seller = sys.intern(seller_link.text) if seller_link else None
         seller_rating_span = seller_info_cell.find('span', class_='star_rating')
         if seller_rating_span:
             rating_match = re.search(r'(\d+(\.\d+)?)', seller_rating_span['alt'])
-            item['seller_rating'] = float(rating_match.group(1)) if rating_match else None
+            item.seller_rating = float(rating_match.group(1)) if rating_match else None
         else:
-            item['seller_rating'] = None
+            item.seller_rating = None
         
         ships_from_span = seller_info_cell.find('span', text='Ships From:')
-        item['ships_from'] = ships_from_span.next_sibling.strip() if ships_from_span and ships_from_span.next_sibling else None
+        item.ships_from = ships_from_span.next_sibling.strip() if ships_from_span and ships_from_span.next_sibling else None
 
 
         # Price
@@ -190,57 +336,23 @@ class DiscogsSellerPageBase(DiscogsPageBase):
         price_span = price_cell.find('span', class_='price')
         if price_span:
             price_text = price_span.text.strip()
-            item['currency'], item['price'] = safe_parse_price(price_text)
+            item.currency, item.price = safe_parse_price(price_text)
         else:
-            item['price'] = None
-            item['currency'] = None
+            item.price = None
+            item.currency = None
             
         return item
     
 class DiscogsSellerPage(DiscogsSellerPageBase):
-    def __init__(self, username, session_manager, query_params=None):
-        url = f"https://www.discogs.com/seller/{username}/profile"
-        super().__init__(url, session_manager, query_params)
+    def __init__(self, username, session_manager, query_params=None, cache=None):
+        url = f"{DISCOGS_BASE_URL}/seller/{username}/profile"
+        super().__init__(url, session_manager, query_params, cache)
         self.username = username
         self.stats = None
 
 class DiscogsSellerPageRelease(DiscogsSellerPageBase):
-    def __init__(self, release_id, session_manager, query_params=None):
-        url = f"https://www.discogs.com/sell/release/{release_id}"
-        super().__init__(url, session_manager, query_params)
+    def __init__(self, release_id, session_manager, query_params=None, cache=None):
+        url = f"{DISCOGS_BASE_URL}/sell/release/{release_id}"
+        super().__init__(url, session_manager, query_params, cache)
         self.release_id = release_id
         self.stats = None
-        
-        
-def safe_parse_int(value_str):
-    """Safely parses integers, accounting for '--' or empty strings."""
-    try:
-        return int(value_str.replace(',', '')) if value_str.strip() and value_str != '--' else None
-    except ValueError:
-        return None
-
-def safe_parse_float(value_str):
-    """Safely parses floats, accounting for '--' or empty strings."""
-    try:
-        return float(value_str) if value_str.strip() and value_str != '--' else None
-    except ValueError:
-        return None
-
-def safe_parse_date(date_str):
-    """Safely parses dates, accounting for 'Never'."""
-    try:
-        return datetime.strptime(date_str, '%b %d, %Y').date() if date_str.strip().lower() != 'never' else None
-    except ValueError:
-        return None
-
-def safe_parse_price(price_text):
-    """Safely parses price text to extract currency and value, handling edge cases."""
-    match = re.match(r'([^\d]*)(\d+[\.,]?\d*)', price_text.replace(',', '.'))
-    if match:
-        currency = match.group(1).strip() if match.group(1) else None
-        try:
-            price = float(match.group(2)) if match.group(2) else None
-        except ValueError:
-            price = None
-        return currency, price
-    return None, None
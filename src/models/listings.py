@@ -0,0 +1,103 @@
+from psycopg2.extras import execute_values
+from models.records import Listing
+
+# Listing fields in the column order of release_sellers; seller is stored as seller_id
+COLUMNS = tuple("seller_id" if name == "seller" else name for name in Listing.__slots__)
+KEY = ("release_id", "listing_id")
+# Releases listings may refer to (release_sellers.release_id references it)
+RELEASES_TABLE = "electronic_releases"
+SELLER_ID = COLUMNS.index("seller_id")
+
+
+class ListingStore:
+    """Writes marketplace listings to release_sellers, one row per release and listing id.
+
+    A listing scraped again (a re-scrape, or the same listing found through a
+    seller's inventory) updates its row, so price changes are kept and a
+    seller's second copy of a release is stored next to the first. See
+    db/listings.sql for the key. Every write stamps the listings' last_seen,
+    and releases whose listings were all fetched get their full fetch time
+    recorded, which retires the listings not seen in it (db/active_listings.sql).
+    """
+
+    def __init__(self, data_store, users):
+        self.data_store = data_store
+        self.users = users
+
+    def rows(self, releases):
+        """release_sellers rows of the listings of releases, each listing id once."""
+        seller_ids = self.users.ids(listing.seller for release in releases for listing in release.sellers)
+        rows = {}
+        for release in releases:
+            for listing in release.sellers:
+                row = (release.release_id, *(
+                    seller_ids.get(listing.seller) if name == "seller" else getattr(listing, name)
+                    for name in Listing.__slots__[1:]
+                ))
+                # A listing can show up on two pages if new ones were listed in between.
+                key = (release.release_id, listing.listing_id) if listing.listing_id is not None else len(rows)
+                rows[key] = row
+        return list(rows.values())
+
+    def inventory_watermarks(self, seller_ids):
+        """Returns {seller_id: highest listing id} seen by earlier inventory crawls of the sellers.
+
+        See db/seller_inventories.sql; sellers never crawled are missing.
+        """
+        with self.data_store.transaction() as cursor:
+            cursor.execute(
+                "SELECT seller_id, listing_id FROM seller_inventory_watermarks WHERE seller_id = ANY(%s)",
+                (list(seller_ids),),
+            )
+            return dict(cursor.fetchall())
+
+    def write(self, releases, known_only=False, inventories=False):
+        """Upserts the listings of releases in one transaction; returns the number of rows written.
+
+        With known_only, listings of releases missing from RELEASES_TABLE are
+        skipped: seller inventories span releases that were never loaded, and
+        the foreign key would reject the whole batch. With inventories, the
+        listings come from seller inventory crawls, and each seller's
+        inventory watermark moves up to the newest listing crawled, skipped
+        ones included. Raises if the write fails, in which case nothing was
+        stored.
+        """
+        rows = self.rows(releases)
+        # Also those without any listing left: their stored listings are all gone
+        complete = [(release.release_id,) for release in releases if release.listings_complete]
+        if not rows and not complete:
+            return 0
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in COLUMNS if column not in KEY)
+        with self.data_store.transaction() as cursor:
+            if inventories:
+                self._write_inventory_watermarks(cursor, rows)
+            if known_only:
+                cursor.execute(f"SELECT id FROM {RELEASES_TABLE} WHERE id = ANY(%s)", (list({row[0] for row in rows}),))
+                known = {release_id for release_id, in cursor.fetchall()}
+                rows = [row for row in rows if row[0] in known]
+            if rows:
+                execute_values(cursor, f"""
+                    INSERT INTO release_sellers ({", ".join(COLUMNS)}) VALUES %s
+                    ON CONFLICT ({", ".join(KEY)}) DO UPDATE SET {updates}, last_seen = now()
+                """, rows, page_size=100)
+            if complete:
+                # now() is the transaction's start, so the listings just written count as seen in this fetch
+                execute_values(cursor, """
+                    INSERT INTO release_listing_fetches (release_id, full_fetch_time) VALUES %s
+                    ON CONFLICT (release_id) DO UPDATE SET full_fetch_time = EXCLUDED.full_fetch_time
+                """, complete, template="(%s, now())", page_size=100)
+        return len(rows)
+
+    def _write_inventory_watermarks(self, cursor, rows):
+        watermarks = {}
+        for row in rows:
+            seller_id, listing_id = row[SELLER_ID], row[-1]
+            if seller_id is not None and listing_id is not None:
+                watermarks[seller_id] = max(listing_id, watermarks.get(seller_id, listing_id))
+        if watermarks:
+            execute_values(cursor, """
+                INSERT INTO seller_inventory_watermarks (seller_id, listing_id) VALUES %s
+                ON CONFLICT (seller_id) DO UPDATE SET
+                    listing_id = GREATEST(seller_inventory_watermarks.listing_id, EXCLUDED.listing_id),
+                    crawled_time = CURRENT_TIMESTAMP
+            """, list(watermarks.items()), page_size=100)
@@ -0,0 +1,86 @@
+from collections import Counter, defaultdict
+import statistics
+from psycopg2.extras import Json, execute_values
+
+
+def summarize_listings(listings):
+    """Market summary rows of listings given as (release_id, currency, price, media_condition, seller) tuples.
+
+    Returns one (release_id, currency, listing_count, seller_count, min_price,
+    median_price, max_price, conditions) row per release and currency, in the
+    column order of release_market_summary; conditions counts the listings
+    per media condition. Listings without a price are left out.
+    """
+    groups = defaultdict(list)
+    for release_id, currency, price, media_condition, seller in listings:
+        if currency is not None and price is not None:
+            groups[release_id, currency].append((price, media_condition, seller))
+
+    rows = []
+    for (release_id, currency), group in groups.items():
+        prices = sorted(price for price, _, _ in group)
+        sellers = {seller for _, _, seller in group if seller is not None}
+        conditions = Counter(media_condition for _, media_condition, _ in group if media_condition is not None)
+        rows.append((release_id, currency, len(group), len(sellers),
+                     prices[0], statistics.median(prices), prices[-1], dict(conditions)))
+    return rows
+
+
+class MarketSummaryStore:
+    """Keeps release_market_summary up to date with the listings still for sale in release_sellers.
+
+    Each write recomputes the summaries of the releases just scraped from
+    their active listings (active_release_sellers, see
+    db/active_listings.sql), found through the release_id index, so dashboards
+    can read one row per release and currency instead of aggregating every
+    listing. (Incremental scrapes only parse the new listings of a release,
+    and a median can't be updated from those alone.)
+    """
+
+    def __init__(self, data_store):
+        self.data_store = data_store
+
+    def write(self, release_ids):
+        """Recomputes the market summaries of release_ids; returns the number of summary rows written.
+
+        The releases' previous summaries are replaced, so currencies a release
+        no longer has listings in are dropped. Raises if it fails, in which
+        case no summary was written.
+        """
+        release_ids = list(release_ids)
+        if not release_ids:
+            return 0
+        with self.data_store.transaction() as cursor:
+            cursor.execute(
+                "SELECT release_id, currency, price, media_condition, seller_id FROM active_release_sellers WHERE release_id = ANY(%s)",
+                (release_ids,),
+            )
+            rows = [(*row[:-1], Json(row[-1])) for row in summarize_listings(cursor.fetchall())]
+            cursor.execute("DELETE FROM release_market_summary WHERE release_id = ANY(%s)", (release_ids,))
+            if rows:
+                execute_values(cursor, """
+                    INSERT INTO release_market_summary (
+                        release_id, currency, listing_count, seller_count, min_price, median_price, max_price, conditions
+                    ) VALUES %s
+                    ON CONFLICT (release_id, currency) DO UPDATE SET
+                        listing_count = EXCLUDED.listing_count,
+                        seller_count = EXCLUDED.seller_count,
+                        min_price = EXCLUDED.min_price,
+                        median_price = EXCLUDED.median_price,
+                        max_price = EXCLUDED.max_price,
+                        conditions = EXCLUDED.conditions,
+                        updated_time = CURRENT_TIMESTAMP
+                """, rows)
+        return len(rows)
+
+    def summaries(self, release_id):
+        """{currency: summary dict} of a release, as stored."""
+        rows = self.data_store.fetch_all("""
+            SELECT currency, listing_count, seller_count, min_price, median_price, max_price, conditions
+            FROM release_market_summary WHERE release_id = %s
+        """, (release_id,))
+        return {
+            currency.strip(): {"listing_count": listing_count, "seller_count": seller_count, "min_price": min_price,
+                               "median_price": median_price, "max_price": max_price, "conditions": conditions}
+            for currency, listing_count, seller_count, min_price, median_price, max_price, conditions in rows
+        }
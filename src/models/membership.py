@@ -0,0 +1,96 @@
+from psycopg2.extras import execute_values
+
+MEMBERSHIP_KINDS = ("want", "have")
+
+
+def diff_members(previous, current):
+    """Returns the (added, removed) members going from the previous to the current member set."""
+    current = set(current)
+    return current - previous, previous - current
+
+
+class MembershipStore:
+    """Stores release want/have lists as deltas between scrapes.
+
+    release_wants and release_haves keep the current members of each release,
+    while release_membership_events records every addition and removal with a
+    timestamp, so past member sets can be rebuilt. Members are stored by the
+    user ids handed out by a UserDirectory.
+    """
+
+    def __init__(self, data_store, users):
+        self.data_store = data_store
+        self.users = users
+
+    def current_members(self, release_ids, kind):
+        """Returns {release_id: set of user ids} for the current members of each release."""
+        with self.data_store.transaction() as cursor:
+            return self._current_members(cursor, release_ids, kind)
+
+    def _current_members(self, cursor, release_ids, kind):
+        cursor.execute(
+            f"SELECT release_id, user_id FROM release_{kind}s WHERE release_id = ANY(%s)",
+            (list(release_ids),),
+        )
+        members = {release_id: set() for release_id in release_ids}
+        for release_id, user_id in cursor.fetchall():
+            members[release_id].add(user_id)
+        return members
+
+    def members_as_of(self, release_id, kind, when):
+        """Rebuilds the member usernames of a release at a point in time from its events."""
+        rows = self.data_store.fetch_all("""
+            SELECT u.username, e.added
+            FROM (
+                SELECT DISTINCT ON (user_id) user_id, added
+                FROM release_membership_events
+                WHERE release_id = %s AND kind = %s AND event_time <= %s
+                ORDER BY user_id, event_time DESC
+            ) e
+            JOIN users u ON u.user_id = e.user_id
+        """, (release_id, kind, when))
+        return {username for username, added in rows if added}
+
+    def write(self, releases, kind):
+        """Writes only the members added or removed since the last scrape of each release.
+
+        The current members are read and the events, additions and removals
+        written in one transaction, so the event log and the member tables
+        can't diverge. Raises if it fails, in which case nothing was written.
+        """
+        # Releases whose stats page couldn't be fetched have no member list and are left alone.
+        scraped = {
+            release.release_id: getattr(release.stats, kind)
+            for release in releases
+            if release.stats is not None and getattr(release.stats, kind) is not None
+        }
+        if not scraped:
+            return 0, 0
+        user_ids = self.users.ids(username for members in scraped.values() for username in members)
+
+        table_name = f"release_{kind}s"
+        with self.data_store.transaction() as cursor:
+            previous = self._current_members(cursor, scraped, kind)
+            events, added_rows, removed_rows = [], [], []
+            for release_id, members in scraped.items():
+                members = {user_ids[username] for username in members}
+                added, removed = diff_members(previous[release_id], members)
+                events.extend((release_id, kind, user_id, True) for user_id in added)
+                events.extend((release_id, kind, user_id, False) for user_id in removed)
+                added_rows.extend((release_id, user_id) for user_id in added)
+                removed_rows.extend((release_id, user_id) for user_id in removed)
+
+            if events:
+                execute_values(
+                    cursor, "INSERT INTO release_membership_events (release_id, kind, user_id, added) VALUES %s", events
+                )
+            if added_rows:
+                execute_values(
+                    cursor, f"INSERT INTO {table_name} (release_id, user_id) VALUES %s ON CONFLICT DO NOTHING", added_rows
+                )
+            if removed_rows:
+                execute_values(cursor, f"""
+                    DELETE FROM {table_name} t USING (VALUES %s) AS v (release_id, user_id)
+                    WHERE t.release_id = v.release_id AND t.user_id = v.user_id
+                """, removed_rows)
+        return len(added_rows), len(removed_rows)
@@ -0,0 +1,75 @@
+class Record:
+    """Base for the compact records the scraper passes around instead of dicts.
+
+    Subclasses only list their fields in __slots__, so instances carry no
+    per-object __dict__. Fields not given to the constructor are None.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.pop(name, None))
+        if fields:
+            raise TypeError(f"{type(self).__name__} has no fields {', '.join(fields)}")
+
+    def as_tuple(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.as_tuple() == other.as_tuple()
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class Listing(Record):
+    """One marketplace listing, in the column order of release_sellers."""
+
+    __slots__ = (
+        "release_id", "image_url", "rating", "have", "want", "title", "label", "catno",
+        "media_condition", "media_condition_description", "seller", "seller_rating",
+        "ships_from", "currency", "price", "listing_id",
+    )
+
+
+class ReleaseStats(Record):
+    """Statistics section of a release page, in the column order of release_details."""
+
+    __slots__ = ("have", "want", "avg_rating", "ratings", "last_sold", "low", "median", "high")
+
+
+# Labels of the release page statistics and the ReleaseStats fields they fill
+RELEASE_STAT_FIELDS = {
+    "Have": "have",
+    "Want": "want",
+    "Avg Rating": "avg_rating",
+    "Ratings": "ratings",
+    "Last Sold": "last_sold",
+    "Low": "low",
+    "Median": "median",
+    "High": "high",
+}
+
+
+class Members(Record):
+    """Usernames that have and want a release; None when the stats page couldn't be fetched."""
+
+    __slots__ = ("have", "want")
+
+
+class ReleaseResult(Record):
+    """Everything scraped for one release: page statistics, members and marketplace listings.
+
+    sellers only holds the listings newer than the watermark, while
+    listing_count is the release's total number of listings on the marketplace.
+    listings_complete is True when sellers holds every listing of the release
+    (no watermark, and every page fetched), so stored listings missing from
+    it are no longer for sale.
+    """
+
+    __slots__ = ("release_id", "release", "stats", "sellers", "listing_count", "listings_complete")
@@ -3,6 +3,7 @@ import psycopg2
 from psycopg2.extras import Json, execute_values
 from psycopg2 import OperationalError
 from .db import BaseDataStore
+from utils.metrics import metrics
 import logging 
 
 class PostgresDataStore(BaseDataStore):
@@ -48,15 +49,57 @@ class PostgresDataStore(BaseDataStore):
             finally:
                 cursor.close()
 
+    @contextmanager
+    def transaction(self):
+        """Cursor of one transaction, committed when the block ends.
+
+        Unlike the other methods, errors roll the transaction back and are
+        raised, so callers writing several related statements know whether
+        they were stored.
+        """
+        conn = psycopg2.connect(self.database_url)
+        try:
+            with conn, conn.cursor() as cursor:
+                yield cursor
+        finally:
+            conn.close()
+
     def insert(self, records):
-        """Inserts a batch of data into the specified table."""
+        """Inserts a batch of data into the specified table; raises if it fails, so loads don't skip batches silently."""
+        with self.transaction() as cursor:
+            with metrics.timer("serialize"):
+                args_str = ",".join(cursor.mogrify("(%s)", (Json(data),)).decode("utf-8") for data in records)
+            cursor.execute(f"INSERT INTO {self.table_name} (data) VALUES " + args_str)
+        logging.info(f"Inserted {len(records)} records into {self.table_name}.")
+
+    def create_table(self, columns="id SERIAL PRIMARY KEY, data JSONB NOT NULL", replace=False):
+        """Creates the table of JSONB records if it doesn't exist yet, or with replace, drops and recreates it."""
         try:
             with self.get_db_cursor(commit=True) as cursor:
-                args_str = ",".join(cursor.mogrify("(%s)", (Json(data),)).decode("utf-8") for data in records)
-                cursor.execute(f"INSERT INTO {self.table_name} (data) VALUES " + args_str)
-                logging.info(f"Inserted {len(records)} records into {self.table_name}.")
+                if replace:
+                    # CASCADE drops the foreign keys of tables normalized from it, not their rows
+                    cursor.execute(f"DROP TABLE IF EXISTS {self.table_name} CASCADE")
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.table_name} ({columns})")
         except Exception as e:
-            logging.error(f"Failed to insert records: {e}")
+            logging.error(f"Failed to create table {self.table_name}: {e}")
+
+    def execute_file(self, file_path):
+        """Runs the SQL script at file_path in one transaction; returns whether it succeeded."""
+        try:
+            with open(file_path, 'r') as file:
+                script = file.read()
+            # Its own connection: get_db_connection logs and swallows errors, which would hide a failed script
+            conn = psycopg2.connect(self.database_url)
+            try:
+                with conn, conn.cursor() as cursor:
+                    cursor.execute(script)
+            finally:
+                conn.close()
+            logging.info(f"Executed {file_path}")
+            return True
+        except Exception as e:
+            logging.error(f"Failed to execute {file_path}: {e}")
+            return False
 
     def fetch_ids(self, query):
         """Fetches a list of IDs based on the provided query."""
@@ -71,6 +114,18 @@ class PostgresDataStore(BaseDataStore):
             logging.error(f"Failed to fetch IDs: {e}")
             return []
 
+    def fetch_all(self, query, params=None, commit=False):
+        """Runs a query and returns all resulting rows, committing if it modifies data."""
+        try:
+            with self.get_db_cursor(commit=commit) as cursor:
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+            logging.info(f"Fetched {len(rows)} rows.")
+            return rows
+        except Exception as e:
+            logging.error(f"Failed to fetch rows: {e}")
+            return []
+
     def fetch_ids_from_file(self, file_path):
         """Runs a SQL query from a provided file path."""
         try:
@@ -1,6 +1,7 @@
 import redis
 import json
 from .db import BaseDataStore
+from utils.metrics import metrics
 
 class RedisDataStore(BaseDataStore):
     def __init__(self, host="localhost", port=6379, db=0):
@@ -15,9 +16,9 @@ class RedisDataStore(BaseDataStore):
     def insert(self, records):
         if not self.connection:
             self.connect()
+        with metrics.timer("serialize"):
+            values = {f"release:{record['id']}": json.dumps(record) for record in records}
         with self.connection.pipeline() as pipe:
-            for record in records:
-                key = f"release:{record['id']}"
-                value = json.dumps(record)
+            for key, value in values.items():
                 pipe.set(key, value)
             pipe.execute()
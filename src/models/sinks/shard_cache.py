@@ -0,0 +1,137 @@
+"""Cache of parsed dump records, so sinks can be reloaded without parsing the XML again.
+
+ShardedFileStore is a data store writing each inserted batch as one gzip
+member of newline-delimited JSON, spreading batches round-robin over a fixed
+number of shard files. finish() writes a manifest marking the cache complete.
+ShardReader reads the shards back and replays them into any data store, one
+process per shard, so reloads scale across cores.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import zlib
+from .db import BaseDataStore
+
+PARSE_CACHE_SHARDS = int(os.getenv("PARSE_CACHE_SHARDS", 8))
+# Fast compression: the cache is rewritten whenever a dump is reparsed
+PARSE_CACHE_COMPRESSLEVEL = int(os.getenv("PARSE_CACHE_COMPRESSLEVEL", 1))
+MANIFEST = "manifest.json"
+
+
+def shard_path(directory, shard):
+    return os.path.join(directory, f"part-{shard:05d}.ndjson.gz")
+
+
+class ShardedFileStore(BaseDataStore):
+    def __init__(self, directory, shards=PARSE_CACHE_SHARDS, compresslevel=PARSE_CACHE_COMPRESSLEVEL):
+        self.directory = directory
+        self.shards = shards
+        self.compresslevel = compresslevel
+        self.batches = 0
+        self.counts = [0] * shards
+
+    def connect(self):
+        """Starts an empty cache, removing any earlier one in the directory."""
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name == MANIFEST or name.endswith(".ndjson.gz"):
+                os.remove(os.path.join(self.directory, name))
+        self.batches = 0
+        self.counts = [0] * self.shards
+
+    def insert(self, records):
+        if not self.batches:
+            self.connect()
+        shard = self.batches % self.shards
+        lines = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, 31)
+        with open(shard_path(self.directory, shard), "ab") as f:
+            f.write(compressor.compress(lines.encode()) + compressor.flush())
+        self.batches += 1
+        self.counts[shard] += len(records)
+
+    def finish(self, **info):
+        """Marks the cache complete; info (e.g. the dump's URL) is kept in the manifest."""
+        if not self.batches:
+            self.connect()
+        manifest = dict(info, shards=[
+            {"path": os.path.basename(shard_path(self.directory, shard)), "records": count}
+            for shard, count in enumerate(self.counts) if count
+        ])
+        tmp_path = os.path.join(self.directory, f"{MANIFEST}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.directory, MANIFEST))
+        logging.info(f"Cached {sum(self.counts)} records in {len(manifest['shards'])} shards in {self.directory}")
+
+
+class TeeDataStore(BaseDataStore):
+    """Inserts every batch into each of several data stores, e.g. a database and a ShardedFileStore."""
+
+    def __init__(self, *data_stores):
+        self.data_stores = data_stores
+
+    def connect(self):
+        for data_store in self.data_stores:
+            data_store.connect()
+
+    def insert(self, records):
+        for data_store in self.data_stores:
+            data_store.insert(records)
+
+
+def _replay_shard(path, data_store_factory, batch_size):
+    data_store = data_store_factory()
+    count = 0
+    for batch in ShardReader.read_shard(path, batch_size):
+        data_store.insert(batch)
+        count += len(batch)
+    return count
+
+
+class ShardReader:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.paths = [os.path.join(directory, shard["path"]) for shard in self.manifest["shards"]]
+        self.records = sum(shard["records"] for shard in self.manifest["shards"])
+
+    @staticmethod
+    def complete(directory):
+        """Whether directory holds a finished cache."""
+        return os.path.exists(os.path.join(directory, MANIFEST))
+
+    @staticmethod
+    def read_shard(path, batch_size=10000):
+        """Yields the records of one shard in batches."""
+        batch = []
+        with gzip.open(path, "rb") as f:
+            for line in f:
+                batch.append(json.loads(line))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def __iter__(self):
+        for path in self.paths:
+            for batch in self.read_shard(path):
+                yield from batch
+
+    def replay(self, data_store_factory, workers=None, batch_size=10000):
+        """Inserts every cached record into data stores made by data_store_factory, one per shard.
+
+        Shards are replayed in parallel by up to workers processes (one per
+        shard by default); data_store_factory must be picklable, e.g. a
+        functools.partial of a data store class. Returns the number of records.
+        """
+        workers = min(workers or len(self.paths), len(self.paths)) or 1
+        logging.info(f"Replaying {self.records} records from {len(self.paths)} shards with {workers} workers")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(_replay_shard, path, data_store_factory, batch_size) for path in self.paths]
+            return sum(future.result() for future in futures)
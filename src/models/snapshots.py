@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta, timezone
+import os
+from psycopg2.extras import execute_values
+from models.records import ReleaseStats
+
+# Snapshots older than these many days are thinned out to the last one of each
+# day, then of each week, so history costs about the same however often releases are scraped
+SNAPSHOT_DAILY_AFTER_DAYS = int(os.getenv("SNAPSHOT_DAILY_AFTER_DAYS", 30))
+SNAPSHOT_WEEKLY_AFTER_DAYS = int(os.getenv("SNAPSHOT_WEEKLY_AFTER_DAYS", 365))
+COLUMNS = ", ".join(ReleaseStats.__slots__)
+
+
+class ReleaseDetailsStore:
+    """Stores release page statistics as the latest values plus a history of changes.
+
+    release_details keeps the latest statistics of each release, and
+    release_detail_snapshots (see db/snapshots.sql) gets a timestamped copy
+    whenever a scrape finds them changed. Scrapes that find nothing new write
+    nothing, and downsample() keeps only the last snapshot per day or week
+    of old data.
+    """
+
+    def __init__(self, data_store):
+        self.data_store = data_store
+        self.partitions = set()
+
+    def current(self, release_ids):
+        """Returns {release_id: ReleaseStats} of the stored statistics of each release."""
+        with self.data_store.transaction() as cursor:
+            return self._current(cursor, release_ids)
+
+    def _current(self, cursor, release_ids):
+        cursor.execute(
+            f"SELECT release_id, {COLUMNS} FROM release_details WHERE release_id = ANY(%s)",
+            (list(release_ids),),
+        )
+        return {release_id: ReleaseStats(**dict(zip(ReleaseStats.__slots__, values)))
+                for release_id, *values in cursor.fetchall()}
+
+    def write(self, releases, now=None):
+        """Writes the statistics that changed since the last scrape of each release; returns how many did.
+
+        The comparison, the snapshots and the release_details update are one
+        transaction, so the latest values never move on without their
+        snapshot. Raises if the write fails, in which case nothing was stored.
+        """
+        # Releases whose page couldn't be fetched have no statistics and keep their stored ones.
+        scraped = {release.release_id: release.release for release in releases if release.release is not None}
+        if not scraped:
+            return 0
+        now = now or datetime.now(timezone.utc)
+        month = (now.astimezone(timezone.utc).year, now.astimezone(timezone.utc).month)
+        with self.data_store.transaction() as cursor:
+            stored = self._current(cursor, scraped)
+            changed = [(release_id, *stats.as_tuple()) for release_id, stats in scraped.items()
+                       if stored.get(release_id) != stats]
+            if not changed:
+                return 0
+            if month not in self.partitions:
+                cursor.execute("SELECT release_detail_snapshot_partition(%s)", (now,))
+            execute_values(
+                cursor,
+                f"INSERT INTO release_detail_snapshots (release_id, snapshot_time, {COLUMNS}) VALUES %s ON CONFLICT DO NOTHING",
+                [(release_id, now, *values) for release_id, *values in changed],
+                page_size=100,
+            )
+            updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in ReleaseStats.__slots__)
+            execute_values(cursor, f"""
+                INSERT INTO release_details (release_id, {COLUMNS}) VALUES %s
+                ON CONFLICT (release_id) DO UPDATE SET {updates}, updated_time = CURRENT_TIMESTAMP
+            """, changed, page_size=100)
+        # Only once committed: a rolled back transaction also rolls back the partition's creation
+        self.partitions.add(month)
+        return len(changed)
+
+    def history(self, release_id, since=None):
+        """(snapshot_time, ReleaseStats) of each change of a release's statistics, oldest first."""
+        rows = self.data_store.fetch_all(f"""
+            SELECT snapshot_time, {COLUMNS} FROM release_detail_snapshots
+            WHERE release_id = %s AND snapshot_time >= %s
+            ORDER BY snapshot_time
+        """, (release_id, since or datetime.min.replace(tzinfo=timezone.utc)))
+        return [(snapshot_time, ReleaseStats(**dict(zip(ReleaseStats.__slots__, values)))) for snapshot_time, *values in rows]
+
+    def as_of(self, release_id, when):
+        """The statistics of a release at a point in time, or None if it hadn't been scraped yet."""
+        rows = self.data_store.fetch_all(f"""
+            SELECT {COLUMNS} FROM release_detail_snapshots
+            WHERE release_id = %s AND snapshot_time <= %s
+            ORDER BY snapshot_time DESC LIMIT 1
+        """, (release_id, when))
+        return ReleaseStats(**dict(zip(ReleaseStats.__slots__, rows[0]))) if rows else None
+
+    def downsample(self, now=None):
+        """Deletes all but the last snapshot of each release per day, and per week for older ones; returns how many.
+
+        Each pass only ranks the snapshots that aged past its cutoff since the
+        previous run (release_detail_snapshot_downsampling records how far it
+        got), so the monthly partitions already thinned out aren't read again.
+        """
+        now = now or datetime.now(timezone.utc)
+        deleted = 0
+        with self.data_store.transaction() as cursor:
+            for unit, days in (("day", SNAPSHOT_DAILY_AFTER_DAYS), ("week", SNAPSHOT_WEEKLY_AFTER_DAYS)):
+                cursor.execute(
+                    "SELECT downsampled_until FROM release_detail_snapshot_downsampling WHERE unit = %s FOR UPDATE",
+                    (unit,),
+                )
+                row = cursor.fetchone()
+                cursor.execute("""
+                    WITH ranked AS (
+                        SELECT release_id, snapshot_time, row_number() OVER (
+                            PARTITION BY release_id, date_trunc(%(unit)s, snapshot_time) ORDER BY snapshot_time DESC
+                        ) AS rank
+                        FROM release_detail_snapshots
+                        WHERE snapshot_time >= %(since)s::TIMESTAMPTZ
+                          AND snapshot_time < date_trunc(%(unit)s, %(cutoff)s::TIMESTAMPTZ)
+                    ), deleted AS (
+                        DELETE FROM release_detail_snapshots s USING ranked r
+                        WHERE r.rank > 1 AND s.release_id = r.release_id AND s.snapshot_time = r.snapshot_time
+                        RETURNING 1
+                    )
+                    SELECT COUNT(*) FROM deleted
+                """, {"unit": unit, "since": row[0] if row else "-infinity", "cutoff": now - timedelta(days=days)})
+                deleted += cursor.fetchone()[0]
+                cursor.execute("""
+                    INSERT INTO release_detail_snapshot_downsampling (unit, downsampled_until)
+                    VALUES (%(unit)s, date_trunc(%(unit)s, %(cutoff)s::TIMESTAMPTZ))
+                    ON CONFLICT (unit) DO UPDATE SET downsampled_until = GREATEST(
+                        release_detail_snapshot_downsampling.downsampled_until, EXCLUDED.downsampled_until
+                    )
+                """, {"unit": unit, "cutoff": now - timedelta(days=days)})
+        return deleted
@@ -0,0 +1,74 @@
+import sys
+import threading
+from collections import OrderedDict
+
+
+class UserDirectory:
+    """Maps Discogs usernames to the integer user ids of the users table.
+
+    Recently used ids are kept in an in-process LRU cache; usernames missing
+    from it are resolved, and created if new, with one query per batch.
+    Raises if they can't be, rather than handing back a partial mapping
+    that would be stored as missing members or NULL sellers.
+    """
+
+    def __init__(self, data_store, cache_size=100_000):
+        self.data_store = data_store
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def ids(self, usernames):
+        """Returns {username: user_id} for usernames, adding unknown users to the users table."""
+        found, missing = {}, set()
+        with self.lock:
+            for username in usernames:
+                if username is None or username in found:
+                    continue
+                user_id = self.cache.get(username)
+                if user_id is None:
+                    missing.add(username)
+                else:
+                    self.cache.move_to_end(username)
+                    found[username] = user_id
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing:
+            resolved = self._get_or_create(missing)
+            # A user inserted concurrently by another node isn't visible to the same
+            # statement, so anything still missing is looked up once more.
+            if len(resolved) < len(missing):
+                resolved.update(self._get_or_create(missing - resolved.keys()))
+            if len(resolved) < len(missing):
+                raise RuntimeError(f"Could not resolve user ids for {len(missing) - len(resolved)} usernames.")
+            self._remember(resolved)
+            found.update(resolved)
+        return found
+
+    def id(self, username):
+        """Returns the user id of a single username."""
+        return self.ids([username]).get(username)
+
+    def _get_or_create(self, usernames):
+        with self.data_store.transaction() as cursor:
+            cursor.execute("""
+                WITH created AS (
+                    INSERT INTO users (username) SELECT unnest(%s::TEXT[])
+                    ON CONFLICT (username) DO NOTHING
+                    RETURNING username, user_id
+                )
+                SELECT username, user_id FROM created
+                UNION ALL
+                SELECT username, user_id FROM users WHERE username = ANY(%s)
+            """, (sorted(usernames), sorted(usernames)))
+            rows = cursor.fetchall()
+        return {sys.intern(username): user_id for username, user_id in rows}
+
+    def _remember(self, user_ids):
+        with self.lock:
+            self.cache.update(user_ids)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
@@ -0,0 +1,123 @@
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+
+
+class WorkClaimer:
+    """Hands out chunks of the scrape frontier to one of several scraper nodes.
+
+    Releases are claimed with an expiring lease using FOR UPDATE SKIP LOCKED,
+    so concurrent nodes never claim the same release. A node that crashes
+    simply stops renewing its leases and its releases become claimable again
+    once they expire. Each node reports its progress to scrape_nodes.
+    """
+
+    def __init__(self, data_store, node_id=None, lease_seconds=600):
+        self.data_store = data_store
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.claimed = 0
+        self.completed = 0
+        self.failed = 0
+
+    def register(self):
+        """Adds or resets this node's row in scrape_nodes."""
+        self.data_store.fetch_all("""
+            INSERT INTO scrape_nodes (node_id, hostname) VALUES (%s, %s)
+            ON CONFLICT (node_id) DO UPDATE
+            SET started_at = now(), heartbeat = now(), claimed = 0, completed = 0, failed = 0
+            RETURNING node_id
+        """, (self.node_id, socket.gethostname()), commit=True)
+        logging.info(f"Registered scraper node {self.node_id}")
+
+    def claim(self, size):
+        """Claims up to size due releases, highest priority first, and returns their ids."""
+        rows = self.data_store.fetch_all("""
+            UPDATE scrape_frontier f
+            SET claimed_by = %s, lease_expires = now() + %s * INTERVAL '1 second'
+            FROM (
+                SELECT release_id
+                FROM scrape_frontier
+                WHERE (next_due IS NULL OR next_due <= now())
+                AND (lease_expires IS NULL OR lease_expires < now())
+                ORDER BY priority DESC NULLS LAST
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ) c
+            WHERE f.release_id = c.release_id
+            RETURNING f.release_id
+        """, (self.node_id, self.lease_seconds, size), commit=True)
+        release_ids = [row[0] for row in rows]
+        self.claimed += len(release_ids)
+        logging.info(f"Node {self.node_id} claimed {len(release_ids)} releases.")
+        return release_ids
+
+    def renew(self, release_ids):
+        """Extends the lease on release ids this node still holds."""
+        rows = self.data_store.fetch_all("""
+            UPDATE scrape_frontier
+            SET lease_expires = now() + %s * INTERVAL '1 second'
+            WHERE release_id = ANY(%s) AND claimed_by = %s
+            RETURNING release_id
+        """, (self.lease_seconds, list(release_ids), self.node_id), commit=True)
+        return [row[0] for row in rows]
+
+    def release(self, release_ids, completed=0):
+        """Gives up the claim on release ids once they have been processed."""
+        self.data_store.fetch_all("""
+            UPDATE scrape_frontier
+            SET claimed_by = NULL, lease_expires = NULL
+            WHERE release_id = ANY(%s) AND claimed_by = %s
+            RETURNING release_id
+        """, (list(release_ids), self.node_id), commit=True)
+        self.completed += completed
+        self.failed += len(release_ids) - completed
+        self.heartbeat()
+
+    def outstanding(self):
+        """Number of releases currently leased by other live nodes."""
+        rows = self.data_store.fetch_all("""
+            SELECT COUNT(*) FROM scrape_frontier
+            WHERE claimed_by IS NOT NULL AND claimed_by <> %s AND lease_expires >= now()
+        """, (self.node_id,))
+        return rows[0][0] if rows else 0
+
+    def heartbeat(self):
+        """Reports this node's progress counters to scrape_nodes."""
+        self.data_store.fetch_all("""
+            UPDATE scrape_nodes
+            SET heartbeat = now(), claimed = %s, completed = %s, failed = %s
+            WHERE node_id = %s
+            RETURNING node_id
+        """, (self.claimed, self.completed, self.failed, self.node_id), commit=True)
+        logging.info(
+            f"Node {self.node_id}: claimed {self.claimed}, completed {self.completed}, failed {self.failed}."
+        )
+
+    def progress(self):
+        """Returns (node_id, heartbeat, claimed, completed, failed) for every node."""
+        return self.data_store.fetch_all(
+            "SELECT node_id, heartbeat, claimed, completed, failed FROM scrape_nodes ORDER BY node_id"
+        )
+
+    @contextmanager
+    def keep_alive(self, release_ids):
+        """Renews the lease on release_ids in the background while the block runs."""
+        stop = threading.Event()
+        # A separate store, since PostgresDataStore connections aren't shared between threads.
+        renewer = WorkClaimer(type(self.data_store)(self.data_store.database_url, self.data_store.table_name),
+                              self.node_id, self.lease_seconds)
+
+        def renew_until_stopped():
+            while not stop.wait(self.lease_seconds / 3):
+                renewer.renew(release_ids)
+
+        thread = threading.Thread(target=renew_until_stopped, name="LeaseRenewer", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
@@ -0,0 +1,172 @@
+import logging
+import math
+from psycopg2.extras import execute_values
+from datetime import datetime, timedelta, timezone
+
+DAY = timedelta(days=1)
+
+# How often each class of release is re-scraped.
+RECRAWL_INTERVALS = {
+    "new": timedelta(0),
+    "hot": DAY,
+    "warm": 7 * DAY,
+    "cold": 30 * DAY,
+}
+# Releases whose scrape failed are retried after this long.
+RETRY_DELAY = timedelta(hours=1)
+# Weight of the latest scrape in the smoothed listing churn.
+CHURN_SMOOTHING = 0.5
+
+
+def classify_release(last_scraped, want, have, last_sold, churn, now):
+    """Buckets a release into a recrawl class from its demand and market activity.
+
+    refresh() computes the same in SQL with frontier_release_class().
+    """
+    if last_scraped is None:
+        return "new"
+    days_since_sold = (now.date() - last_sold).days if last_sold else None
+    if (days_since_sold is not None and days_since_sold <= 30) or (churn or 0) >= 0.3 or (want or 0) >= 500:
+        return "hot"
+    if (days_since_sold is not None and days_since_sold <= 365) or (want or 0) >= 50:
+        return "warm"
+    return "cold"
+
+
+def compute_priority(last_scraped, want, have, last_sold, churn, release_class, now, intervals=RECRAWL_INTERVALS):
+    """Scores a release for scraping; higher scores are scraped first.
+
+    The score grows with the time since the last scrape relative to the
+    class's recrawl interval, and is boosted by want/have counts, how
+    recently the release sold and how much its listings churn. refresh()
+    computes the same in SQL with frontier_priority().
+    """
+    if last_scraped is None:
+        staleness = 10.0
+    else:
+        interval = intervals[release_class].total_seconds() or 1.0
+        staleness = (now - last_scraped).total_seconds() / interval
+    demand = math.log1p(want or 0) + 0.5 * math.log1p(have or 0)
+    recency = 1.0 / (1.0 + (now.date() - last_sold).days / 30.0) if last_sold else 0.0
+    return staleness * (1.0 + demand) * (1.0 + recency) * (1.0 + (churn or 0.0))
+
+
+class ScrapeFrontier:
+    """Persistent, priority ordered queue of release ids to scrape.
+
+    Backed by the scrape_frontier table (see db/frontier.sql). refresh()
+    recomputes every release's class, priority and due time from the latest
+    release_details and listing churn; next_batch() hands out the highest
+    priority releases that are due; mark_scraped() records the outcome.
+    """
+
+    def __init__(self, data_store, intervals=None):
+        self.data_store = data_store
+        self.intervals = dict(RECRAWL_INTERVALS, **(intervals or {}))
+
+    def add(self, release_ids):
+        """Adds release ids to the frontier; ids already present are left alone."""
+        self.data_store.bulk_insert(
+            "INSERT INTO scrape_frontier (release_id) VALUES %s ON CONFLICT (release_id) DO NOTHING",
+            [(release_id,) for release_id in release_ids],
+        )
+
+    def refresh(self, now=None):
+        """Recomputes class, priority and due time for every release in the frontier.
+
+        Runs as one UPDATE using the functions of db/frontier_priority.sql,
+        under an advisory lock so that when several nodes share the frontier
+        only one refreshes it at a time; the others skip. Returns whether
+        the frontier was refreshed.
+        """
+        now = now or datetime.now(timezone.utc)
+        try:
+            with self.data_store.transaction() as cursor:
+                cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext('scrape_frontier_refresh'))")
+                if not cursor.fetchone()[0]:
+                    logging.info("Another node is refreshing the scrape frontier, skipping.")
+                    return False
+                cursor.execute("""
+                    WITH intervals AS (
+                        SELECT * FROM unnest(%(classes)s::TEXT[], %(seconds)s::FLOAT[]) AS i (release_class, seconds)
+                    )
+                    UPDATE scrape_frontier f
+                    SET release_class = c.release_class,
+                        priority = frontier_priority(f.last_scraped, c.want, c.have, c.last_sold, f.listing_churn, i.seconds, %(now)s),
+                        next_due = f.last_scraped + i.seconds * INTERVAL '1 second'
+                    FROM (
+                        SELECT s.release_id, d.want, d.have, d.last_sold,
+                               frontier_release_class(s.last_scraped, d.want, d.have, d.last_sold, s.listing_churn, %(now)s) AS release_class
+                        FROM scrape_frontier s
+                        LEFT JOIN release_details d ON d.release_id = s.release_id
+                    ) c
+                    JOIN intervals i ON i.release_class = c.release_class
+                    WHERE f.release_id = c.release_id
+                """, {
+                    "classes": list(self.intervals),
+                    "seconds": [interval.total_seconds() for interval in self.intervals.values()],
+                    "now": now,
+                })
+                logging.info(f"Refreshed priorities for {cursor.rowcount} releases in the scrape frontier.")
+            return True
+        except Exception as e:
+            logging.error(f"Failed to refresh the scrape frontier: {e}")
+            return False
+
+    def next_batch(self, size):
+        """Returns up to size due release ids, highest priority first."""
+        rows = self.data_store.fetch_all("""
+            SELECT release_id
+            FROM scrape_frontier
+            WHERE next_due IS NULL OR next_due <= now()
+            ORDER BY priority DESC NULLS LAST
+            LIMIT %s
+        """, (size,))
+        return [row[0] for row in rows]
+
+    def mark_scraped(self, release_ids, releases, now=None):
+        """Records a scrape attempt for release_ids; releases holds the results that were scraped and stored.
+
+        A release counts as scraped only if it's in releases: the scraper
+        leaves out releases with a page it couldn't fetch, and callers pass
+        none when the batch failed to store, so those are retried after
+        RETRY_DELAY instead of their class's interval. listing_count is the
+        release's number of listings on the marketplace and listing_churn the
+        smoothed share of them that was new since the previous scrape. Runs
+        in one transaction and raises if it fails, since the releases would
+        otherwise stay due and be claimed again right away.
+        """
+        now = now or datetime.now(timezone.utc)
+        scraped = {release.release_id: release for release in releases}
+        with self.data_store.transaction() as cursor:
+            cursor.execute(
+                "SELECT release_id, listing_count, listing_churn, release_class FROM scrape_frontier WHERE release_id = ANY(%s) FOR UPDATE",
+                (list(release_ids),),
+            )
+            previous = {release_id: (count, churn, release_class) for release_id, count, churn, release_class in cursor.fetchall()}
+
+            updates = []
+            for release_id in release_ids:
+                listing_count, churn, release_class = previous.get(release_id, (None, None, None))
+                release = scraped.get(release_id)
+                if release is None:
+                    updates.append((release_id, None, now + RETRY_DELAY, listing_count, churn))
+                    continue
+                new_listings = len(release.sellers)
+                if release.listing_count is not None:
+                    listing_count = release.listing_count
+                latest_churn = min(new_listings / listing_count, 1.0) if listing_count else float(new_listings > 0)
+                churn = latest_churn if churn is None else CHURN_SMOOTHING * latest_churn + (1 - CHURN_SMOOTHING) * churn
+                interval = self.intervals.get(release_class or "new") or self.intervals["hot"]
+                updates.append((release_id, now, now + interval, listing_count, churn))
+
+            execute_values(cursor, """
+                UPDATE scrape_frontier f
+                SET last_scraped = COALESCE(v.last_scraped::TIMESTAMPTZ, f.last_scraped),
+                    next_due = v.next_due::TIMESTAMPTZ,
+                    listing_count = v.listing_count::INT,
+                    listing_churn = v.listing_churn::FLOAT,
+                    priority = 0
+                FROM (VALUES %s) AS v (release_id, last_scraped, next_due, listing_count, listing_churn)
+                WHERE f.release_id = v.release_id
+            """, updates, page_size=100)
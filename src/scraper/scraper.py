@@ -1,51 +1,373 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import logging
-from models.discogs_objects import DiscogsRelease, DiscogsStatsPage, DiscogsSellerPageRelease
+import math
+import multiprocessing
+import time
+from models.discogs_objects import DiscogsRelease, DiscogsStatsPage, DiscogsSellerPage, DiscogsSellerPageRelease
+from models.records import Members, ReleaseResult
+from utils import html_parser
+from utils.metrics import metrics
 from managers.session_manager import SessionManager
 from managers.proxy_manager import ProxyManager
 import threading
 
+LISTINGS_PER_PAGE = 250
+MAX_LISTING_PAGES = 40
+DEFAULT_LISTING_FILTERS = {"genre": "Electronic", "format": "Vinyl"}
+
+
+class StageStats:
+    """Counts items and busy time for one stage of the scraping pipeline.
+
+    Each item's time is also observed in the metrics registry as metric.
+    """
+
+    def __init__(self, name, workers, unit="releases", metric=None):
+        self.name = name
+        self.metric = metric or name
+        self.workers = workers
+        self.unit = unit
+        self.count = 0
+        self.busy_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.busy_seconds += seconds
+        metrics.observe(self.metric, seconds)
+
+    def report(self, wall_seconds):
+        throughput = self.count / wall_seconds if wall_seconds else 0.0
+        average = self.busy_seconds / self.count if self.count else 0.0
+        utilization = self.busy_seconds / (wall_seconds * self.workers) if wall_seconds and self.workers else 0.0
+        logging.info(
+            f"Stage {self.name}: {self.count} {self.unit}, {throughput:.2f} {self.unit}/sec, "
+            f"{average:.3f}s each, {self.workers} workers {utilization:.0%} busy"
+        )
+
+
+def parse_release_pages(pages):
+    """Parses the raw HTML fetched for one release into a ReleaseResult."""
+    release_id = pages["release_id"]
+    watermark = pages.get("watermark")
+    try:
+        # None rather than empty lists when the stats page is missing, so it isn't read as everyone leaving
+        members_have, members_want = DiscogsStatsPage.parse_members_data(pages["stats"]) if pages["stats"] else (None, None)
+        sellers = [
+            item
+            for sellers_html in pages["sellers"]
+            for item in DiscogsSellerPageRelease.parse_items_for_sale(sellers_html)
+            if watermark is None or item.listing_id is None or item.listing_id > watermark
+        ]
+        return ReleaseResult(
+            release_id=release_id,
+            release=DiscogsRelease.parse_stats(pages["release"]) if pages["release"] else None,
+            stats=Members(have=members_have, want=members_want),
+            sellers=sellers,
+            listing_count=count_listings(pages["sellers"]),
+            listings_complete=watermark is None and fetched_every_listing(pages["sellers"]),
+        )
+    except Exception as e:
+        logging.error(f"Error parsing release {release_id}: {e}", exc_info=True)
+        return None
+
+
+def count_listings(sellers_html):
+    """Total number of marketplace listings of a release, from its first page of listings; None without one."""
+    if not sellers_html:
+        return None
+    total = html_parser.parse_pagination_total(sellers_html[0])
+    # Pages without a pagination header hold all listings
+    return total if total is not None else len(html_parser.parse_listing_ids(sellers_html[0]))
+
+
+def fetched_every_listing(sellers_html):
+    """True if sellers_html holds every page of a release's listings, i.e. the walk wasn't cut short by max_listing_pages."""
+    total = count_listings(sellers_html)
+    return total is not None and len(sellers_html) >= math.ceil(total / LISTINGS_PER_PAGE)
+
+
+def parse_seller_pages(pages):
+    """Parses the raw inventory pages fetched for one seller into a list of listings."""
+    username = pages["username"]
+    watermark = pages.get("watermark")
+    try:
+        return {
+            "username": username,
+            "listings": [
+                item
+                for inventory_html in pages["sellers"]
+                for item in DiscogsSellerPage.parse_items_for_sale(inventory_html)
+                if watermark is None or item.listing_id is None or item.listing_id > watermark
+            ]
+        }
+    except Exception as e:
+        logging.error(f"Error parsing inventory of seller {username}: {e}", exc_info=True)
+        return None
+
+
+def group_listings_by_release(seller_results):
+    """Regroups seller inventory listings into per-release results."""
+    releases = {}
+    for result in seller_results:
+        for item in result["listings"]:
+            if item.release_id is not None:
+                releases.setdefault(item.release_id, []).append(item)
+    return [ReleaseResult(release_id=release_id, sellers=sellers) for release_id, sellers in releases.items()]
+
+
+def _timed_parse(parse, pages):
+    start = time.perf_counter()
+    result = parse(pages)
+    return result, time.perf_counter() - start
+
+
+def _describe(result):
+    """(kind, key) of a result, as log arguments so nothing is formatted unless the line is emitted."""
+    if isinstance(result, ReleaseResult):
+        return "release ID", result.release_id
+    return "seller", result["username"]
+
+
+def _reached_watermark(sellers_html, watermark):
+    """True if the page lists a listing at or below the watermark, i.e. one we've already seen."""
+    return watermark is not None and any(listing_id <= watermark for listing_id in html_parser.parse_listing_ids(sellers_html))
+
+
 class Scraper:
-    def __init__(self, proxy_list_url, max_workers=3):
+    def __init__(self, proxy_list_url, max_workers=3, page_cache=None, parse_workers=0,
+                 listing_filters=None, page_workers=4, max_listing_pages=MAX_LISTING_PAGES, completed=None):
         self.proxy_manager = ProxyManager(proxy_list_url)
         self.session_manager = SessionManager(self.proxy_manager)
+        self.session_manager.warm_up()
         self.max_workers = max_workers
+        self.page_cache = page_cache
+        # With parse_workers > 0, fetch threads only download pages and parsing
+        # runs in a separate process pool so it doesn't compete for the GIL.
+        self.parse_workers = parse_workers
+        self.parse_executor = None
+        self.stage_stats = self._new_stage_stats()
+        # Marketplace listings are fetched LISTINGS_PER_PAGE at a time; pages
+        # after the first are fetched page_workers at a time.
+        self.listing_filters = DEFAULT_LISTING_FILTERS if listing_filters is None else listing_filters
+        self.page_workers = page_workers
+        self.max_listing_pages = max_listing_pages
+        self.page_executor = ThreadPoolExecutor(max_workers=page_workers, thread_name_prefix="ListingPage")
+        # Ids of releases already scraped (e.g. an IdBitmap); run() skips them without fetching.
+        self.completed = completed
+
+    def fetch_release_pages(self, release_id, watermark=None):
+        """Downloads the release, stats and marketplace pages without parsing them.
 
-    def get_release_info(self, release_id):
+        watermark is the highest listing id already stored for the release;
+        marketplace pages stop being fetched once it is reached. Returns None
+        if any of the pages couldn't be fetched, so the release is scraped
+        again rather than stored (and marked scraped) with parts missing.
+        """
         try:
-            logging.info(f"Fetching release info for ID: {release_id} on thread: {threading.current_thread().name}")
-            release_page = DiscogsRelease(release_id, self.session_manager)
-            logging.debug(f"Fetching release seller pagr info for ID: {release_id} on thread: {threading.current_thread().name} on proxy: {release_page.proxy}")
-            release_page.fetch_and_parse()
+            logging.info("Fetching release info for ID: %s", release_id)
+            release_page = DiscogsRelease(release_id, self.session_manager, cache=self.page_cache)
+            logging.debug("Fetching release page for ID: %s on proxy: %s", release_id, release_page.proxy)
+            release_html = release_page.fetch_page_content()
 
-            stats_page = DiscogsStatsPage(release_id, self.session_manager)
-            logging.debug(f"Fetching release stats page for ID: {release_id} on thread: {threading.current_thread().name} on proxy: {stats_page.proxy}")
-            stats_page.fetch_and_parse()
+            stats_page = DiscogsStatsPage(release_id, self.session_manager, cache=self.page_cache)
+            logging.debug("Fetching release stats page for ID: %s on proxy: %s", release_id, stats_page.proxy)
+            stats_html = stats_page.fetch_page_content()
 
-            query_params = {"sort": "listed,desc", "limit": 250, "genre": "Electronic", "format": "Vinyl"}
-            seller_page = DiscogsSellerPageRelease(release_id, self.session_manager, query_params)
-            logging.debug(f"Fetching release seller pagr info for ID: {release_id} on thread: {threading.current_thread().name} on proxy: {seller_page.proxy}")
-            seller_page.fetch_and_parse()
+            sellers_html = self.fetch_listing_pages(release_id, watermark)
+
+            missing = [name for name, html in (("release", release_html), ("stats", stats_html),
+                                               ("listings", sellers_html)) if html is None]
+            if missing:
+                logging.warning(f"Couldn't fetch the {', '.join(missing)} page(s) of release {release_id}")
+                return None
 
             return {
                 "release_id": release_id,
-                "release": release_page.stats,
-                "stats": {"have": stats_page.members_have, "want": stats_page.members_want},
-                "sellers": seller_page.items_for_sale
+                "release": release_html,
+                "stats": stats_html,
+                "sellers": sellers_html,
+                "watermark": watermark
             }
         except Exception as e:
-            logging.error(f"Error processing release {release_id} on thread: {threading.current_thread().name}: {e}", exc_info=True)
+            logging.error(f"Error fetching release {release_id} on thread: {threading.current_thread().name}: {e}", exc_info=True)
             return None
 
+    def fetch_listing_pages(self, release_id, watermark=None):
+        """Fetches every marketplace page for a release, newest listings first; None if they couldn't be fetched."""
+        return self._fetch_paginated(
+            lambda page: self._fetch_listing_page(release_id, page), watermark, f"release {release_id}"
+        )
 
-    def run(self, release_ids):
+    def fetch_seller_pages(self, username, watermark=None):
+        """Downloads every inventory page of a seller without parsing them."""
+        try:
+            logging.info("Fetching inventory for seller: %s", username)
+            inventory_html = self._fetch_paginated(
+                lambda page: self._fetch_inventory_page(username, page), watermark, f"seller {username}"
+            )
+            if inventory_html is None:
+                logging.warning(f"Couldn't fetch the inventory of seller {username}")
+                return None
+            return {
+                "username": username,
+                "sellers": inventory_html,
+                "watermark": watermark
+            }
+        except Exception as e:
+            logging.error(f"Error fetching inventory of seller {username} on thread: {threading.current_thread().name}: {e}", exc_info=True)
+            return None
+
+    def _fetch_paginated(self, fetch_page, watermark, description):
+        """Fetches all pages of a marketplace listing, newest listings first.
+
+        The first page tells us the total number of listings; the remaining
+        pages are fetched concurrently, a window of page_workers pages at a
+        time, until the watermark is reached. Returns None if any page couldn't
+        be fetched: a missing first page would look like no listings at all,
+        and the listings of a missing later page would be lost for good once
+        newer ones were stored past them as the next watermark.
+        """
+        first_page = fetch_page(1)
+        if first_page is None:
+            return None
+        pages = [first_page]
+        total = html_parser.parse_pagination_total(first_page)
+        if not total or _reached_watermark(first_page, watermark):
+            return pages
+
+        page_count = min(math.ceil(total / LISTINGS_PER_PAGE), self.max_listing_pages)
+        remaining = list(range(2, page_count + 1))
+        for i in range(0, len(remaining), self.page_workers):
+            window = remaining[i : i + self.page_workers]
+            window_pages = list(self.page_executor.map(fetch_page, window))
+            if any(page is None for page in window_pages):
+                logging.warning(f"Couldn't fetch every listing page of {description}")
+                return None
+            pages.extend(window_pages)
+            if any(_reached_watermark(page, watermark) for page in window_pages):
+                break
+        logging.debug("Fetched %d of %d listing pages for %s", len(pages), page_count, description)
+        return pages
+
+    def _listing_query_params(self, page):
+        query_params = dict(self.listing_filters, sort="listed,desc", limit=LISTINGS_PER_PAGE)
+        if page > 1:
+            query_params["page"] = page
+        return query_params
+
+    def _fetch_listing_page(self, release_id, page):
+        seller_page = DiscogsSellerPageRelease(release_id, self.session_manager, self._listing_query_params(page), cache=self.page_cache)
+        logging.debug("Fetching release seller page %d for ID: %s on proxy: %s", page, release_id, seller_page.proxy)
+        return seller_page.fetch_page_content()
+
+    def _fetch_inventory_page(self, username, page):
+        inventory_page = DiscogsSellerPage(username, self.session_manager, self._listing_query_params(page), cache=self.page_cache)
+        logging.debug("Fetching inventory page %d for seller: %s on proxy: %s", page, username, inventory_page.proxy)
+        return inventory_page.fetch_page_content()
+
+    def get_release_info(self, release_id, watermark=None):
+        return self._scrape(self.fetch_release_pages, parse_release_pages, release_id, watermark)
+
+    def _scrape(self, fetch, parse, key, watermark=None):
+        pages = self._timed_fetch(fetch, key, watermark)
+        if pages is None:
+            return None
+        result, seconds = _timed_parse(parse, pages)
+        self.stage_stats["parse"].record(seconds)
+        return result
+
+    def _timed_fetch(self, fetch, key, watermark=None):
+        start = time.perf_counter()
+        pages = fetch(key, watermark)
+        self.stage_stats["fetch"].record(time.perf_counter() - start)
+        return pages
+
+    def _new_stage_stats(self, unit="releases"):
+        return {
+            "fetch": StageStats("fetch", self.max_workers, unit),
+            "parse": StageStats("parse", self.parse_workers or self.max_workers, unit, metric="html_parse"),
+        }
+
+    def _get_parse_executor(self):
+        if self.parse_executor is None:
+            # Spawn rather than fork: the fetch threads may hold locks at fork time.
+            self.parse_executor = ProcessPoolExecutor(
+                max_workers=self.parse_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self.parse_executor
+
+    def run(self, release_ids, watermarks=None):
+        """Scrapes release_ids; watermarks maps release ids to the highest listing id already stored."""
+        if self.completed is not None:
+            pending = [release_id for release_id in release_ids if release_id not in self.completed]
+            if len(pending) < len(release_ids):
+                logging.info(f"Skipping {len(release_ids) - len(pending)} releases that were already scraped")
+            release_ids = pending
+        return self._run(release_ids, watermarks, self.fetch_release_pages, parse_release_pages, "releases")
+
+    def run_sellers(self, usernames, watermarks=None):
+        """Scrapes the full inventories of usernames and returns their listings grouped by release.
+
+        watermarks maps usernames to the highest listing id already stored for that seller.
+        """
+        seller_results = self._run(usernames, watermarks, self.fetch_seller_pages, parse_seller_pages, "sellers")
+        releases = group_listings_by_release(seller_results)
+        logging.info(f"Collected listings for {len(releases)} releases from {len(seller_results)} sellers")
+        return releases
+
+    def _run(self, keys, watermarks, fetch, parse, unit):
         logging.info("Starting scraper with %d workers", self.max_workers)
+        self.stage_stats = self._new_stage_stats(unit)
+        watermarks = watermarks or {}
+        start = time.perf_counter()
+        if self.parse_workers:
+            results = self._run_pipelined(keys, watermarks, fetch, parse)
+        else:
+            results = self._run_threaded(keys, watermarks, fetch, parse)
+
+        wall_seconds = time.perf_counter() - start
+        metrics.inc(f"{unit}_scraped", len(results))
+        for stats in self.stage_stats.values():
+            stats.report(wall_seconds)
+        if self.page_cache:
+            logging.info(f"Page cache hits: {self.page_cache.hits}, misses: {self.page_cache.misses}")
+        return results
+
+    def _run_threaded(self, keys, watermarks, fetch, parse):
         results = []
         with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = [executor.submit(self.get_release_info, rid) for rid in release_ids]
+            futures = [executor.submit(self._scrape, fetch, parse, key, watermarks.get(key)) for key in keys]
             for future in as_completed(futures):
                 result = future.result()
                 if result:
                     results.append(result)
-                    logging.info(f"Successfully fetched data for release ID: {result['release_id']}")
-        return results
\ No newline at end of file
+                    logging.info("Successfully fetched data for %s: %s", *_describe(result))
+        return results
+
+    def _run_pipelined(self, keys, watermarks, fetch, parse):
+        results = []
+        parse_executor = self._get_parse_executor()
+        parse_futures = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            fetch_futures = [executor.submit(self._timed_fetch, fetch, key, watermarks.get(key)) for key in keys]
+            for future in as_completed(fetch_futures):
+                pages = future.result()
+                if pages:
+                    parse_futures.append(parse_executor.submit(_timed_parse, parse, pages))
+
+        for future in as_completed(parse_futures):
+            result, seconds = future.result()
+            self.stage_stats["parse"].record(seconds)
+            if result:
+                results.append(result)
+                logging.info("Successfully fetched data for %s: %s", *_describe(result))
+        return results
+
+    def close(self):
+        """Shuts down the listing page threads and the parse process pool, if one was started."""
+        self.page_executor.shutdown()
+        if self.parse_executor is not None:
+            self.parse_executor.shutdown()
+            self.parse_executor = None
@@ -0,0 +1,140 @@
+"""Graph of artists, their aliases and the groups they're in, as a memory-mapped CSR index.
+
+ArtistGraphBuilder is a data store that collects the alias and group edges
+of the artist records parse_xml inserts (put it next to the real data store
+with TeeDataStore) and finish() writes them in compressed sparse row form:
+an offsets array indexed by artist id and one array of neighbors, each
+packed as neighbor id << 2 | edge kind. ArtistGraph memory-maps that file,
+so opening it is instant and neighborhood queries only touch the rows they
+read.
+"""
+from itertools import accumulate
+import logging
+import mmap
+import os
+import struct
+from array import array
+from collections import deque
+from models.sinks.db import BaseDataStore
+
+ALIAS, GROUP, MEMBER = 0, 1, 2
+KIND_NAMES = {ALIAS: "alias", GROUP: "group", MEMBER: "member"}
+MAGIC = b"DAGR"
+# magic, version, largest artist id, edge count
+HEADER = struct.Struct("<4sBQQ")
+HEADER_SIZE = 32
+# Neighbor ids share 32 bits with the 2 bit edge kind
+MAX_ARTIST_ID = (1 << 30) - 1
+
+
+class ArtistGraphBuilder(BaseDataStore):
+    def __init__(self, path):
+        self.path = path
+        # Edges packed as artist id << 32 | neighbor id << 2 | kind, so sorting groups them by artist
+        self.edges = array("Q")
+        self.skipped = 0
+
+    def connect(self):
+        pass
+
+    def insert(self, records):
+        for record in records:
+            artist_id = record.get("id")
+            if artist_id is None or artist_id > MAX_ARTIST_ID:
+                continue
+            for alias in record.get("aliases") or ():
+                self._add(artist_id, alias["id"], ALIAS)
+                self._add(alias["id"], artist_id, ALIAS)
+            for group in record.get("groups") or ():
+                self._add(artist_id, group["id"], GROUP)
+                self._add(group["id"], artist_id, MEMBER)
+            for member in record.get("members") or ():
+                self._add(artist_id, member["id"], MEMBER)
+                self._add(member["id"], artist_id, GROUP)
+
+    def _add(self, artist_id, neighbor_id, kind):
+        if artist_id > MAX_ARTIST_ID or neighbor_id > MAX_ARTIST_ID:
+            self.skipped += 1
+            return
+        self.edges.append(artist_id << 32 | neighbor_id << 2 | kind)
+
+    def finish(self):
+        """Writes the graph to path and returns it opened as an ArtistGraph."""
+        edges = sorted(self.edges)
+        self.edges = array("Q")
+        max_id = (edges[-1] >> 32) if edges else 0
+        counts = array("I", bytes(4 * (max_id + 2)))
+        neighbors = array("I")
+        previous = None
+        for edge in edges:
+            # Aliases usually appear on both artists' records, so the same edge is added twice
+            if edge == previous:
+                continue
+            previous = edge
+            neighbors.append(edge & 0xFFFFFFFF)
+            counts[(edge >> 32) + 1] += 1
+        offsets = array("I", accumulate(counts))
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, 1, max_id, len(neighbors)).ljust(HEADER_SIZE, b"\0"))
+            offsets.tofile(f)
+            neighbors.tofile(f)
+        os.replace(tmp_path, self.path)
+        logging.info(f"Wrote artist graph of {len(neighbors)} edges to {self.path} ({self.skipped} edges skipped)")
+        return ArtistGraph(self.path)
+
+
+class ArtistGraph:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.max_id, edge_count = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or version != 1:
+            raise ValueError(f"{path} is not an artist graph")
+        view = memoryview(self.mmap)
+        offsets_end = HEADER_SIZE + 4 * (self.max_id + 2)
+        self.offsets = view[HEADER_SIZE:offsets_end].cast("I")
+        self.neighbors = view[offsets_end:offsets_end + 4 * edge_count].cast("I")
+
+    def __len__(self):
+        """Number of edges."""
+        return len(self.neighbors)
+
+    def neighbors_of(self, artist_id, kinds=None):
+        """(neighbor id, kind) pairs of an artist, optionally only of the given edge kinds."""
+        if artist_id > self.max_id:
+            return []
+        row = self.neighbors[self.offsets[artist_id]:self.offsets[artist_id + 1]]
+        return [(packed >> 2, packed & 3) for packed in row if kinds is None or packed & 3 in kinds]
+
+    def aliases(self, artist_id):
+        return [neighbor for neighbor, _ in self.neighbors_of(artist_id, (ALIAS,))]
+
+    def groups(self, artist_id):
+        return [neighbor for neighbor, _ in self.neighbors_of(artist_id, (GROUP,))]
+
+    def members(self, artist_id):
+        return [neighbor for neighbor, _ in self.neighbors_of(artist_id, (MEMBER,))]
+
+    def neighborhood(self, artist_id, hops=2, kinds=None):
+        """Artists within hops edges of artist_id (optionally of the given kinds), mapped to their distance."""
+        distances = {artist_id: 0}
+        queue = deque([artist_id])
+        while queue:
+            current = queue.popleft()
+            distance = distances[current]
+            if distance == hops:
+                continue
+            for neighbor, _ in self.neighbors_of(current, kinds):
+                if neighbor not in distances:
+                    distances[neighbor] = distance + 1
+                    queue.append(neighbor)
+        del distances[artist_id]
+        return distances
+
+    def close(self):
+        self.offsets.release()
+        self.neighbors.release()
+        self.mmap.close()
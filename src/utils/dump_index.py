@@ -0,0 +1,245 @@
+"""Random access to single records of a dump by id.
+
+A plain .xml.gz can only be read from the start. ``build_index`` reads a dump
+once and writes a copy split into independent gzip members of about
+``checkpoint_bytes`` of XML each, cut between records, plus an index of every
+record's id, uncompressed offset and length. The copy is still an ordinary
+gzip file that XMLDataHandler can load. ``DumpIndex`` memory-maps the index
+and fetches a record by decompressing only the member holding it.
+
+(zran-style checkpoints into the original file would avoid the copy, but
+resuming inflation mid-stream needs inflatePrime, which Python's zlib does
+not expose.)
+"""
+import argparse
+import bisect
+import gzip
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import zlib
+from array import array
+
+from lxml import etree
+
+from utils.xml_handler import PARSERS
+
+# Uncompressed XML per gzip member; a lookup decompresses at most one member
+INDEX_CHECKPOINT_BYTES = int(os.getenv("INDEX_CHECKPOINT_BYTES", 1024**2))
+INDEX_COMPRESSLEVEL = int(os.getenv("INDEX_COMPRESSLEVEL", 6))
+READ_SIZE = 1024**2
+MAGIC = b"DGZI"
+# magic, version, kind, member count, record count
+HEADER = struct.Struct("<4sB16sQQ")
+HEADER_SIZE = 64
+
+
+def seekable_path(path):
+    """releases.xml.gz -> releases.seekable.xml.gz"""
+    base, _, _ = path.partition(".xml")
+    return f"{base}.seekable.xml.gz"
+
+
+class _MemberWriter:
+    """Writes gzip members one after another, remembering where each starts."""
+
+    def __init__(self, file, compresslevel):
+        self.file = file
+        self.compresslevel = compresslevel
+        self.compressed_offsets = array("Q")
+        self.uncompressed_offsets = array("Q")
+        self.uncompressed = 0
+        self.compressor = None
+
+    def write(self, data):
+        if not data:
+            return
+        if self.compressor is None:
+            self.compressed_offsets.append(self.file.tell())
+            self.uncompressed_offsets.append(self.uncompressed)
+            self.compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, 31)
+        self.file.write(self.compressor.compress(data))
+        self.uncompressed += len(data)
+
+    def member_size(self):
+        return self.uncompressed - self.uncompressed_offsets[-1] if self.compressor else 0
+
+    def cut(self):
+        if self.compressor is not None:
+            self.file.write(self.compressor.flush())
+            self.compressor = None
+
+    def close(self):
+        self.cut()
+        self.compressed_offsets.append(self.file.tell())
+        self.uncompressed_offsets.append(self.uncompressed)
+
+
+def _record_id(kind, record):
+    # Releases and masters carry the id as an attribute, artists and labels as their first <id> child
+    match = re.search(rb'^<\w+[^>]*?\sid="(\d+)"', record) or re.search(rb"<id>(\d+)</id>", record)
+    return int(match.group(1)) if match else None
+
+
+def build_index(source_path, kind, destination_path=None, checkpoint_bytes=INDEX_CHECKPOINT_BYTES,
+                compresslevel=INDEX_COMPRESSLEVEL):
+    """Writes a seekable copy of the dump at source_path and its index; returns the DumpIndex."""
+    destination_path = destination_path or seekable_path(source_path)
+    tag = kind.encode()
+    tag_pattern = re.compile(rb"<(/?)" + tag + rb"(?=[\s/>])")
+    tail = len(tag) + 2
+    ids, offsets, lengths = array("Q"), array("Q"), array("I")
+
+    with gzip.open(source_path, "rb") as source, open(destination_path, "wb") as destination:
+        writer = _MemberWriter(destination, compresslevel)
+        buffer, base, pos, depth, start = b"", 0, 0, 0, None
+        for chunk in iter(lambda: source.read(READ_SIZE), b""):
+            buffer += chunk
+            incomplete = False
+            while True:
+                match = tag_pattern.search(buffer, pos)
+                if match is None:
+                    break
+                end = buffer.find(b">", match.end())
+                if end == -1:
+                    incomplete, pos = True, match.start()
+                    break
+                pos = end + 1
+                closing, self_closing = match.group(1), buffer[end - 1:end] == b"/"
+                if not closing and depth == 0:
+                    start = match.start()
+                if not closing and not self_closing:
+                    depth += 1
+                    continue
+                if closing:
+                    depth -= 1
+                if depth:
+                    continue
+                # A whole top level record: index it and cut the member after it once it's big enough
+                record_id = _record_id(kind, buffer[start:pos])
+                if record_id is not None:
+                    ids.append(record_id)
+                    offsets.append(base + start)
+                    lengths.append(pos - start)
+                writer.write(buffer[writer.uncompressed - base:pos])
+                if writer.member_size() >= checkpoint_bytes:
+                    writer.cut()
+                start = None
+
+            keep = start if depth else (pos if incomplete else max(pos, len(buffer) - tail))
+            writer.write(buffer[writer.uncompressed - base:keep])
+            buffer = buffer[keep:]
+            base += keep
+            pos -= keep
+            if start is not None:
+                start -= keep
+        writer.write(buffer[writer.uncompressed - base:])
+        writer.close()
+
+    if any(ids[i] > ids[i + 1] for i in range(len(ids) - 1)):
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        ids = array("Q", (ids[i] for i in order))
+        offsets = array("Q", (offsets[i] for i in order))
+        lengths = array("I", (lengths[i] for i in order))
+
+    index_path = f"{destination_path}.idx"
+    with open(index_path, "wb") as f:
+        header = HEADER.pack(MAGIC, 1, kind.encode(), len(writer.compressed_offsets) - 1, len(ids))
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        for values in (writer.compressed_offsets, writer.uncompressed_offsets, ids, offsets, lengths):
+            values.tofile(f)
+    logging.info(f"Indexed {len(ids)} {kind}s in {len(writer.compressed_offsets) - 1} members of {destination_path}")
+    return DumpIndex(destination_path)
+
+
+class DumpIndex:
+    """Looks up single records of a dump written by build_index."""
+
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path or f"{path}.idx"
+        with open(self.index_path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, kind, members, records = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or version != 1:
+            raise ValueError(f"{self.index_path} is not a dump index")
+        self.kind = kind.rstrip(b"\0").decode()
+        view, position = memoryview(self.mmap), HEADER_SIZE
+        sections = []
+        for count, code, size in ((members + 1, "Q", 8), (members + 1, "Q", 8), (records, "Q", 8),
+                                  (records, "Q", 8), (records, "I", 4)):
+            sections.append(view[position:position + count * size].cast(code))
+            position += count * size
+        self.compressed_offsets, self.uncompressed_offsets, self.ids, self.offsets, self.lengths = sections
+        self.file = open(self.path, "rb")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, record_id):
+        return self._position(record_id) is not None
+
+    def _position(self, record_id):
+        i = bisect.bisect_left(self.ids, record_id)
+        return i if i < len(self.ids) and self.ids[i] == record_id else None
+
+    def raw(self, record_id):
+        """The record's XML, or None if the dump has no such record."""
+        i = self._position(record_id)
+        if i is None:
+            return None
+        offset, length = self.offsets[i], self.lengths[i]
+        member = bisect.bisect_right(self.uncompressed_offsets, offset) - 1
+        self.file.seek(self.compressed_offsets[member])
+        compressed = self.file.read(self.compressed_offsets[member + 1] - self.compressed_offsets[member])
+        start = offset - self.uncompressed_offsets[member]
+        data = zlib.decompressobj(31).decompress(compressed, start + length)
+        return data[start:start + length]
+
+    def get(self, record_id):
+        """The record parsed like XMLDataHandler would, or None if the dump has no such record."""
+        record = self.raw(record_id)
+        if record is None:
+            return None
+        return PARSERS[self.kind].parse(etree.fromstring(record))
+
+    def close(self):
+        for section in (self.compressed_offsets, self.uncompressed_offsets, self.ids, self.offsets, self.lengths):
+            section.release()
+        self.mmap.close()
+        self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index a dump for random access, or look up records in one.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="write a seekable copy of a dump and its index")
+    build.add_argument("path")
+    build.add_argument("kind", choices=sorted(PARSERS))
+    build.add_argument("--destination")
+    build.add_argument("--checkpoint-bytes", type=int, default=INDEX_CHECKPOINT_BYTES)
+    get = commands.add_parser("get", help="print records of an indexed dump")
+    get.add_argument("path", help="the seekable copy written by build")
+    get.add_argument("ids", type=int, nargs="+")
+    get.add_argument("--raw", action="store_true", help="print the XML instead of the parsed record")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.command == "build":
+        build_index(args.path, args.kind, args.destination, args.checkpoint_bytes)
+        return
+    index = DumpIndex(args.path)
+    for record_id in args.ids:
+        record = index.raw(record_id) if args.raw else index.get(record_id)
+        if record is None:
+            print(f"No {index.kind} {record_id}", file=sys.stderr)
+        else:
+            print(record.decode() if args.raw else record)
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
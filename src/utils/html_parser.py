@@ -0,0 +1,221 @@
+import logging
+import re
+import sys
+from lxml import etree
+from models.records import Listing, ReleaseStats, RELEASE_STAT_FIELDS
+from utils.parser_utils import safe_parse_int, safe_parse_float, safe_parse_date, safe_parse_price
+
+# lxml counterparts of the BeautifulSoup parsers in models/discogs_objects.py.
+# They return exactly the same structures, but only parse the region of the
+# page that holds the data and walk the lxml tree directly instead of going
+# through BeautifulSoup's find/find_all machinery.
+
+_STRING = etree.XPath("string()", smart_strings=False)
+_RATING_PATTERN = re.compile(r'(\d+(\.\d+)?)')
+_ITEMS_TABLE_CLASS = 'table_block mpitems push_down table_responsive'
+_DIGITS_PATTERN = re.compile(r'(\d+)')
+_RELEASE_LINK_PATTERN = re.compile(r'^/release/(\d+)')
+_LISTING_ID_PATTERN = re.compile(r'/sell/item/(\d+)')
+_LISTING_LINK_PATTERN = re.compile(r'href="/sell/item/(\d+)"')
+_PAGINATION_TOTAL_PATTERN = re.compile(
+    r'class="pagination_total"[^>]*>\s*[\d,]+\s*(?:&ndash;|\u2013|-)\s*[\d,]+\s+of\s+([\d,]+)'
+)
+
+
+def _find_all(elem, tag, class_name=None, limit=None):
+    """Equivalent of BeautifulSoup's find_all(tag, class_=class_name) over descendants."""
+    found = []
+    if elem is None:
+        raise AttributeError(f"Cannot search for <{tag}> in a missing element")
+    for candidate in elem.iterdescendants(tag):
+        if class_name is not None:
+            classes = candidate.get('class')
+            if not classes or class_name not in classes.split():
+                continue
+        found.append(candidate)
+        if limit and len(found) == limit:
+            break
+    return found
+
+
+def _find(elem, tag, class_name=None):
+    """Equivalent of BeautifulSoup's find(tag, class_=class_name)."""
+    return _first(_find_all(elem, tag, class_name, limit=1))
+
+
+def _first(nodes):
+    return nodes[0] if nodes else None
+
+
+def _text(node):
+    """Equivalent of BeautifulSoup's .text for an element or a text node."""
+    return node if isinstance(node, str) else _STRING(node)
+
+
+def _next_sibling(elem):
+    """Equivalent of BeautifulSoup's .next_sibling: the tail text if any, else the next element."""
+    return elem.tail if elem.tail is not None else elem.getnext()
+
+
+def _next_element_sibling(elem):
+    """Equivalent of BeautifulSoup's .find_next_sibling(): skips comments and text."""
+    sibling = elem.getnext()
+    while sibling is not None and not isinstance(sibling.tag, str):
+        sibling = sibling.getnext()
+    return sibling
+
+
+def _parse_region(html_content, marker, open_tag, close_tag=None):
+    """Parses only the part of the page that contains marker, or the whole page if it isn't found."""
+    index = html_content.find(marker)
+    if index != -1:
+        start = html_content.rfind(open_tag, 0, index)
+        end = html_content.find(close_tag, index) if close_tag else len(html_content)
+        if start != -1 and end != -1:
+            html_content = html_content[start:end + len(close_tag or "")]
+    return etree.HTML(html_content)
+
+
+def parse_release_stats(html_content):
+    """Parses the statistics section of a release page."""
+    root = _parse_region(html_content, 'id="release-stats"', '<section', '</section>')
+    stats_section = None
+    if root is not None:
+        stats_section = next((section for section in root.iter('section') if section.get('id') == 'release-stats'), None)
+    if stats_section is None:
+        logging.warning("Stats section not found in HTML content")
+        return ReleaseStats()
+    stats = ReleaseStats()
+
+    for li in _find_all(stats_section, 'li'):
+        key_element = _find(li, 'span')
+        key = _text(key_element).strip(':').strip()
+        field = RELEASE_STAT_FIELDS.get(key)
+        if field is None:
+            continue
+        value_text = _text(_next_sibling(key_element)).strip()
+
+        if key == 'Last Sold':
+            value = safe_parse_date(value_text)
+        elif key in ['Have', 'Want', 'Ratings']:
+            value = safe_parse_int(value_text)
+        elif key == 'Avg Rating':
+            value = safe_parse_float(value_text.split('/')[0].strip())
+        else:
+            value = safe_parse_price(value_text)[1]
+
+        setattr(stats, field, value)
+
+    return stats
+
+
+def parse_members_data(html_content):
+    """Parses the have and want member lists of a release stats page."""
+    root = _parse_region(html_content, 'release_stats_group', '<div')
+    stats_groups = _find_all(root, 'div', 'release_stats_group') if root is not None else []
+    members_have, members_want = [], []
+
+    if len(stats_groups) >= 2:
+        members_have = _parse_members(stats_groups[1])
+        if len(stats_groups) >= 3:
+            members_want = _parse_members(stats_groups[2])
+    return members_have, members_want
+
+
+def _parse_members(stats_group):
+    members_list = next(ul for ul in stats_group.iterdescendants('ul') if ul.get('role') == 'list')
+    return [sys.intern(_text(_find(member, 'a')).strip()) for member in _find_all(members_list, 'li')]
+
+
+def parse_items_for_sale(html_content):
+    """Parses the marketplace listings table of a seller or sell/release page."""
+    root = _parse_region(html_content, _ITEMS_TABLE_CLASS, '<table', '</table>')
+    table = next(table for table in root.iter('table') if table.get('class') == _ITEMS_TABLE_CLASS)
+    return [parse_item_row(row) for row in _find_all(_find(table, 'tbody'), 'tr', 'shortcut_navigable')]
+
+
+def parse_pagination_total(html_content):
+    """Returns the total number of listings from a marketplace page's pagination header, or None."""
+    match = _PAGINATION_TOTAL_PATTERN.search(html_content)
+    return int(match.group(1).replace(',', '')) if match else None
+
+
+def parse_listing_ids(html_content):
+    """Returns the marketplace listing ids linked from a page, without building a tree."""
+    return [int(listing_id) for listing_id in _LISTING_LINK_PATTERN.findall(html_content)]
+
+
+def parse_item_row(row):
+    item = Listing()
+    # Parsing image and community data
+    item_picture_cell = _find(row, 'td', 'item_picture')
+    image_tag = _find(item_picture_cell, 'img')
+    item.image_url = image_tag.get('src') if image_tag is not None else None
+
+    # Release the listing belongs to, needed when parsing a seller's inventory
+    release_match = _DIGITS_PATTERN.search(row.get('data-release-id', ''))
+    if not release_match:
+        release_link = next((a for a in item_picture_cell.iterdescendants('a') if _RELEASE_LINK_PATTERN.match(a.get('href', ''))), None)
+        release_match = _RELEASE_LINK_PATTERN.match(release_link.get('href')) if release_link is not None else None
+    item.release_id = int(release_match.group(1)) if release_match else None
+
+    # Community ratings, have, want
+    community_data = _find(item_picture_cell, 'div', 'community_data_text')
+    if community_data is not None:
+        rating_strong = _find(community_data, 'strong')
+        item.rating = float(_text(rating_strong)) if rating_strong is not None else None
+        community_results = _find_all(community_data, 'div', 'community_result', limit=2)
+        item.have = int(_text(_find(community_results[0], 'span', 'community_number')).strip()) if len(community_results) > 0 else None
+        item.want = int(_text(_find(community_results[1], 'span', 'community_number')).strip()) if len(community_results) > 1 else None
+
+    # Description, label, cat#
+    item_description_cell = _find(row, 'td', 'item_description')
+    title_link = _find(item_description_cell, 'a', 'item_description_title')
+    item.title = _text(title_link) if title_link is not None else None
+    listing_match = _LISTING_ID_PATTERN.search(title_link.get('href', '')) if title_link is not None else None
+    item.listing_id = int(listing_match.group(1)) if listing_match else None
+    label_and_cat = _find(item_description_cell, 'p', 'label_and_cat')
+    label_link = _find(label_and_cat, 'a') if label_and_cat is not None else None
+    item.label = _text(label_link) if label_link is not None else None
+    catno_span = _find(label_and_cat, 'span', 'item_catno') if label_and_cat is not None else None
+    item.catno = _text(catno_span) if catno_span is not None else None
+
+    # Media condition is the element following the last "mplabel" span
+    item.media_condition = None
+    item.media_condition_description = None
+    mplabel_spans = _find_all(item_description_cell, 'span', 'mplabel')
+    media_condition_span = _next_element_sibling(mplabel_spans[-1]) if mplabel_spans else None
+    if media_condition_span is not None:
+        item.media_condition = _text(media_condition_span).strip().split('\n')[0]
+        description_span = _find(media_condition_span, 'span', 'has-tooltip')
+        if description_span is not None:
+            item.media_condition_description = (
+                description_span.get('title') or _text(_find(description_span, 'span', 'tooltip-inner')).strip()
+            )
+
+    # Seller info
+    seller_info_cell = _find(row, 'td', 'seller_info')
+    seller_link = _find(seller_info_cell, 'a')
+    item.seller = sys.intern(_text(seller_link)) if seller_link is not None else None
+    seller_rating_span = _find(seller_info_cell, 'span', 'star_rating')
+    if seller_rating_span is not None:
+        rating_match = _RATING_PATTERN.search(seller_rating_span.get('alt'))
+        item.seller_rating = float(rating_match.group(1)) if rating_match else None
+    else:
+        item.seller_rating = None
+
+    ships_from_span = next(
+        (span for span in seller_info_cell.iterdescendants('span') if span.text == 'Ships From:' and len(span) == 0),
+        None,
+    )
+    item.ships_from = ships_from_span.tail.strip() if ships_from_span is not None and ships_from_span.tail else None
+
+    # Price
+    price_span = _find(_find(row, 'td', 'item_price'), 'span', 'price')
+    if price_span is not None:
+        item.currency, item.price = safe_parse_price(_text(price_span).strip())
+    else:
+        item.price = None
+        item.currency = None
+
+    return item
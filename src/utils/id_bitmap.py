@@ -0,0 +1,64 @@
+import logging
+import os
+import threading
+import zlib
+
+# Number of set bits in each byte value, for counting with bytes.translate
+_POPCOUNT = bytes(bin(value).count("1") for value in range(256))
+
+
+class IdBitmap:
+    """Set of non-negative integer ids stored as one bit per id.
+
+    Discogs release ids are dense, so even tens of millions of ids take a few
+    megabytes and membership checks are a single byte lookup. The bitmap is
+    saved zlib-compressed to ``path`` (atomically, via a temporary file) and
+    loaded from it again on start.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.bits = bytearray()
+        self.count = 0
+        self.lock = threading.Lock()
+        if self.path and os.path.exists(self.path):
+            self.load()
+
+    def __contains__(self, id_):
+        byte, bit = divmod(id_, 8)
+        return byte < len(self.bits) and bool(self.bits[byte] >> bit & 1)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, id_):
+        byte, bit = divmod(id_, 8)
+        with self.lock:
+            if byte >= len(self.bits):
+                # Grow by at least a quarter so sequential ids don't reallocate every time
+                self.bits.extend(bytes(max(byte + 1 - len(self.bits), len(self.bits) // 4)))
+            mask = 1 << bit
+            if not self.bits[byte] & mask:
+                self.bits[byte] |= mask
+                self.count += 1
+
+    def update(self, ids):
+        for id_ in ids:
+            self.add(id_)
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            bits = bytearray(zlib.decompress(f.read()))
+        with self.lock:
+            self.bits = bits
+            self.count = sum(bits.translate(_POPCOUNT))
+        logging.info(f"Loaded {self.count} ids from {self.path}")
+
+    def save(self):
+        with self.lock:
+            data = zlib.compress(bytes(self.bits), 1)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+        logging.info(f"Saved {self.count} ids to {self.path}")
@@ -0,0 +1,269 @@
+"""Per-stage counters and latency histograms for loading and scraping.
+
+Stages (decompress, parse, serialize, insert, fetch, html_parse, db_write_*)
+are timed into the module level ``metrics`` registry, which can be dumped
+periodically as a Prometheus text file (or JSON when the path ends in .json)
+and summarised in the log at the end of a run. ``SamplingProfiler`` samples
+the stacks of every thread and writes them as collapsed stacks, which
+flamegraph.pl and speedscope read. ``instrumented()`` turns both on from the
+environment.
+"""
+import bisect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+# Where to dump metrics, e.g. metrics.prom or metrics.json; unset disables the dump
+METRICS_PATH = os.getenv("METRICS_PATH")
+METRICS_INTERVAL_SECONDS = float(os.getenv("METRICS_INTERVAL_SECONDS", 30))
+# Where to write sampled stacks; unset disables the profiler
+PROFILE_PATH = os.getenv("PROFILE_PATH")
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_SECONDS", 0.01))
+METRICS_PREFIX = "discogs"
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Upper bound of the bucket the q-th quantile falls in (the largest value for the last bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def cumulative_counts(self):
+        counts, seen = [], 0
+        for count in self.counts:
+            seen += count
+            counts.append(seen)
+        return counts
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = Counter()
+            self.histograms = {}
+            self.started = time.time()
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage):
+        """Decorator timing every call of a function as stage."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "uptime_seconds": time.time() - self.started,
+                "counters": dict(self.counters),
+                "stages": {
+                    stage: {
+                        "count": histogram.count,
+                        "sum_seconds": histogram.sum,
+                        "p50_seconds": histogram.quantile(0.5),
+                        "p99_seconds": histogram.quantile(0.99),
+                        "max_seconds": histogram.max,
+                        "buckets": dict(zip([*map(str, histogram.buckets), "+Inf"], histogram.cumulative_counts())),
+                    }
+                    for stage, histogram in self.histograms.items()
+                },
+            }
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = [
+            f"# TYPE {METRICS_PREFIX}_uptime_seconds gauge",
+            f"{METRICS_PREFIX}_uptime_seconds {snapshot['uptime_seconds']:.3f}",
+        ]
+        for name, value in sorted(snapshot["counters"].items()):
+            lines += [f"# TYPE {METRICS_PREFIX}_{name}_total counter", f"{METRICS_PREFIX}_{name}_total {value}"]
+        if snapshot["stages"]:
+            histogram = f"{METRICS_PREFIX}_stage_seconds"
+            lines.append(f"# TYPE {histogram} histogram")
+            for stage, stats in sorted(snapshot["stages"].items()):
+                for bound, count in stats["buckets"].items():
+                    lines.append(f'{histogram}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'{histogram}_sum{{stage="{stage}"}} {stats["sum_seconds"]:.6f}')
+                lines.append(f'{histogram}_count{{stage="{stage}"}} {stats["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """Writes the metrics to path, as JSON if it ends in .json and in Prometheus text format otherwise."""
+        content = json.dumps(self.snapshot(), indent=2) if path.endswith(".json") else self.to_prometheus()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def log_summary(self):
+        snapshot = self.snapshot()
+        for stage, stats in sorted(snapshot["stages"].items()):
+            logging.info(
+                "Stage %s: %d calls, %.2fs total, p50 %.4fs, p99 %.4fs, max %.4fs", stage, stats["count"],
+                stats["sum_seconds"], stats["p50_seconds"], stats["p99_seconds"], stats["max_seconds"],
+            )
+        if snapshot["counters"]:
+            logging.info("Counters: %s", ", ".join(f"{name}={value}" for name, value in sorted(snapshot["counters"].items())))
+
+
+metrics = Metrics()
+
+
+class TimedReader:
+    """File wrapper timing each read() as stage and counting the bytes read, e.g. to time gzip decompression."""
+
+    def __init__(self, file, stage, registry=metrics):
+        self.file = file
+        self.stage = stage
+        self.registry = registry
+
+    def read(self, size=-1):
+        start = time.perf_counter()
+        data = self.file.read(size)
+        self.registry.observe(self.stage, time.perf_counter() - start)
+        self.registry.inc(f"{self.stage}_bytes", len(data))
+        return data
+
+
+class MetricsDumper(threading.Thread):
+    """Dumps metrics to path every interval seconds, and once more when stopped."""
+
+    def __init__(self, path, interval=METRICS_INTERVAL_SECONDS, registry=metrics):
+        super().__init__(name="MetricsDumper", daemon=True)
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self._dump()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self._dump()
+
+    def _dump(self):
+        try:
+            self.registry.dump(self.path)
+        except Exception as e:
+            logging.error(f"Failed to dump metrics to {self.path}: {e}")
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class SamplingProfiler(threading.Thread):
+    """Samples the stack of every other thread each interval seconds.
+
+    Only the current process is sampled, not the parse worker processes. The
+    samples are written as collapsed stacks, one "frame;frame;frame count"
+    line per distinct stack.
+    """
+
+    def __init__(self, path, interval=PROFILE_INTERVAL_SECONDS):
+        super().__init__(name="SamplingProfiler", daemon=True)
+        self.path = path
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != self.ident:
+                    self.samples[_collapse(frame)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        with open(self.path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        logging.info(f"Wrote {sum(self.samples.values())} profile samples to {self.path}")
+
+
+def suffixed(path, suffix):
+    """Returns path with suffix inserted before its extension, e.g. metrics.prom -> metrics.release.prom."""
+    if not path:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{suffix}{extension}"
+
+
+@contextmanager
+def instrumented(metrics_path=METRICS_PATH, profile_path=PROFILE_PATH):
+    """Dumps metrics periodically and runs the sampling profiler while the block runs, if configured."""
+    dumper = MetricsDumper(metrics_path) if metrics_path else None
+    profiler = SamplingProfiler(profile_path) if profile_path else None
+    for thread in (dumper, profiler):
+        if thread:
+            thread.start()
+    try:
+        yield metrics
+    finally:
+        for thread in (profiler, dumper):
+            if thread:
+                thread.stop()
+        metrics.log_summary()
@@ -0,0 +1,330 @@
+"""Fuzzy search of artist names and name variations, as a memory-mapped trigram index.
+
+NameIndexBuilder is a data store that collects the names of the artist
+records parse_xml inserts (put it next to the real data store with
+TeeDataStore). Names are normalized (case folded, accents, punctuation and
+Discogs' " (2)" suffixes removed) and split into pg_trgm style trigrams.
+finish() writes an inverted index: the sorted trigram hashes, each with a
+sorted list of the names containing it, plus the names and their artist ids.
+NameIndex memory-maps that file and ranks names by trigram similarity,
+|shared| / |query ∪ name| as in pg_trgm's similarity().
+
+Names are numbered by their number of trigrams, so the names long enough and
+short enough to reach a similarity are one range of ids, cut out of each
+posting list by bisecting. A name reaching a similarity also shares at least
+that share of the query's trigrams, so it shares one of the rarest few
+(prefix filtering); only those postings are counted, and the candidates are
+checked against the other trigrams by bisecting their postings, dropping a
+name as soon as it can't reach the bar. Searches start with a high bar and
+lower it until limit artists are found, so close matches rarely read the
+postings of common trigrams. Each pass counts at most
+NAME_SEARCH_MAX_POSTINGS postings and checks at most NAME_SEARCH_CANDIDATES
+names, so a weak match can be missed in a large index, but no query is slow.
+"""
+import argparse
+import bisect
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+from itertools import accumulate, chain, repeat
+import logging
+import math
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+import sys
+import unicodedata
+import zlib
+from array import array
+from operator import itemgetter
+from models.sinks.db import BaseDataStore
+from models.sinks.shard_cache import ShardReader
+
+NAME_SEARCH_LIMIT = int(os.getenv("NAME_SEARCH_LIMIT", 5))
+# Names less similar than this to the query aren't returned (pg_trgm's default)
+NAME_SEARCH_MIN_SIMILARITY = float(os.getenv("NAME_SEARCH_MIN_SIMILARITY", 0.3))
+# Postings counted and names checked per search pass; past these a pass ignores names
+# sharing only the query's commonest trigrams, and checks the names sharing the most
+NAME_SEARCH_MAX_POSTINGS = int(os.getenv("NAME_SEARCH_MAX_POSTINGS", 20000))
+NAME_SEARCH_CANDIDATES = int(os.getenv("NAME_SEARCH_CANDIDATES", 200))
+# Similarity bars tried before min_similarity
+SIMILARITY_STEPS = (0.9, 0.7, 0.5)
+MAGIC = b"DNMI"
+# magic, version, trigram count, posting count, name count, bytes of names, most trigrams in a name
+HEADER = struct.Struct("<4sBQQQQQ")
+HEADER_SIZE = 64
+DISAMBIGUATION = re.compile(r"\s*\(\d+\)\s*$")
+NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize(name):
+    """Lower case words of name without accents, punctuation or a trailing " (2)"."""
+    name = unicodedata.normalize("NFKD", DISAMBIGUATION.sub("", name).casefold())
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    return " ".join(NON_WORD.sub(" ", name).split())
+
+
+def trigrams(normalized):
+    """Hashes of the trigrams of each word, padded like pg_trgm ("  ab" ... "ab ")."""
+    return {
+        zlib.crc32(f"  {word} "[i:i + 3].encode())
+        for word in normalized.split()
+        for i in range(len(word) + 1)
+    }
+
+
+def title_artist(title):
+    """The artist part of a marketplace listing title ("Artist - Title (LP, Album)")."""
+    artist, separator, _ = title.partition(" - ")
+    return artist if separator else title
+
+
+class NameIndexBuilder(BaseDataStore):
+    def __init__(self, path):
+        self.path = path
+        # Trigram hash -> ids of the names containing it, appended in order so already sorted
+        self.postings = {}
+        self.artist_ids = array("I")
+        self.trigram_counts = array("I")
+        self.names = []
+
+    def connect(self):
+        pass
+
+    def insert(self, records):
+        for record in records:
+            if record.get("id") is None:
+                continue
+            seen = set()
+            for name in [record.get("name")] + (record.get("namevariations") or []):
+                normalized = normalize(name) if name else ""
+                if not normalized or normalized in seen:
+                    continue
+                seen.add(normalized)
+                self._add(record["id"], name, trigrams(normalized))
+
+    def _add(self, artist_id, name, grams):
+        name_id = len(self.artist_ids)
+        for gram in grams:
+            postings = self.postings.get(gram)
+            if postings is None:
+                postings = self.postings[gram] = array("I")
+            postings.append(name_id)
+        self.artist_ids.append(artist_id)
+        self.trigram_counts.append(len(grams))
+        self.names.append(name)
+
+    def finish(self):
+        """Writes the index to path and returns it opened as a NameIndex."""
+        count, longest = len(self.artist_ids), max(self.trigram_counts, default=0)
+        # Renumber the names by trigram count; names with n trigrams get ids length_starts[n]...
+        sizes = array("I", bytes(4 * (longest + 2)))
+        for trigram_count in self.trigram_counts:
+            sizes[trigram_count + 1] += 1
+        length_starts = array("I", accumulate(sizes))
+        next_ids = array("I", length_starts)
+        new_ids, order = array("I", bytes(4 * count)), array("I", bytes(4 * count))
+        for name_id, trigram_count in enumerate(self.trigram_counts):
+            new_ids[name_id] = next_ids[trigram_count]
+            order[next_ids[trigram_count]] = name_id
+            next_ids[trigram_count] += 1
+
+        keys = array("I", sorted(self.postings))
+        offsets = array("I", [0])
+        names = [self.names[name_id].encode() for name_id in order]
+        name_offsets = array("Q", accumulate(map(len, names), initial=0))
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, 1, len(keys), sum(map(len, self.postings.values())), count,
+                                name_offsets[-1], longest).ljust(HEADER_SIZE, b"\0"))
+            # 8 byte sections first, so every section stays aligned
+            name_offsets.tofile(f)
+            keys.tofile(f)
+            for key in keys:
+                postings = array("I", sorted(new_ids[name_id] for name_id in self.postings.pop(key)))
+                offsets.append(offsets[-1] + len(postings))
+                postings.tofile(f)
+            offsets.tofile(f)
+            array("I", (self.artist_ids[name_id] for name_id in order)).tofile(f)
+            length_starts.tofile(f)
+            f.writelines(names)
+        os.replace(tmp_path, self.path)
+        logging.info(f"Wrote name index of {count} names and {len(keys)} trigrams to {self.path}")
+        self.postings, self.names = {}, []
+        self.artist_ids, self.trigram_counts = array("I"), array("I")
+        return NameIndex(self.path)
+
+
+# Opened in each search worker process by _open_index
+_index = None
+
+
+def _open_index(path):
+    global _index
+    _index = NameIndex(path)
+
+
+def _search_chunk(queries, limit, min_similarity):
+    return [_index.search(query, limit, min_similarity) for query in queries]
+
+
+class NameIndex:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, trigram_count, posting_count, name_count, names_size, self.longest = \
+            HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or version != 1:
+            raise ValueError(f"{path} is not a name index")
+        view = memoryview(self.mmap)
+        self.views = []
+        position = HEADER_SIZE
+
+        def section(code, count):
+            nonlocal position
+            size = count * array(code).itemsize
+            part = view[position:position + size].cast(code)
+            position += size
+            self.views.append(part)
+            return part
+
+        self.name_offsets = section("Q", name_count + 1)
+        self.keys = section("I", trigram_count)
+        self.postings = section("I", posting_count)
+        self.offsets = section("I", trigram_count + 1)
+        self.artist_ids = section("I", name_count)
+        self.length_starts = section("I", self.longest + 2)
+        self.names = section("B", names_size)
+
+    def __len__(self):
+        """Number of names."""
+        return len(self.artist_ids)
+
+    def name(self, name_id):
+        return bytes(self.names[self.name_offsets[name_id]:self.name_offsets[name_id + 1]]).decode()
+
+    def _postings(self, gram):
+        i = bisect.bisect_left(self.keys, gram)
+        if i == len(self.keys) or self.keys[i] != gram:
+            return self.postings[0:0]
+        return self.postings[self.offsets[i]:self.offsets[i + 1]]
+
+    def trigram_count(self, name_id):
+        return bisect.bisect_right(self.length_starts, name_id) - 1
+
+    def search(self, query, limit=NAME_SEARCH_LIMIT, min_similarity=NAME_SEARCH_MIN_SIMILARITY):
+        """(artist id, name, similarity) of the artists named most like query, best first.
+
+        Each artist appears once, with the best matching of its name and name variations.
+        """
+        grams = trigrams(normalize(query or ""))
+        if not grams:
+            return []
+        rows = sorted((self._postings(gram) for gram in grams), key=len)
+        best = {}
+        for threshold in [step for step in SIMILARITY_STEPS if step > min_similarity] + [min_similarity]:
+            self._search_pass(rows, threshold, best)
+            if len(best) >= limit:
+                break
+        top = heapq.nlargest(limit, best.items(), key=lambda item: (item[1][0], -item[0]))
+        return [(artist_id, self.name(name_id), round(similarity, 4)) for artist_id, (similarity, name_id) in top]
+
+    def _search_pass(self, rows, threshold, best):
+        """Adds the names at least threshold similar to the query whose trigrams' postings are rows to best."""
+        size = len(rows)
+        needed = max(1, math.ceil(threshold * size - 1e-9))
+        # similarity <= min(size, n) / max(size, n), so n trigrams from needed to size / threshold
+        longest = int(size / threshold + 1e-9) if threshold > 0 else self.longest
+        low = self.length_starts[min(needed, self.longest + 1)]
+        high = self.length_starts[min(longest, self.longest) + 1]
+        shared = Counter()
+        counted, scanned = 0, 0
+        for row in rows[:size - needed + 1]:
+            part = row[bisect.bisect_left(row, low):bisect.bisect_left(row, high)]
+            if counted and scanned + len(part) > NAME_SEARCH_MAX_POSTINGS:
+                break
+            shared.update(part)
+            scanned += len(part)
+            counted += 1
+
+        rest = rows[counted:]
+        candidates = shared.items()
+        if len(shared) > NAME_SEARCH_CANDIDATES:
+            candidates = heapq.nlargest(NAME_SEARCH_CANDIDATES, candidates, key=itemgetter(1))
+        for name_id, count in candidates:
+            name_size = self.trigram_count(name_id)
+            # shared / (size + name_size - shared) >= threshold needs this many shared trigrams
+            misses = count + len(rest) - math.ceil(threshold * (size + name_size) / (1 + threshold) - 1e-9)
+            for row in rest:
+                if misses < 0:
+                    break
+                i = bisect.bisect_left(row, name_id)
+                if i < len(row) and row[i] == name_id:
+                    count += 1
+                else:
+                    misses -= 1
+            if misses < 0:
+                continue
+            similarity = count / (size + name_size - count)
+            artist_id = self.artist_ids[name_id]
+            if similarity >= threshold and similarity > best.get(artist_id, (0, None))[0]:
+                best[artist_id] = (similarity, name_id)
+
+    def search_many(self, queries, limit=NAME_SEARCH_LIMIT, min_similarity=NAME_SEARCH_MIN_SIMILARITY, workers=1):
+        """search() of each query, in order; repeated queries (after normalizing) are only searched once.
+
+        With workers > 1 the queries are split over that many processes, each
+        mapping the same index file.
+        """
+        keys = [normalize(query or "") for query in queries]
+        unique = list(dict.fromkeys(keys))
+        if workers > 1 and len(unique) > 1:
+            chunk = math.ceil(len(unique) / workers)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_open_index, initargs=(self.path,)) as executor:
+                chunks = executor.map(_search_chunk, [unique[i:i + chunk] for i in range(0, len(unique), chunk)],
+                                      repeat(limit), repeat(min_similarity))
+                results = dict(zip(unique, chain.from_iterable(chunks)))
+        else:
+            results = {key: self.search(key, limit, min_similarity) for key in unique}
+        return [results[key] for key in keys]
+
+    def close(self):
+        for part in self.views:
+            part.release()
+        self.mmap.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an artist name index from a parse cache, or search one.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="index the names of the artists in a parse cache")
+    build.add_argument("cache_dir", help="parse cache of an artists dump (PARSE_CACHE_DIR/artists)")
+    build.add_argument("path")
+    search = commands.add_parser("search", help="print the artists named most like each query")
+    search.add_argument("path")
+    search.add_argument("queries", nargs="+")
+    search.add_argument("--limit", type=int, default=NAME_SEARCH_LIMIT)
+    search.add_argument("--min-similarity", type=float, default=NAME_SEARCH_MIN_SIMILARITY)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.command == "build":
+        builder = NameIndexBuilder(args.path)
+        builder.insert(ShardReader(args.cache_dir))
+        builder.finish().close()
+        return
+    index = NameIndex(args.path)
+    for query, matches in zip(args.queries, index.search_many(args.queries, args.limit, args.min_similarity)):
+        if not matches:
+            print(f"No artist named like {query!r}", file=sys.stderr)
+        for artist_id, name, similarity in matches:
+            print(f"{query}\t{artist_id}\t{name}\t{similarity}")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+DEFAULT_TTLS = {
+    "release": 7 * 24 * 3600,
+    "stats": 24 * 3600,
+    "sellers": 6 * 3600,
+}
+
+
+class PageCache:
+    """On-disk cache of fetched Discogs pages.
+
+    Entries are keyed by a hash of the URL and stored as a small JSON header
+    followed by the zlib-compressed body. Each page type can have its own TTL,
+    the total size on disk is bounded by evicting the least recently used
+    entries, and ``offline`` mode serves cached pages regardless of age and
+    never goes to the network.
+    """
+
+    HEADER_SEPARATOR = b"\n"
+
+    def __init__(self, cache_dir, ttls=None, max_bytes=None, offline=False, compression_level=6):
+        self.cache_dir = cache_dir
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.compression_level = compression_level
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.total_bytes = self._scan_size()
+        logging.info(f"Initializing PageCache at {self.cache_dir} ({self.total_bytes} bytes, offline={self.offline})")
+
+    def _key(self, url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _path(self, url):
+        key = self._key(url)
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _entries(self):
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    yield entry
+
+    def _scan_size(self):
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def get(self, url, page_type=None):
+        """Returns the cached body for url, or None if missing or expired."""
+        path = self._path(url)
+        try:
+            with open(path, "rb") as file:
+                raw = file.read()
+        except FileNotFoundError:
+            self._record(hit=False)
+            return None
+        except OSError as e:
+            logging.error(f"Failed to read cache entry for {url}: {e}")
+            self._record(hit=False)
+            return None
+
+        try:
+            header_raw, body = raw.split(self.HEADER_SEPARATOR, 1)
+            header = json.loads(header_raw)
+            ttl = self.ttls.get(page_type or header.get("page_type"))
+            if not self.offline and ttl is not None and time.time() - header["fetched_at"] > ttl:
+                logging.debug(f"Cache entry expired for {url}")
+                self._record(hit=False)
+                return None
+            content = zlib.decompress(body).decode("utf-8")
+        except (ValueError, KeyError, zlib.error) as e:
+            logging.warning(f"Discarding corrupt cache entry for {url}: {e}")
+            self._remove(path)
+            self._record(hit=False)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._record(hit=True)
+        return content
+
+    def set(self, url, content, page_type=None):
+        """Stores content for url, evicting old entries if over max_bytes."""
+        path = self._path(url)
+        header = json.dumps({"url": url, "page_type": page_type, "fetched_at": time.time()}).encode("utf-8")
+        payload = header + self.HEADER_SEPARATOR + zlib.compress(content.encode("utf-8"), self.compression_level)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(tmp_path, "wb") as file:
+                file.write(payload)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.error(f"Failed to write cache entry for {url}: {e}")
+            self._remove(tmp_path)
+            return
+
+        with self.lock:
+            self.total_bytes += len(payload) - previous_size
+            over_limit = self.max_bytes is not None and self.total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the cache is at 90% of max_bytes."""
+        if self.max_bytes is None:
+            return
+        target = int(self.max_bytes * 0.9)
+        with self.lock:
+            entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+            total = sum(entry.stat().st_size for entry in entries)
+            removed = 0
+            for entry in entries:
+                if total <= target:
+                    break
+                size = entry.stat().st_size
+                if self._remove(entry.path):
+                    total -= size
+                    removed += 1
+            self.total_bytes = total
+        logging.info(f"Evicted {removed} cache entries, cache size is now {total} bytes.")
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def _record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
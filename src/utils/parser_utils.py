@@ -0,0 +1,36 @@
+from datetime import datetime
+import re
+
+
+def safe_parse_int(value_str):
+    """Safely parses integers, accounting for '--' or empty strings."""
+    try:
+        return int(value_str.replace(',', '')) if value_str.strip() and value_str != '--' else None
+    except ValueError:
+        return None
+
+def safe_parse_float(value_str):
+    """Safely parses floats, accounting for '--' or empty strings."""
+    try:
+        return float(value_str) if value_str.strip() and value_str != '--' else None
+    except ValueError:
+        return None
+
+def safe_parse_date(date_str):
+    """Safely parses dates, accounting for 'Never'."""
+    try:
+        return datetime.strptime(date_str, '%b %d, %Y').date() if date_str.strip().lower() != 'never' else None
+    except ValueError:
+        return None
+
+def safe_parse_price(price_text):
+    """Safely parses price text to extract currency and value, handling edge cases."""
+    match = re.match(r'([^\d]*)(\d+[\.,]?\d*)', price_text.replace(',', '.'))
+    if match:
+        currency = match.group(1).strip() if match.group(1) else None
+        try:
+            price = float(match.group(2)) if match.group(2) else None
+        except ValueError:
+            price = None
+        return currency, price
+    return None, None
@@ -5,7 +5,9 @@ from tqdm import tqdm
 import gzip
 from lxml import etree
 import os
+import time
 from dotenv import load_dotenv
+from utils.metrics import metrics, TimedReader
 
 load_dotenv()
 
@@ -26,7 +28,7 @@ def log_method(func):
 class XMLDataHandler:
     def __init__(self, url, destination_dir="./",
                  data_store=None, parser_class=None,
-                 keep_file=False):
+                 keep_file=False, record_filter=None, bandwidth=None):
         self.url = url
         self.destination_dir = destination_dir
         self.filename = self._get_filename_from_url()
@@ -34,6 +36,11 @@ class XMLDataHandler:
         self.data_store = data_store
         self.parser_class = parser_class
         self.keep_file = keep_file
+        # Optional RecordFilter; records it rejects are skipped before being parsed. Only
+        # the criteria this dump's records carry apply, so artists and labels aren't filtered.
+        self.record_filter = record_filter.for_kind(parser_class.name) if record_filter and parser_class else None
+        # Optional TokenBucket of bytes/sec shared with other concurrent downloads
+        self.bandwidth = bandwidth
 
     def _get_filename_from_url(self):
         parsed_url = urlparse(self.url)
@@ -46,9 +53,11 @@ class XMLDataHandler:
             logging.info(f"File already exists: {self.filepath}")
             return
         logging.info(f"Downloading {self.parser_class.name} file to {self.filepath}")
+        # Download under another name so an interrupted download isn't taken for the whole file
+        partial_path = f"{self.filepath}.part"
         with (
             requests.get(self.url, stream=True) as response,
-            open(self.filepath, "wb") as file,
+            open(partial_path, "wb") as file,
             tqdm(
                 desc="Downloading",
                 total=int(response.headers.get("content-length", 0)),
@@ -56,36 +65,55 @@ class XMLDataHandler:
                 unit_scale=True,
             ) as progress_bar,
         ):
-            for chunk in response.iter_content(chunk_size=4096):
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=65536):
+                if self.bandwidth:
+                    self.bandwidth.consume(len(chunk))
                 file.write(chunk)
                 progress_bar.update(len(chunk))
+        os.replace(partial_path, self.filepath)
 
     def parse_xml(self):
+        """Loads every record into the data store; returns the number loaded, or None if parsing failed."""
         if not self.parser_class:
             raise ValueError("Parser class not defined.")
         data_batch = []
         count = 0
+        skipped = 0
+        record_filter = self.record_filter
         logging.info(f"Beginning XML parsing for {self.parser_class.name}")
         try:
             with gzip.open(self.filepath, "rb") as gz_file:
-                for _, elem in etree.iterparse(gz_file, events=("end",), tag=self.parser_class.name):
-                    parsed_data = self.parser_class.parse(elem)
-                    data_batch.append(parsed_data)  
+                for _, elem in etree.iterparse(TimedReader(gz_file, "decompress"), events=("end",), tag=self.parser_class.name):
+                    parent = elem.getparent()
+                    # Only top level records; labels also nest <label> elements as sublabels.
+                    if parent is None or parent.getparent() is not None:
+                        continue
+                    if record_filter is None or record_filter(elem):
+                        start = time.perf_counter()
+                        parsed_data = self.parser_class.parse(elem)
+                        metrics.observe("parse", time.perf_counter() - start)
+                        data_batch.append(parsed_data)
+                        count += 1
+                    else:
+                        skipped += 1
+                    # Drop the record and the already parsed ones before it, so memory stays flat
                     elem.clear()
-                    count += 1
+                    while elem.getprevious() is not None:
+                        del parent[0]
 
                     if len(data_batch) >= BATCH_SIZE:
                         logging.info(
                             f"Inserting batch of {len(data_batch)} {self.parser_class.name}, total parsed: {count}"
                         )
-                        self.data_store.insert(data_batch)
+                        self._insert(data_batch)
                         data_batch = []
 
                 if data_batch:
                     logging.info(
                         f"Inserting final batch of {len(data_batch)} {self.parser_class.name}, total parsed: {count}"
                     )
-                    self.data_store.insert(data_batch)
+                    self._insert(data_batch)
 
             if not self.keep_file:
                 self.delete_file()
@@ -94,10 +122,21 @@ class XMLDataHandler:
             logging.info(
                 "XML parsing interrupted by user. Cleanup will not delete the file."
             )
+            return None
         except Exception as e:
             logging.error(f"Error during XML parsing or data insertion: {e}")
+            return None
 
+        if skipped:
+            metrics.inc(f"{self.parser_class.name}_filtered", skipped)
+            logging.info(f"Skipped {skipped} {self.parser_class.name} records rejected by the filter")
         logging.info(f"Completed XML parsing, total {self.parser_class.name} parsed: {count}")
+        return count
+
+    def _insert(self, data_batch):
+        with metrics.timer("insert"):
+            self.data_store.insert(data_batch)
+        metrics.inc(f"{self.parser_class.name}_records", len(data_batch))
 
     @log_method
     def delete_file(self):
@@ -108,13 +147,83 @@ class XMLDataHandler:
         except OSError as e:
             logging.error(f"Error deleting file {self.filepath}: {e}")
 
+class RecordFilter:
+    """Cheap checks on a record element, run before the parser so rejected records are never parsed.
+
+    A record passes if it matches every criterion given. genres, styles,
+    formats and countries match if the record has any of the values; years is
+    an inclusive (first, last) range checked against a release's release date
+    or a master's year. Records without a value for a criterion are rejected;
+    for_kind() drops the criteria a dump kind doesn't have.
+    """
+
+    def __init__(self, genres=None, styles=None, formats=None, countries=None, years=None):
+        self.genres = set(genres or ())
+        self.styles = set(styles or ())
+        self.formats = set(formats or ())
+        self.countries = set(countries or ())
+        self.years = years
+        # Single lookups first, so most records are rejected before the lists are walked
+        self.checks = [
+            check for check, enabled in (
+                (self._check_country, self.countries),
+                (self._check_year, self.years),
+                (self._check_genres, self.genres),
+                (self._check_formats, self.formats),
+                (self._check_styles, self.styles),
+            ) if enabled
+        ]
+
+    # The criteria each dump kind's records have values for
+    KIND_CRITERIA = {
+        "release": ("genres", "styles", "formats", "countries", "years"),
+        "master": ("genres", "styles", "years"),
+    }
+
+    def for_kind(self, kind):
+        """The filter to apply to a dump of kind, without the criteria its records lack; None if no criteria are left.
+
+        Records without a value for a criterion are rejected, so e.g. a genre
+        filter applied to the artist dump would load no artists at all.
+        """
+        criteria = {name: getattr(self, name) for name in self.KIND_CRITERIA.get(kind, ()) if getattr(self, name)}
+        ignored = [name for name in ("genres", "styles", "formats", "countries", "years")
+                   if getattr(self, name) and name not in criteria]
+        if ignored:
+            logging.info(f"Not filtering the {kind} dump by {', '.join(ignored)}: its records don't have them")
+        return RecordFilter(**criteria) if criteria else None
+
+    def __call__(self, elem):
+        for check in self.checks:
+            if not check(elem):
+                return False
+        return True
+
+    def _check_country(self, elem):
+        return elem.findtext("country") in self.countries
+
+    def _check_year(self, elem):
+        released = elem.findtext("released") or elem.findtext("year") or ""
+        year = released[:4]
+        return year.isdigit() and self.years[0] <= int(year) <= self.years[1]
+
+    def _check_genres(self, elem):
+        return any(genre.text in self.genres for genre in elem.iterfind("genres/genre"))
+
+    def _check_styles(self, elem):
+        return any(style.text in self.styles for style in elem.iterfind("styles/style"))
+
+    def _check_formats(self, elem):
+        return any(format_.get("name") in self.formats for format_ in elem.iterfind("formats/format"))
+
+
 class BaseParser:
     name = None
 
     def parse(self, elem):
         raise NotImplementedError("The parse method must be implemented by subclasses.")
     
-class ArtistParser:
+class ArtistParser(BaseParser):
     name = 'artist'
 
     @staticmethod
@@ -212,6 +321,7 @@ class ReleaseParser(BaseParser):
     def parse(elem):
         logging.debug("Parsing release data.")
         try:
+            master = elem.find("master_id")
             return {
                 "id": elem.attrib.get("id"),
                 "status": elem.attrib.get("status"),
@@ -220,13 +330,14 @@ class ReleaseParser(BaseParser):
                 "extraartists": ReleaseParser._parse_extra_artists(elem),
                 "labels": ReleaseParser._parse_labels(elem),
                 "formats": ReleaseParser._parse_formats(elem),
-                "genres": ReleaseParser._parse_elements(elem, ".//genre"),
-                "styles": ReleaseParser._parse_elements(elem, ".//style"),
+                "genres": ReleaseParser._parse_elements(elem, "genres/genre"),
+                "styles": ReleaseParser._parse_elements(elem, "styles/style"),
                 "country": elem.findtext("country"),
                 "released": elem.findtext("released"),
                 "notes": elem.findtext("notes"),
                 "data_quality": elem.findtext("data_quality"),
-                "master_id": ReleaseParser._get_attribute(elem.find("master_id"), "is_main_release"),
+                "master_id": master.text if master is not None else None,
+                "is_main_release": ReleaseParser._get_attribute(master, "is_main_release"),
                 "tracklist": ReleaseParser._parse_tracklist(elem),
                 "videos": ReleaseParser._parse_videos(elem),
                 "companies": ReleaseParser._parse_companies(elem),
@@ -236,99 +347,156 @@ class ReleaseParser(BaseParser):
             logging.error(f"Error parsing release: {e}")
             return {}
 
-    def _get_attribute(self, elem, attr_name):
+    @staticmethod
+    def _get_attribute(elem, attr_name):
         """Safely gets an attribute from an element, returning None if the element or attribute doesn't exist."""
         if elem is not None:
             return elem.attrib.get(attr_name)
         return None
 
-    def _parse_images(self):
+    @staticmethod
+    def _parse_images(elem):
         return [
             {
-                "type": self._get_attribute(image, "type"),
-                "uri": self._get_attribute(image, "uri"),
-                "uri150": self._get_attribute(image, "uri150"),
-                "width": self._get_attribute(image, "width"),
-                "height": self._get_attribute(image, "height"),
+                "type": image.get("type"),
+                "uri": image.get("uri"),
+                "uri150": image.get("uri150"),
+                "width": image.get("width"),
+                "height": image.get("height"),
             }
-            for image in self.root.findall(".//images/image")
+            for image in elem.findall("images/image")
         ]
 
-    def _parse_extra_artists(self):
+    @staticmethod
+    def _parse_extra_artists(elem):
         return [
             {
-                "id": artist.find("id").text if artist.find("id") is not None else None,
-                "name": (
-                    artist.find("name").text
-                    if artist.find("name") is not None
-                    else None
-                ),
-                "role": (
-                    artist.find("role").text
-                    if artist.find("role") is not None
-                    else None
-                ),
+                "id": artist.findtext("id"),
+                "name": artist.findtext("name"),
+                "role": artist.findtext("role"),
             }
-            for artist in self.root.findall(".//extraartists/artist")
+            for artist in elem.findall("extraartists/artist")
         ]
 
-    def _parse_formats(self):
+    @staticmethod
+    def _parse_formats(elem):
         return [
             {
-                "name": self._get_attribute(format_, "name"),
-                "qty": self._get_attribute(format_, "qty"),
+                "name": format_.get("name"),
+                "qty": format_.get("qty"),
                 "descriptions": [
-                    desc.text for desc in format_.findall(".//description") if desc.text
+                    desc.text for desc in format_.findall("descriptions/description") if desc.text
                 ],
             }
-            for format_ in self.root.findall(".//formats/format")
+            for format_ in elem.findall("formats/format")
         ]
 
-    def _parse_artists(self):
+    @staticmethod
+    def _parse_artists(elem):
         return [
-            {"id": artist.find("id").text, "name": artist.find("name").text}
-            for artist in self.root.findall(".//artists/artist")
+            {"id": artist.findtext("id"), "name": artist.findtext("name")}
+            for artist in elem.findall("artists/artist")
         ]
 
-    def _parse_labels(self):
+    @staticmethod
+    def _parse_labels(elem):
         return [
             {
                 "name": label.attrib.get("name"),
                 "catno": label.attrib.get("catno"),
                 "id": label.attrib.get("id"),
             }
-            for label in self.root.findall(".//labels/label")
+            for label in elem.findall("labels/label")
         ]
 
-    def _parse_elements(self, root, xpath):
-        return [element.text.strip() for element in root.findall(xpath) if element.text]
+    @staticmethod
+    def _parse_elements(elem, path):
+        return [element.text.strip() for element in elem.findall(path) if element.text]
 
-    def _parse_tracklist(self):
+    @staticmethod
+    def _parse_tracklist(elem):
         return [
             {
-                "position": track.find("position").text,
-                "title": track.find("title").text,
-                "duration": track.find("duration").text,
+                "position": track.findtext("position"),
+                "title": track.findtext("title"),
+                "duration": track.findtext("duration"),
             }
-            for track in self.root.findall(".//tracklist/track")
+            for track in elem.findall("tracklist/track")
         ]
 
-    def _parse_videos(self):
+    @staticmethod
+    def _parse_videos(elem):
         return [
             {
                 "src": video.attrib.get("src"),
-                "title": video.find("title").text,
-                "description": video.find("description").text,
+                "title": video.findtext("title"),
+                "description": video.findtext("description"),
             }
-            for video in self.root.findall(".//videos/video")
+            for video in elem.findall("videos/video")
         ]
 
-    def _parse_companies(self):
+    @staticmethod
+    def _parse_companies(elem):
         return [
             {
-                "id": company.find("id").text,
-                "name": company.find("name").text,
-                "entity_type_name": company.find("entity_type_name").text,
+                "id": company.findtext("id"),
+                "name": company.findtext("name"),
+                "entity_type_name": company.findtext("entity_type_name"),
             }
-            for company in self.root.findall(".//companies/company")
+            for company in elem.findall("companies/company")
         ]
+
+
+class LabelParser(BaseParser):
+    name = 'label'
+
+    @staticmethod
+    def parse(elem):
+        logging.debug("Parsing label data.")
+        try:
+            parent = elem.find("parentLabel")
+            return {
+                "id": int(elem.findtext("id")),
+                "name": elem.findtext("name"),
+                "contactinfo": elem.findtext("contactinfo"),
+                "profile": elem.findtext("profile"),
+                "data_quality": elem.findtext("data_quality"),
+                "urls": [url.text for url in elem.findall("urls/url")],
+                "sublabels": [
+                    {"id": int(label.get("id")), "name": label.text}
+                    for label in elem.findall("sublabels/label")
+                ],
+                "parent_label": {"id": int(parent.get("id")), "name": parent.text} if parent is not None else None,
+                "images": ArtistParser._parse_images(elem),
+            }
+        except Exception as e:
+            logging.error(f"Error parsing label: {e}")
+            return {}
+
+
+class MasterParser(BaseParser):
+    name = 'master'
+
+    @staticmethod
+    def parse(elem):
+        logging.debug("Parsing master data.")
+        try:
+            return {
+                "id": int(elem.get("id")),
+                "main_release": elem.findtext("main_release"),
+                "title": elem.findtext("title"),
+                "year": elem.findtext("year"),
+                "data_quality": elem.findtext("data_quality"),
+                "artists": ReleaseParser._parse_artists(elem),
+                "genres": ReleaseParser._parse_elements(elem, "genres/genre"),
+                "styles": ReleaseParser._parse_elements(elem, "styles/style"),
+                "videos": ReleaseParser._parse_videos(elem),
+                "images": ArtistParser._parse_images(elem),
+            }
+        except Exception as e:
+            logging.error(f"Error parsing master: {e}")
+            return {}
+
+
+# Parser for each Discogs dump, by the name of its records
+PARSERS = {parser.name: parser for parser in (ArtistParser, ReleaseParser, LabelParser, MasterParser)}
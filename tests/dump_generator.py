@@ -0,0 +1,185 @@
+"""Writes synthetic Discogs data dumps (artists, releases, labels, masters) as .xml.gz.
+
+Records follow the layout of the monthly dumps. The number of nested children
+(tracks, images, aliases, ...) is drawn from an exponential distribution around
+a configurable mean, so a few records are much larger than the rest, as in
+the real data. Children every real record has (a release's artist, label,
+format, genre and track) are always present at least once.
+
+Usage:
+    python -m tests.dump_generator release out/releases.xml.gz --records 100000
+    python -m tests.dump_generator artist out/artists.xml.gz --mb 500 --children aliases=4,images=3
+"""
+import argparse
+import gzip
+import random
+from xml.sax.saxutils import escape, quoteattr
+
+# Mean number of nested children per record
+DEFAULT_CHILDREN = {
+    "artist": {"aliases": 1.5, "groups": 0.8, "members": 0.5, "namevariations": 2.0, "urls": 1.5, "images": 1.0},
+    "release": {"artists": 1.3, "extraartists": 4.0, "labels": 1.2, "formats": 1.1, "genres": 1.2, "styles": 2.0,
+                "tracks": 9.0, "videos": 1.5, "companies": 3.0, "images": 2.0},
+    "label": {"sublabels": 1.0, "urls": 1.0, "images": 0.7},
+    "master": {"artists": 1.2, "genres": 1.2, "styles": 2.0, "videos": 2.0, "images": 1.5},
+}
+GENRES = ["Electronic", "Rock", "Jazz", "Hip Hop", "Funk / Soul", "Pop", "Classical", "Reggae"]
+STYLES = ["Techno", "House", "Ambient", "Minimal", "Acid", "Dub", "Electro", "Trance", "Breakbeat", "IDM"]
+WORDS = ("deep night signal echo analog dust orbit pulse drift velvet machine static bloom tide "
+         "glass mirror silent motion cobalt ember circuit garden river chrome").split()
+
+
+class DumpGenerator:
+    def __init__(self, kind, children=None, seed=0):
+        self.kind = kind
+        self.children = dict(DEFAULT_CHILDREN[kind], **(children or {}))
+        self.random = random.Random(seed)
+
+    def write(self, path, records=None, megabytes=None):
+        """Writes records records, or as many as fit in megabytes of uncompressed XML. Returns the record count."""
+        limit = megabytes * 1024 ** 2 if megabytes else None
+        written = count = 0
+        record = getattr(self, f"_{self.kind}")
+        with gzip.open(path, "wt", encoding="utf-8", compresslevel=6) as f:
+            f.write(f"<{self.kind}s>")
+            while (records is None or count < records) and (limit is None or written < limit):
+                count += 1
+                xml = record(count)
+                f.write(xml)
+                written += len(xml)
+            f.write(f"</{self.kind}s>")
+        return count
+
+    def _n(self, child, minimum=0):
+        mean = self.children.get(child, 0)
+        return max(minimum, int(self.random.expovariate(1 / mean)) if mean else 0)
+
+    def _id(self, upper=1_000_000):
+        return self.random.randint(1, upper)
+
+    def _words(self, low=1, high=4):
+        return " ".join(self.random.choice(WORDS) for _ in range(self.random.randint(low, high))).title()
+
+    def _text(self, sentences):
+        return " ".join(f"{self._words(4, 12)}." for _ in range(sentences))
+
+    def _images(self):
+        return "<images>" + "".join(
+            f'<image height="600" type="{"primary" if i == 0 else "secondary"}" uri="" uri150="" width="600"/>'
+            for i in range(self._n("images"))
+        ) + "</images>"
+
+    def _urls(self):
+        return "<urls>" + "".join(
+            f"<url>https://example.com/{self.random.choice(WORDS)}/{self._id()}</url>" for _ in range(self._n("urls"))
+        ) + "</urls>"
+
+    def _names(self, tag, child):
+        return f"<{tag}>" + "".join(
+            f'<name id="{self._id()}">{escape(self._words())}</name>' for _ in range(self._n(child))
+        ) + f"</{tag}>"
+
+    def _artists(self, tag="artists", child="artists", role=False):
+        artists = []
+        for _ in range(self._n(child, 1 if child == "artists" else 0)):
+            role_xml = f"<role>{self.random.choice(['Producer', 'Mixed By', 'Written-By', 'Remix'])}</role>" if role else ""
+            artists.append(f"<artist><id>{self._id()}</id><name>{escape(self._words())}</name>"
+                           f"<anv></anv><join></join>{role_xml}<tracks></tracks></artist>")
+        return f"<{tag}>{''.join(artists)}</{tag}>"
+
+    def _list(self, tag, child, values, minimum=0):
+        return f"<{tag}s>" + "".join(
+            f"<{tag}>{escape(self.random.choice(values))}</{tag}>" for _ in range(self._n(child, minimum))
+        ) + f"</{tag}s>"
+
+    def _videos(self):
+        return "<videos>" + "".join(
+            f'<video duration="{self.random.randint(60, 600)}" embed="true" '
+            f'src="https://www.youtube.com/watch?v={self._id()}"><title>{escape(self._words())}</title>'
+            f"<description>{escape(self._words(2, 8))}</description></video>"
+            for _ in range(self._n("videos"))
+        ) + "</videos>"
+
+    def _artist(self, artist_id):
+        return (
+            f"<artist>{self._images()}<id>{artist_id}</id><name>{escape(self._words())}</name>"
+            f"<realname>{escape(self._words(2, 3))}</realname><profile>{escape(self._text(self.random.randint(0, 4)))}</profile>"
+            f"<data_quality>Needs Vote</data_quality>{self._urls()}{self._names('namevariations', 'namevariations')}"
+            f"{self._names('aliases', 'aliases')}{self._names('groups', 'groups')}{self._names('members', 'members')}</artist>"
+        )
+
+    def _release(self, release_id):
+        labels = "".join(
+            f'<label catno="{self.random.choice(WORDS).upper()}{self.random.randint(1, 999):03d}" '
+            f'id="{self._id()}" name={quoteattr(self._words())}/>'
+            for _ in range(self._n("labels", 1))
+        )
+        formats = "".join(
+            f'<format name="Vinyl" qty="{self.random.randint(1, 3)}" text=""><descriptions>'
+            f'<description>12"</description><description>33 ⅓ RPM</description></descriptions></format>'
+            for _ in range(self._n("formats", 1))
+        )
+        tracks = "".join(
+            f"<track><position>{chr(65 + i // 4)}{i % 4 + 1}</position><title>{escape(self._words())}</title>"
+            f"<duration>{self.random.randint(2, 9)}:{self.random.randint(0, 59):02d}</duration></track>"
+            for i in range(self._n("tracks", 1))
+        )
+        companies = "".join(
+            f"<company><id>{self._id()}</id><name>{escape(self._words())}</name><catno></catno>"
+            f"<entity_type>13</entity_type><entity_type_name>Phonographic Copyright (p)</entity_type_name>"
+            f"<resource_url></resource_url></company>"
+            for _ in range(self._n("companies"))
+        )
+        return (
+            f'<release id="{release_id}" status="Accepted">{self._images()}{self._artists()}'
+            f"<title>{escape(self._words())}</title><labels>{labels}</labels>"
+            f"{self._artists('extraartists', 'extraartists', role=True)}<formats>{formats}</formats>"
+            f"{self._list('genre', 'genres', GENRES, 1)}{self._list('style', 'styles', STYLES)}"
+            f"<country>{self.random.choice(['UK', 'US', 'Germany', 'Netherlands', 'Japan'])}</country>"
+            f"<released>{self.random.randint(1960, 2024)}</released><notes>{escape(self._text(self.random.randint(0, 3)))}</notes>"
+            f"<data_quality>Correct</data_quality>"
+            f'<master_id is_main_release="{self.random.choice(["true", "false"])}">{self._id()}</master_id>'
+            f"<tracklist>{tracks}</tracklist>{self._videos()}<companies>{companies}</companies></release>"
+        )
+
+    def _label(self, label_id):
+        sublabels = "".join(
+            f'<label id="{self._id()}">{escape(self._words())}</label>' for _ in range(self._n("sublabels"))
+        )
+        parent = f'<parentLabel id="{self._id()}">{escape(self._words())}</parentLabel>' if self.random.random() < 0.2 else ""
+        return (
+            f"<label>{self._images()}<id>{label_id}</id><name>{escape(self._words())}</name>"
+            f"<contactinfo>{escape(self._words(3, 8))}</contactinfo><profile>{escape(self._text(self.random.randint(0, 3)))}</profile>"
+            f"<data_quality>Needs Vote</data_quality>{self._urls()}<sublabels>{sublabels}</sublabels>{parent}</label>"
+        )
+
+    def _master(self, master_id):
+        return (
+            f'<master id="{master_id}"><main_release>{self._id()}</main_release>{self._images()}{self._artists()}'
+            f"{self._list('genre', 'genres', GENRES, 1)}{self._list('style', 'styles', STYLES)}"
+            f"<year>{self.random.randint(1960, 2024)}</year><title>{escape(self._words())}</title>"
+            f"<data_quality>Correct</data_quality>{self._videos()}</master>"
+        )
+
+
+def parse_children(value):
+    return {name: float(mean) for name, mean in (item.split("=") for item in value.split(",") if item)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=sorted(DEFAULT_CHILDREN))
+    parser.add_argument("path")
+    parser.add_argument("--records", type=int)
+    parser.add_argument("--mb", type=float, help="uncompressed size to generate instead of a record count")
+    parser.add_argument("--children", type=parse_children, default={}, help="mean nested children, e.g. tracks=12,images=3")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.records is None and args.mb is None:
+        parser.error("one of --records or --mb is required")
+    count = DumpGenerator(args.kind, args.children, args.seed).write(args.path, args.records, args.mb)
+    print(f"Wrote {count} {args.kind}s to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
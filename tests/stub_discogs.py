@@ -0,0 +1,115 @@
+"""Local stand-in for discogs.com serving the saved page fixtures.
+
+The server answers release, stats, sell/release and seller pages from
+tests/fixtures with a configurable latency, share of 500 errors and share of
+429 rate limit responses. It also listens on a number of extra ports acting as
+fake HTTP proxies: a request sent through one of them carries the absolute
+URL, which is served the same way. ``/proxies`` lists those ports in the
+format ProxyManager expects.
+"""
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+ROUTES = [
+    (re.compile(r"^/release/stats/\d+$"), "stats"),
+    (re.compile(r"^/release/\d+$"), "release"),
+    (re.compile(r"^/sell/release/\d+$"), "sellers"),
+    (re.compile(r"^/seller/[^/]+/profile$"), "sellers"),
+]
+
+
+class StubDiscogs:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0, proxies=4, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.pages = {name: (FIXTURES / f"{name}.html").read_bytes() for name in ("release", "stats", "sellers")}
+        self.random = random.Random(seed)
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.servers = [self._make_server() for _ in range(proxies + 1)]
+        self.threads = []
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.servers[0].server_port}"
+
+    @property
+    def proxy_list_url(self):
+        return f"{self.base_url}/proxies"
+
+    def start(self):
+        for server in self.servers:
+            thread = threading.Thread(target=server.serve_forever, name="StubDiscogs", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _make_server(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                status, body, headers = stub.respond(urlsplit(self.path).path)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        return server
+
+    def respond(self, path):
+        if path == "/proxies":
+            body = "\n".join(f"127.0.0.1:{server.server_port}" for server in self.servers[1:])
+            return 200, body.encode(), {"Content-Type": "text/plain"}
+
+        page = next((name for pattern, name in ROUTES if pattern.match(path)), None)
+        if page is None:
+            self._count("not_found")
+            return 404, b"Not found", {}
+
+        with self.lock:
+            roll = self.random.random()
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        time.sleep(delay)
+        if roll < self.rate_limit_rate:
+            self._count("rate_limited")
+            return 429, b"Too many requests", {"Retry-After": "0"}
+        if roll < self.rate_limit_rate + self.error_rate:
+            self._count("errors")
+            return 500, b"Server error", {}
+        self._count(page)
+        return 200, self.pages[page], {"Content-Type": "text/html; charset=utf-8"}
+
+    def _count(self, name):
+        with self.lock:
+            self.counts[name] += 1
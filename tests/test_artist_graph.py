@@ -0,0 +1,58 @@
+import time
+
+from models.sinks.shard_cache import TeeDataStore
+from tests.dump_generator import DumpGenerator
+from tests.test_shard_cache import RecordingDataStore
+from utils.artist_graph import ALIAS, GROUP, MEMBER, ArtistGraph, ArtistGraphBuilder
+from utils.xml_handler import ArtistParser, XMLDataHandler
+
+ARTISTS = [
+    {"id": 1, "aliases": [{"id": 2, "name": "B"}], "groups": [{"id": 10, "name": "Band"}]},
+    {"id": 2, "aliases": [{"id": 1, "name": "A"}], "groups": []},
+    {"id": 3, "aliases": [], "groups": [{"id": 10, "name": "Band"}]},
+    {"id": 10, "aliases": [], "groups": [], "members": [{"id": 1, "name": "A"}, {"id": 3, "name": "C"}]},
+    {"id": 4, "aliases": None, "groups": None},
+]
+
+
+def test_graph_links_aliases_groups_and_members(tmp_path):
+    builder = ArtistGraphBuilder(str(tmp_path / "artists.graph"))
+    builder.insert(ARTISTS)
+    graph = builder.finish()
+
+    assert graph.aliases(1) == [2] and graph.aliases(2) == [1]
+    assert graph.groups(1) == [10] and graph.groups(3) == [10]
+    assert graph.members(10) == [1, 3]
+    # The alias on both records and the group/member pairs are stored once
+    assert len(graph) == 6
+    assert graph.neighbors_of(4) == [] and graph.neighbors_of(99) == []
+    assert graph.neighborhood(2) == {1: 1, 10: 2}
+    assert graph.neighborhood(2, hops=3) == {1: 1, 10: 2, 3: 3}
+    assert graph.neighborhood(3, kinds=(GROUP, MEMBER)) == {10: 1, 1: 2}
+    assert graph.neighbors_of(1, (ALIAS,)) == [(2, ALIAS)]
+    graph.close()
+
+    reopened = ArtistGraph(str(tmp_path / "artists.graph"))
+    assert reopened.members(10) == [1, 3]
+    reopened.close()
+
+
+def test_graph_built_while_loading_artists(tmp_path):
+    path = tmp_path / "artists.xml.gz"
+    DumpGenerator("artist").write(path, records=500)
+    recorded, builder = RecordingDataStore(), ArtistGraphBuilder(str(tmp_path / "artists.graph"))
+    XMLDataHandler(f"file://{path}", str(tmp_path), data_store=TeeDataStore(recorded, builder),
+                   parser_class=ArtistParser(), keep_file=True).parse_xml()
+    graph = builder.finish()
+
+    for artist in recorded.records:
+        assert set(graph.aliases(artist["id"])) >= {alias["id"] for alias in artist["aliases"]}
+        assert set(graph.groups(artist["id"])) >= {group["id"] for group in artist["groups"]}
+        for group in artist["groups"]:
+            assert artist["id"] in graph.members(group["id"])
+
+    start = time.perf_counter()
+    for artist in recorded.records:
+        graph.neighborhood(artist["id"], hops=2)
+    assert (time.perf_counter() - start) / len(recorded.records) < 0.001
+    graph.close()
@@ -0,0 +1,108 @@
+import multiprocessing
+import os
+import time
+import pytest
+from scraper.claims import WorkClaimer
+
+# The multi-node tests need a scratch Postgres database, e.g.
+# TEST_DATABASE_URL=postgresql://postgres@localhost:5432/discogs_test
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+requires_postgres = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+def recording_store_class():
+    """A store class whose instances record the params of every query in one list.
+
+    keep_alive() builds its own store of the same class, so each test gets a
+    new class rather than sharing the list between tests.
+    """
+    queries = []
+
+    class RecordingStore:
+        def __init__(self, database_url, table_name):
+            self.database_url = database_url
+            self.table_name = table_name
+            self.queries = queries
+
+        def fetch_all(self, query, params=None, commit=False):
+            self.queries.append(params)
+            return []
+
+    return RecordingStore
+
+
+def test_keep_alive_renews_leases():
+    store = recording_store_class()("postgresql://unused", "unused")
+    claimer = WorkClaimer(store, node_id="node-a", lease_seconds=0.03)
+    with claimer.keep_alive([1, 2]):
+        time.sleep(0.05)
+    assert (0.03, [1, 2], "node-a") in store.queries
+
+
+@pytest.fixture
+def frontier_db():
+    import psycopg2
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    with conn, conn.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS scrape_frontier, scrape_nodes")
+        cursor.execute("""
+            CREATE TABLE scrape_frontier (
+                release_id INT PRIMARY KEY, release_class TEXT NOT NULL DEFAULT 'new',
+                priority DOUBLE PRECISION, last_scraped TIMESTAMPTZ, next_due TIMESTAMPTZ,
+                listing_count INT, listing_churn FLOAT, claimed_by TEXT, lease_expires TIMESTAMPTZ
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE scrape_nodes (
+                node_id TEXT PRIMARY KEY, hostname TEXT, started_at TIMESTAMPTZ DEFAULT now(),
+                heartbeat TIMESTAMPTZ DEFAULT now(), claimed INT DEFAULT 0, completed INT DEFAULT 0, failed INT DEFAULT 0
+            )
+        """)
+        cursor.execute("INSERT INTO scrape_frontier (release_id, priority) SELECT i, i FROM generate_series(1, 500) i")
+    yield conn
+    conn.close()
+
+
+def claim_until_empty(node_id, queue):
+    from models.sinks.postgres import PostgresDataStore
+    claimer = WorkClaimer(PostgresDataStore(TEST_DATABASE_URL, "scrape_frontier"), node_id=node_id)
+    claimer.register()
+    seen = []
+    while batch := claimer.claim(25):
+        seen.extend(batch)
+        # Scraped releases aren't due again for a while
+        claimer.data_store.fetch_all(
+            "UPDATE scrape_frontier SET next_due = now() + INTERVAL '1 day' WHERE release_id = ANY(%s) RETURNING 1",
+            (batch,), commit=True,
+        )
+        claimer.release(batch, completed=len(batch))
+    queue.put(seen)
+
+
+@requires_postgres
+def test_nodes_claim_disjoint_work(frontier_db):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    nodes = [context.Process(target=claim_until_empty, args=(f"node-{i}", queue)) for i in range(4)]
+    for node in nodes:
+        node.start()
+    claimed = [queue.get(timeout=60) for _ in nodes]
+    for node in nodes:
+        node.join()
+
+    all_ids = [release_id for ids in claimed for release_id in ids]
+    assert sorted(all_ids) == list(range(1, 501))
+    with frontier_db.cursor() as cursor:
+        cursor.execute("SELECT SUM(completed) FROM scrape_nodes")
+        assert cursor.fetchone()[0] == 500
+
+
+@requires_postgres
+def test_expired_leases_are_reclaimed(frontier_db):
+    from models.sinks.postgres import PostgresDataStore
+    crashed = WorkClaimer(PostgresDataStore(TEST_DATABASE_URL, "scrape_frontier"), node_id="crashed", lease_seconds=1)
+    survivor = WorkClaimer(PostgresDataStore(TEST_DATABASE_URL, "scrape_frontier"), node_id="survivor")
+    lost = crashed.claim(10)
+    assert set(lost).isdisjoint(survivor.claim(10))
+    time.sleep(1.5)
+    assert set(lost) <= set(survivor.claim(500))
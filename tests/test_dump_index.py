@@ -0,0 +1,40 @@
+import gzip
+
+import pytest
+
+from tests.dump_generator import DumpGenerator
+from utils import dump_index
+from utils.dump_index import DumpIndex, build_index, seekable_path
+from utils.xml_handler import PARSERS
+
+
+@pytest.mark.parametrize("kind", sorted(PARSERS))
+def test_build_index_looks_up_every_record(tmp_path, monkeypatch, kind):
+    # Tiny reads so tags and records straddle chunk boundaries
+    monkeypatch.setattr(dump_index, "READ_SIZE", 97)
+    source = str(tmp_path / f"{kind}s.xml.gz")
+    DumpGenerator(kind, children={"sublabels": 3}, seed=2).write(source, records=60)
+
+    index = build_index(source, kind, checkpoint_bytes=2048)
+
+    assert index.path == seekable_path(source) == str(tmp_path / f"{kind}s.seekable.xml.gz")
+    assert len(index.compressed_offsets) > 3
+    with gzip.open(source, "rb") as original, gzip.open(index.path, "rb") as copy:
+        assert original.read() == copy.read()
+    assert len(index) == 60
+    for record_id in range(1, 61):
+        assert int(index.get(record_id)["id"]) == record_id
+        assert index.raw(record_id).startswith(f"<{kind}".encode())
+    index.close()
+
+
+def test_lookup_of_unknown_id(tmp_path):
+    source = str(tmp_path / "releases.xml.gz")
+    DumpGenerator("release").write(source, records=5)
+    build_index(source, "release").close()
+
+    index = DumpIndex(seekable_path(source))
+    assert index.kind == "release"
+    assert 3 in index and 6 not in index
+    assert index.get(6) is None
+    index.close()
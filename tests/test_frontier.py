@@ -0,0 +1,116 @@
+import os
+from datetime import datetime, timedelta, timezone, date
+from unittest.mock import MagicMock, patch
+import pytest
+from models.records import ReleaseResult, Listing
+from scraper.frontier import ScrapeFrontier, classify_release, compute_priority, RECRAWL_INTERVALS, RETRY_DELAY
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+requires_postgres = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+NOW = datetime(2024, 6, 1, tzinfo=timezone.utc)
+
+@pytest.fixture
+def data_store():
+    return MagicMock()
+
+def test_classify_release():
+    assert classify_release(None, 0, 0, None, None, NOW) == "new"
+    assert classify_release(NOW, 10, 10, date(2024, 5, 20), 0.0, NOW) == "hot"
+    assert classify_release(NOW, 800, 10, None, 0.0, NOW) == "hot"
+    assert classify_release(NOW, 60, 10, None, 0.0, NOW) == "warm"
+    assert classify_release(NOW, 1, 2, date(2015, 1, 1), 0.0, NOW) == "cold"
+
+def test_priority_prefers_stale_popular_releases():
+    last_week = NOW - timedelta(days=7)
+    popular = compute_priority(last_week, 400, 900, date(2024, 5, 30), 0.1, "warm", NOW)
+    obscure = compute_priority(last_week, 2, 5, None, 0.0, "warm", NOW)
+    fresh = compute_priority(NOW - timedelta(hours=1), 400, 900, date(2024, 5, 30), 0.1, "warm", NOW)
+    assert popular > obscure
+    assert popular > fresh
+
+def test_refresh_passes_class_intervals(data_store):
+    cursor = data_store.transaction.return_value.__enter__.return_value
+    cursor.fetchone.return_value = (True,)
+    assert ScrapeFrontier(data_store, intervals={"cold": timedelta(days=90)}).refresh(now=NOW)
+    params = cursor.execute.call_args[0][1]
+    assert dict(zip(params["classes"], params["seconds"])) == {"new": 0, "hot": 86400, "warm": 604800, "cold": 7776000}
+    assert params["now"] == NOW
+
+def test_refresh_skips_while_another_node_refreshes(data_store):
+    cursor = data_store.transaction.return_value.__enter__.return_value
+    cursor.fetchone.return_value = (False,)
+    assert not ScrapeFrontier(data_store).refresh(now=NOW)
+    assert cursor.execute.call_count == 1
+
+def mark_scraped(data_store, previous, release_ids, releases):
+    cursor = data_store.transaction.return_value.__enter__.return_value
+    cursor.fetchall.return_value = previous
+    with patch("scraper.frontier.execute_values") as execute_values:
+        ScrapeFrontier(data_store).mark_scraped(release_ids, releases, now=NOW)
+    data_store.transaction.assert_called_once()
+    return execute_values.call_args[0][2]
+
+def test_mark_scraped_retries_failures(data_store):
+    scraped = ReleaseResult(release_id=1, sellers=[Listing(), Listing()], listing_count=8)
+    updates = mark_scraped(data_store, [(1, 10, None, "warm"), (2, None, None, "new")], [1, 2], [scraped])
+    updates = {row[0]: row for row in updates}
+    assert updates[1] == (1, NOW, NOW + timedelta(days=7), 8, pytest.approx(0.25))
+    assert updates[2] == (2, None, NOW + RETRY_DELAY, None, None)
+
+def test_mark_scraped_keeps_count_without_listing_pages(data_store):
+    updates = mark_scraped(data_store, [(1, 10, 0.5, "hot")], [1], [ReleaseResult(release_id=1, sellers=[])])
+    assert updates == [(1, NOW, NOW + timedelta(days=1), 10, pytest.approx(0.25))]
+
+def test_mark_scraped_raises_when_the_update_fails(data_store):
+    data_store.transaction.return_value.__enter__.return_value.fetchall.return_value = []
+    with patch("scraper.frontier.execute_values", side_effect=RuntimeError("connection lost")):
+        with pytest.raises(RuntimeError):
+            ScrapeFrontier(data_store).mark_scraped([1], [], now=NOW)
+
+@requires_postgres
+def test_refresh_matches_python_priorities():
+    import psycopg2
+    from models.sinks.postgres import PostgresDataStore
+    releases = [
+        # release_id, last_scraped, churn, want, have, last_sold
+        (1, None, None, None, None, None),
+        (2, NOW - timedelta(days=2), 0.5, 20, 30, date(2024, 5, 31)),
+        (3, NOW - timedelta(days=10), 0.0, 60, 10, None),
+        (4, NOW - timedelta(days=40), 0.1, 1, 2, date(2015, 1, 1)),
+        (5, NOW - timedelta(hours=3), None, 900, 1200, date(2024, 3, 1)),
+    ]
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS scrape_frontier, release_details")
+        cursor.execute("CREATE TABLE release_details (release_id INT PRIMARY KEY, want INT, have INT, last_sold DATE)")
+        cursor.execute("""
+            CREATE TABLE scrape_frontier (
+                release_id INT PRIMARY KEY, release_class TEXT NOT NULL DEFAULT 'new', priority DOUBLE PRECISION,
+                last_scraped TIMESTAMPTZ, next_due TIMESTAMPTZ, listing_count INT, listing_churn FLOAT
+            )
+        """)
+        cursor.execute(open(os.path.join(os.path.dirname(__file__), "..", "db", "frontier_priority.sql")).read())
+        for release_id, last_scraped, churn, want, have, last_sold in releases:
+            cursor.execute("INSERT INTO scrape_frontier (release_id, last_scraped, listing_churn) VALUES (%s, %s, %s)",
+                           (release_id, last_scraped, churn))
+            if release_id != 1:
+                cursor.execute("INSERT INTO release_details VALUES (%s, %s, %s, %s)", (release_id, want, have, last_sold))
+    conn.close()
+
+    ScrapeFrontier(PostgresDataStore(TEST_DATABASE_URL, "scrape_frontier")).refresh(now=NOW)
+
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT release_id, release_class, priority, next_due FROM scrape_frontier")
+        stored = {release_id: row for release_id, *row in cursor.fetchall()}
+    conn.close()
+    for release_id, last_scraped, churn, want, have, last_sold in releases:
+        release_class = classify_release(last_scraped, want, have, last_sold, churn, NOW)
+        priority = compute_priority(last_scraped, want, have, last_sold, churn, release_class, NOW)
+        next_due = last_scraped + RECRAWL_INTERVALS[release_class] if last_scraped else None
+        assert stored[release_id] == [release_class, pytest.approx(priority), next_due]
+
+    # While another node holds the refresh lock, refresh() leaves the frontier alone
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('scrape_frontier_refresh'))")
+        assert not ScrapeFrontier(PostgresDataStore(TEST_DATABASE_URL, "scrape_frontier")).refresh(now=NOW)
+    conn.close()
@@ -0,0 +1,57 @@
+from pathlib import Path
+from unittest.mock import MagicMock
+import pytest
+from models import discogs_objects
+from models.discogs_objects import DiscogsRelease, DiscogsStatsPage, DiscogsSellerPageRelease
+from models.records import ReleaseStats
+from utils import html_parser
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+@pytest.fixture
+def session_manager():
+    manager = MagicMock()
+    manager.get_session.return_value = (MagicMock(), None)
+    return manager
+
+@pytest.fixture
+def bs4_backend(monkeypatch):
+    monkeypatch.setattr(discogs_objects, "HTML_PARSER", "bs4")
+
+def read_fixture(name):
+    return (FIXTURES / name).read_text(encoding="utf-8")
+
+def test_release_stats_match_bs4(session_manager, bs4_backend):
+    html = read_fixture("release.html")
+    expected = DiscogsRelease(1, session_manager).parse_stats(html)
+    assert html_parser.parse_release_stats(html) == expected
+    assert expected.have == 1234
+
+def test_members_match_bs4(bs4_backend):
+    html = read_fixture("stats.html")
+    have, want = html_parser.parse_members_data(html)
+    assert (have, want) == DiscogsStatsPage.parse_members_data(html)
+    assert want[-1] == "ivan&co"
+
+def test_items_for_sale_match_bs4(session_manager, bs4_backend):
+    html = read_fixture("sellers.html")
+    expected = DiscogsSellerPageRelease(1, session_manager).parse_items_for_sale(html)
+    items = html_parser.parse_items_for_sale(html)
+    assert items == expected
+    assert len(items) == 5
+    assert all(type(value) is str for item in items for value in item.as_tuple() if isinstance(value, str))
+
+def test_missing_stats_section_returns_empty():
+    assert html_parser.parse_release_stats("<html><body><p>Not found</p></body></html>") == ReleaseStats()
+
+def test_pages_use_lxml_backend_by_default(session_manager):
+    session_manager.get_session.return_value[0].get.return_value.text = read_fixture("stats.html")
+    page = DiscogsStatsPage(1, session_manager)
+    page.fetch_and_parse()
+    assert page.members_have == ["alice", "bob_records", "carol", "dj.dave", "eve"]
+
+def test_pagination_total_and_listing_ids():
+    html = read_fixture("sellers.html")
+    assert html_parser.parse_pagination_total(html) == 5
+    assert html_parser.parse_listing_ids(html) == [3012345678, 3012340000, 3011111111, 3010000001, 3009999999]
+    assert html_parser.parse_pagination_total("<html></html>") is None
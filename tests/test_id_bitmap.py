@@ -0,0 +1,21 @@
+from utils.id_bitmap import IdBitmap
+
+
+def test_add_and_contains():
+    bitmap = IdBitmap()
+    bitmap.update([3, 8, 29_000_000, 8])
+    assert 8 in bitmap and 29_000_000 in bitmap
+    assert 7 not in bitmap and 29_000_001 not in bitmap and 40_000_000 not in bitmap
+    assert len(bitmap) == 3
+
+
+def test_save_and_reload(tmp_path):
+    path = str(tmp_path / "completed.bin")
+    bitmap = IdBitmap(path)
+    bitmap.update(range(0, 100_000, 3))
+    bitmap.save()
+
+    reloaded = IdBitmap(path)
+    assert len(reloaded) == len(bitmap)
+    assert 99_999 in reloaded and 99_998 not in reloaded
+    assert not (tmp_path / "completed.bin.tmp").exists()
@@ -0,0 +1,115 @@
+import os
+from unittest.mock import MagicMock, patch
+import pytest
+from models.listings import ListingStore
+from models.records import Listing, ReleaseResult
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+requires_postgres = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+def listing(listing_id, seller="bob", price=10.0):
+    return Listing(seller=seller, price=price, currency="$", listing_id=listing_id)
+
+
+def users_for(*usernames):
+    users = MagicMock()
+    users.ids.return_value = {username: user_id for user_id, username in enumerate(usernames, 1)}
+    return users
+
+
+def test_rows_keep_every_listing_once():
+    releases = [
+        # Two copies from one seller; listing 2 was seen on two pages
+        ReleaseResult(release_id=1, sellers=[listing(1), listing(2), listing(2, price=12.0), listing(None)]),
+        ReleaseResult(release_id=2, sellers=[listing(3, seller="carol"), listing(None)]),
+    ]
+
+    rows = ListingStore(MagicMock(), users_for("bob", "carol")).rows(releases)
+
+    assert [(row[0], row[-1], row[-2]) for row in rows] == [
+        (1, 1, 10.0), (1, 2, 12.0), (1, None, 10.0), (2, 3, 10.0), (2, None, 10.0)
+    ]
+    assert {row[10] for row in rows} == {1, 2}
+
+
+def test_write_upserts_in_one_transaction():
+    data_store = MagicMock()
+    with patch("models.listings.execute_values") as execute_values:
+        assert ListingStore(data_store, users_for("bob")).write([ReleaseResult(release_id=1, sellers=[listing(1)])]) == 1
+        assert ListingStore(data_store, users_for("bob")).write([ReleaseResult(release_id=1, sellers=[])]) == 0
+    data_store.transaction.assert_called_once()
+    assert "ON CONFLICT (release_id, listing_id) DO UPDATE" in execute_values.call_args[0][1]
+
+
+@requires_postgres
+def test_relisted_and_repeated_listings():
+    import psycopg2
+    from models.sinks.postgres import PostgresDataStore
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS release_sellers, electronic_releases, seller_inventory_watermarks, users CASCADE")
+        cursor.execute("CREATE TABLE users (user_id SERIAL PRIMARY KEY, username TEXT NOT NULL UNIQUE)")
+        cursor.execute("INSERT INTO users (username) VALUES ('bob')")
+        cursor.execute("CREATE TABLE electronic_releases (id INT PRIMARY KEY)")
+        cursor.execute("INSERT INTO electronic_releases (id) VALUES (1)")
+        cursor.execute("""
+            CREATE TABLE release_sellers (
+                release_id INT NOT NULL, image_url TEXT, rating FLOAT, have INT, want INT, title TEXT, label TEXT,
+                catno TEXT, media_condition TEXT, media_condition_description TEXT, seller_id INT, seller_rating FLOAT,
+                ships_from TEXT, currency CHAR(3), price FLOAT, listing_id BIGINT,
+                PRIMARY KEY (release_id, seller_id)
+            )
+        """)
+        cursor.execute("CREATE INDEX release_sellers_release_listing_idx ON release_sellers (release_id, listing_id)")
+        cursor.execute(open(os.path.join(os.path.dirname(__file__), "..", "db", "listings.sql")).read())
+        cursor.execute(open(os.path.join(os.path.dirname(__file__), "..", "db", "seller_inventories.sql")).read())
+        cursor.execute("DROP TABLE IF EXISTS release_listing_fetches CASCADE")
+        cursor.execute("ALTER TABLE release_sellers ADD COLUMN created_time TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP")
+        cursor.execute(open(os.path.join(os.path.dirname(__file__), "..", "db", "active_listings.sql")).read())
+    store = ListingStore(PostgresDataStore(TEST_DATABASE_URL, "release_sellers"), users_for("bob"))
+
+    store.write([ReleaseResult(release_id=1, sellers=[listing(1), listing(2)])])
+    # A re-scrape finds listing 2 repriced and a new copy from the same seller
+    store.write([ReleaseResult(release_id=1, sellers=[listing(2, price=8.0), listing(3)])])
+    # A seller's inventory also lists release 99, which was never loaded
+    assert store.inventory_watermarks([1]) == {}
+    assert store.write([ReleaseResult(release_id=99, sellers=[listing(4)]),
+                        ReleaseResult(release_id=1, sellers=[listing(3)])], known_only=True, inventories=True) == 1
+    # The inventory watermark counts the listing of the unknown release; per-release writes don't move it
+    store.write([ReleaseResult(release_id=1, sellers=[listing(9)])])
+    assert store.inventory_watermarks([1]) == {1: 4}
+
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT listing_id, seller_id, price FROM release_sellers ORDER BY listing_id")
+        assert cursor.fetchall() == [(1, 1, 10.0), (2, 1, 8.0), (3, 1, 10.0), (9, 1, 10.0)]
+    conn.close()
+
+
+@requires_postgres
+def test_full_fetch_retires_listings_no_longer_for_sale():
+    import psycopg2
+    from models.sinks.postgres import PostgresDataStore
+    test_relisted_and_repeated_listings()
+    store = ListingStore(PostgresDataStore(TEST_DATABASE_URL, "release_sellers"), users_for("bob"))
+
+    # Listings 1 and 9 sold; a full fetch only finds 2 and 3, plus a new one
+    store.write([ReleaseResult(release_id=1, sellers=[listing(2), listing(3), listing(10)], listings_complete=True)])
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT listing_id FROM active_release_sellers ORDER BY listing_id")
+        assert cursor.fetchall() == [(2,), (3,), (10,)]
+        # All of them are kept in release_sellers
+        cursor.execute("SELECT count(*) FROM release_sellers")
+        assert cursor.fetchone() == (5,)
+    conn.close()
+
+    # Listings found later, e.g. by an incremental scrape, are active too; a full fetch with none retires all
+    store.write([ReleaseResult(release_id=1, sellers=[listing(11)])])
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM active_release_sellers")
+        assert cursor.fetchone() == (4,)
+    conn.close()
+    assert store.write([ReleaseResult(release_id=1, sellers=[], listings_complete=True)]) == 0
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM active_release_sellers")
+        assert cursor.fetchone() == (0,)
+    conn.close()
@@ -0,0 +1,157 @@
+import functools
+import json
+import os
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from managers.load_orchestrator import LoadOrchestrator, TokenBucket, dump_url
+from tests.dump_generator import DumpGenerator
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+requires_postgres = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+def test_token_bucket_holds_rate_across_threads():
+    bucket = TokenBucket(rate=20000, capacity=1000)
+    start = time.monotonic()
+    threads = [threading.Thread(target=lambda: [bucket.consume(500) for _ in range(3)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 6000 bytes at 20000/sec, less the 1000 byte burst
+    assert 0.2 <= time.monotonic() - start < 0.5
+
+
+def test_dump_url():
+    assert dump_url("artist", "20240101").endswith("/data/2024/discogs_20240101_artists.xml.gz")
+
+
+@pytest.fixture
+def dump_server(tmp_path):
+    served = tmp_path / "served"
+    served.mkdir()
+    for kind in ("artist", "release"):
+        DumpGenerator(kind).write(served / f"{kind}s.xml.gz", records=30)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(SimpleHTTPRequestHandler, directory=served))
+    server.RequestHandlerClass.log_message = lambda *args: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@requires_postgres
+def test_orchestrator_loads_dumps_and_runs_steps(tmp_path, dump_server):
+    import psycopg2
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS artists, releases, labels, artist_counts, release_counts, both_counts, label_counts CASCADE")
+    steps = []
+    for name, inputs in (("artist_counts", {"artist"}), ("release_counts", {"release"}),
+                         ("both_counts", {"artist", "release"}), ("label_counts", {"label"})):
+        path = tmp_path / f"{name}.sql"
+        table = f"{name.split('_')[0]}s" if name != "both_counts" else "artists, releases"
+        path.write_text(f"DROP TABLE IF EXISTS {name}; CREATE TABLE {name} AS SELECT count(*) AS n FROM {table};")
+        steps.append((str(path), inputs))
+    downloads = tmp_path / "downloads"
+    downloads.mkdir()
+    status_path = str(tmp_path / "status.json")
+    dumps = {"artist": f"{dump_server}/artists.xml.gz", "release": f"{dump_server}/releases.xml.gz",
+             "label": f"{dump_server}/missing.xml.gz"}
+
+    status = LoadOrchestrator(dumps, TEST_DATABASE_URL, str(downloads), cpu_workers=2, db_connections=2,
+                              bandwidth=10**6, steps=steps, status_path=status_path).run()
+
+    assert {kind: dump["status"] for kind, dump in status["dumps"].items()} == \
+        {"artist": "loaded", "release": "loaded", "label": "failed"}
+    assert status["dumps"]["artist"]["records"] == 30
+    assert [step["status"] for step in status["steps"].values()] == ["done", "done", "done", "skipped"]
+    assert json.load(open(status_path)) == status
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT (SELECT n FROM artist_counts), (SELECT n FROM release_counts), (SELECT count(*) FROM releases)")
+        assert cursor.fetchone() == (30, 30, 30)
+        # db/artists.sql joins on artists.artist_id
+        cursor.execute("SELECT count(*) FROM artists WHERE artist_id = (data->>'id')::INT")
+        assert cursor.fetchone() == (30,)
+
+    # A rerun only retries the failed dump
+    os.remove(downloads / "artists.xml.gz")
+    rerun = LoadOrchestrator(dumps, TEST_DATABASE_URL, str(downloads), steps=steps, status_path=status_path)
+    assert [load.kind for load in rerun.loads.values() if load.status != "loaded"] == ["label"]
+    assert rerun.run()["dumps"]["artist"]["status"] == "loaded"
+    assert not (downloads / "artists.xml.gz").exists()
+
+    # A dump that failed part way through is loaded again from scratch, and its steps rerun
+    status["dumps"]["artist"]["status"] = "failed"
+    json.dump(status, open(status_path, "w"))
+    rerun = LoadOrchestrator(dumps, TEST_DATABASE_URL, str(downloads), steps=steps, status_path=status_path).run()
+    assert rerun["dumps"]["artist"]["status"] == "loaded"
+    assert rerun["steps"][steps[0][0]]["status"] == "done"
+    assert rerun["steps"][steps[1][0]]["status"] == "done"
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT (SELECT count(*) FROM artists), (SELECT n FROM artist_counts)")
+        assert cursor.fetchone() == (30, 30)
+    conn.close()
+
+
+@requires_postgres
+def test_worker_metrics_are_written_per_dump(tmp_path, dump_server, monkeypatch):
+    # Worker processes are spawned, so they read METRICS_PATH from the environment
+    monkeypatch.setenv("METRICS_PATH", str(tmp_path / "metrics.json"))
+    downloads = tmp_path / "downloads"
+    downloads.mkdir()
+    dumps = {"artist": f"{dump_server}/artists.xml.gz", "release": f"{dump_server}/releases.xml.gz"}
+    status = LoadOrchestrator(dumps, TEST_DATABASE_URL, str(downloads), cpu_workers=1, steps=[]).run()
+    assert {dump["status"] for dump in status["dumps"].values()} == {"loaded"}
+    for kind in dumps:
+        snapshot = json.load(open(tmp_path / f"metrics.{kind}.json"))
+        assert snapshot["stages"]["parse"]["count"] > 0
+
+
+@requires_postgres
+def test_normalization_steps_run_and_rerun(tmp_path, dump_server, monkeypatch):
+    import psycopg2
+    # The steps' paths are relative to src/, where load.py runs
+    monkeypatch.chdir(os.path.join(os.path.dirname(__file__), "..", "src"))
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS electronic_releases, release_labels, release_videos, release_artists, "
+                       "release_formats, artist_aliases, artist_groups, artist_name_variations, artist_websites CASCADE")
+    conn.close()
+    downloads = tmp_path / "downloads"
+    downloads.mkdir()
+    status_path = str(tmp_path / "status.json")
+    dumps = {"artist": f"{dump_server}/artists.xml.gz", "release": f"{dump_server}/releases.xml.gz"}
+
+    def counts():
+        with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT (SELECT count(*) FROM electronic_releases),
+                       (SELECT count(*) FROM releases WHERE data->'genres' ? 'Electronic'),
+                       (SELECT count(*) FROM electronic_releases WHERE master_id IS NULL OR is_main_release IS NULL),
+                       (SELECT count(*) FROM release_labels), (SELECT count(*) FROM release_formats),
+                       (SELECT count(*) FROM release_videos),
+                       (SELECT sum(jsonb_array_length(data->'videos')) FROM electronic_releases)
+            """)
+            row = cursor.fetchone()
+        conn.close()
+        return row
+
+    status = LoadOrchestrator(dumps, TEST_DATABASE_URL, str(downloads), status_path=status_path).run()
+    assert [step["status"] for step in status["steps"].values()] == ["done", "done"]
+    loaded = counts()
+    electronic, expected, unparsed, labels, formats, videos, expected_videos = loaded
+    assert electronic == expected > 0
+    assert unparsed == 0
+    assert labels >= electronic and formats >= electronic
+    assert videos == expected_videos > 0
+
+    # Reloading the releases runs db/cleanup.sql again
+    status["dumps"]["release"]["status"] = "failed"
+    json.dump(status, open(status_path, "w"))
+    rerun = LoadOrchestrator(dumps, TEST_DATABASE_URL, str(downloads), status_path=status_path).run()
+    assert rerun["steps"]["../db/cleanup.sql"]["status"] == "done"
+    assert counts() == loaded
@@ -0,0 +1,85 @@
+import os
+from unittest.mock import MagicMock, patch
+import pytest
+from models.market import MarketSummaryStore, summarize_listings
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+requires_postgres = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+LISTINGS = [
+    (1, "$", 10.0, "Mint (M)", 100),
+    (1, "$", 30.0, "Very Good (VG)", 101),
+    (1, "$", 20.0, "Mint (M)", 102),
+    (1, "$", 25.0, "Mint (M)", 102),
+    (1, "€", 15.0, None, 103),
+    (1, None, None, "Mint (M)", 104),
+    (2, "$", 5.0, "Good (G)", None),
+]
+
+
+def test_summarize_listings():
+    rows = {(row[0], row[1]): row[2:] for row in summarize_listings(LISTINGS)}
+
+    assert rows == {
+        (1, "$"): (4, 3, 10.0, 22.5, 30.0, {"Mint (M)": 3, "Very Good (VG)": 1}),
+        (1, "€"): (1, 1, 15.0, 15.0, 15.0, {}),
+        (2, "$"): (1, 0, 5.0, 5.0, 5.0, {"Good (G)": 1}),
+    }
+    assert summarize_listings([]) == []
+
+
+def test_write_recomputes_the_given_releases():
+    data_store = MagicMock()
+    cursor = data_store.transaction.return_value.__enter__.return_value
+    cursor.fetchall.return_value = LISTINGS
+
+    with patch("models.market.execute_values") as execute_values:
+        assert MarketSummaryStore(data_store).write({1, 2}) == 3
+        assert MarketSummaryStore(data_store).write([]) == 0
+    assert sorted(cursor.execute.call_args[0][1][0]) == [1, 2]
+    rows = execute_values.call_args[0][2]
+    assert [row[:7] for row in rows][0] == (1, "$", 4, 3, 10.0, 22.5, 30.0)
+
+
+@requires_postgres
+def test_summary_matches_the_backfill():
+    import psycopg2
+    from models.sinks.postgres import PostgresDataStore
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS release_sellers, release_market_summary, release_listing_fetches CASCADE")
+        cursor.execute("""
+            CREATE TABLE release_sellers (
+                release_id INT, seller_id INT, currency CHAR(3), price FLOAT, media_condition TEXT, listing_id BIGINT,
+                created_time TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.executemany("INSERT INTO release_sellers (release_id, currency, price, media_condition, seller_id) "
+                           "VALUES (%s, %s, %s, %s, %s)", LISTINGS)
+        cursor.execute(open(os.path.join(os.path.dirname(__file__), "..", "db", "market.sql")).read())
+        cursor.execute(open(os.path.join(os.path.dirname(__file__), "..", "db", "active_listings.sql")).read())
+    p = PostgresDataStore(TEST_DATABASE_URL, "release_sellers")
+    store = MarketSummaryStore(p)
+    backfilled = store.summaries(1)
+    assert backfilled["$"]["median_price"] == 22.5 and backfilled["$"]["conditions"] == {"Mint (M)": 3, "Very Good (VG)": 1}
+
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("INSERT INTO release_sellers (release_id, currency, price, media_condition, seller_id) "
+                       "VALUES (1, '$', 40.0, 'Near Mint (NM or M-)', 105)")
+    assert store.write([1]) == 2
+
+    summaries = store.summaries(1)
+    assert summaries["€"] == backfilled["€"]
+    assert summaries["$"] == {"listing_count": 5, "seller_count": 4, "min_price": 10.0, "median_price": 25.0,
+                              "max_price": 40.0, "conditions": {"Mint (M)": 3, "Very Good (VG)": 1, "Near Mint (NM or M-)": 1}}
+    # Rewriting gives the same rows; the backfill and the scraper agree
+    store.write([1])
+    assert store.summaries(1) == summaries
+
+    # Once a full fetch no longer finds listings, they drop out of the summaries
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("INSERT INTO release_listing_fetches VALUES (1, now())")
+        cursor.execute("UPDATE release_sellers SET last_seen = now() WHERE price = 40.0")
+    conn.close()
+    assert store.write([1]) == 1
+    assert store.summaries(1) == {"$": {"listing_count": 1, "seller_count": 1, "min_price": 40.0, "median_price": 40.0,
+                                        "max_price": 40.0, "conditions": {"Near Mint (NM or M-)": 1}}}
@@ -0,0 +1,105 @@
+import os
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+import pytest
+from models.membership import MembershipStore, diff_members
+from models.records import Members, ReleaseResult
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+requires_postgres = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+def test_diff_members():
+    assert diff_members({"alice", "bob"}, ["bob", "carol"]) == ({"carol"}, {"alice"})
+    assert diff_members(set(), []) == (set(), set())
+
+
+def test_write_only_stores_changes():
+    data_store = MagicMock()
+    cursor = data_store.transaction.return_value.__enter__.return_value
+    cursor.fetchall.return_value = [(1, 10), (1, 11)]
+    users = MagicMock()
+    users.ids.return_value = {"bob": 11, "carol": 12}
+    releases = [
+        ReleaseResult(release_id=1, stats=Members(want=["bob", "carol"])),
+        # The stats page failed, so release 2's members are unknown and must not be touched
+        ReleaseResult(release_id=2, stats=Members()),
+    ]
+    with patch("models.membership.execute_values") as execute_values:
+        assert MembershipStore(data_store, users).write(releases, "want") == (1, 1)
+    assert cursor.execute.call_args[0][1] == ([1],)
+    # The read and all three writes share one transaction
+    data_store.transaction.assert_called_once()
+    events, added, removed = [call[0][2] for call in execute_values.call_args_list]
+    assert sorted(events) == [(1, "want", 10, False), (1, "want", 12, True)]
+    assert added == [(1, 12)]
+    assert removed == [(1, 10)]
+
+
+def test_write_fails_rather_than_guessing_members():
+    data_store = MagicMock()
+    data_store.transaction.return_value.__enter__.return_value.execute.side_effect = RuntimeError("connection lost")
+    users = MagicMock()
+    users.ids.return_value = {"bob": 11}
+    with patch("models.membership.execute_values") as execute_values:
+        with pytest.raises(RuntimeError):
+            MembershipStore(data_store, users).write([ReleaseResult(release_id=1, stats=Members(want=["bob"]))], "want")
+    execute_values.assert_not_called()
+
+
+def test_write_fails_when_users_cannot_be_resolved():
+    data_store = MagicMock()
+    users = MagicMock()
+    users.ids.side_effect = RuntimeError("Could not resolve user ids for 1 usernames.")
+    with patch("models.membership.execute_values") as execute_values:
+        with pytest.raises(RuntimeError):
+            MembershipStore(data_store, users).write([ReleaseResult(release_id=1, stats=Members(want=["bob"]))], "want")
+    execute_values.assert_not_called()
+    data_store.transaction.assert_not_called()
+
+
+@pytest.fixture
+def membership_db():
+    import psycopg2
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    with conn, conn.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS release_wants, release_haves, release_membership_events, release_sellers, users CASCADE")
+        for kind in ("wants", "haves"):
+            cursor.execute(f"""
+                CREATE TABLE release_{kind} (
+                    release_id INT, username TEXT, created_time TIMESTAMPTZ DEFAULT now(),
+                    PRIMARY KEY (release_id, username)
+                )
+            """)
+        cursor.execute("""
+            CREATE TABLE release_sellers (
+                release_id INT, seller TEXT, listing_id BIGINT, PRIMARY KEY (release_id, seller)
+            )
+        """)
+        cursor.execute("INSERT INTO release_wants (release_id, username) VALUES (2, 'dave')")
+        for migration in ("membership.sql", "users.sql"):
+            cursor.execute(open(os.path.join(os.path.dirname(__file__), "..", "db", migration)).read())
+    yield conn
+    conn.close()
+
+
+@requires_postgres
+def test_members_are_rebuilt_from_events(membership_db):
+    from models.sinks.postgres import PostgresDataStore
+    from models.users import UserDirectory
+    p = PostgresDataStore(TEST_DATABASE_URL, "release_wants")
+    store = MembershipStore(p, UserDirectory(p))
+    store.write([ReleaseResult(release_id=1, stats=Members(want=["alice", "bob"]))], "want")
+    between = datetime.now(timezone.utc)
+    store.write([ReleaseResult(release_id=1, stats=Members(want=["bob", "carol"]))], "want")
+    store.write([ReleaseResult(release_id=1, stats=None)], "want")
+
+    assert store.members_as_of(1, "want", datetime.now(timezone.utc)) == {"bob", "carol"}
+    assert store.members_as_of(1, "want", between) == {"alice", "bob"}
+    # Members already stored before the migration are kept as their first events
+    assert store.members_as_of(2, "want", datetime.now(timezone.utc)) == {"dave"}
+    with membership_db.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM release_membership_events")
+        assert cursor.fetchone()[0] == 5
+        cursor.execute("SELECT COUNT(*) FROM release_wants")
+        assert cursor.fetchone()[0] == 3
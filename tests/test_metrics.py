@@ -0,0 +1,71 @@
+import io
+import json
+import time
+
+from utils.metrics import Histogram, Metrics, SamplingProfiler, TimedReader, suffixed
+
+
+def test_histogram_quantiles_use_bucket_bounds():
+    histogram = Histogram(buckets=(0.01, 0.1, 1.0))
+    for value in [0.005] * 90 + [0.05] * 9 + [3.0]:
+        histogram.observe(value)
+
+    assert histogram.count == 100
+    assert histogram.quantile(0.5) == 0.01
+    assert histogram.quantile(0.99) == 0.1
+    assert histogram.quantile(1.0) == 3.0
+    assert histogram.cumulative_counts() == [90, 99, 99, 100]
+
+
+def test_metrics_dump_prometheus_and_json(tmp_path):
+    metrics = Metrics()
+    metrics.inc("xml_records", 10)
+    with metrics.timer("parse"):
+        pass
+    metrics.timed("insert")(lambda: None)()
+
+    prometheus = metrics.to_prometheus()
+    assert "discogs_xml_records_total 10" in prometheus
+    assert 'discogs_stage_seconds_count{stage="parse"} 1' in prometheus
+    assert 'discogs_stage_seconds_bucket{stage="insert",le="+Inf"} 1' in prometheus
+
+    metrics.dump(str(tmp_path / "metrics.json"))
+    snapshot = json.loads((tmp_path / "metrics.json").read_text())
+    assert snapshot["counters"] == {"xml_records": 10}
+    assert set(snapshot["stages"]) == {"parse", "insert"}
+
+
+def test_timed_reader_counts_bytes():
+    metrics = Metrics()
+    reader = TimedReader(io.BytesIO(b"x" * 100), "decompress", registry=metrics)
+
+    while reader.read(30):
+        pass
+
+    assert metrics.counters["decompress_bytes"] == 100
+    assert metrics.histograms["decompress"].count == 5
+
+
+def busy_loop(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_sampling_profiler_writes_collapsed_stacks(tmp_path):
+    path = tmp_path / "profile.txt"
+    profiler = SamplingProfiler(str(path), interval=0.001)
+    profiler.start()
+    busy_loop(0.2)
+    profiler.stop()
+
+    lines = path.read_text().splitlines()
+    assert lines
+    assert any("busy_loop (test_metrics.py" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+def test_suffixed_paths():
+    assert suffixed("out/metrics.prom", "release") == "out/metrics.release.prom"
+    assert suffixed("metrics", "artist") == "metrics.artist"
+    assert suffixed(None, "artist") is None
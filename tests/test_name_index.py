@@ -0,0 +1,82 @@
+import random
+
+from models.sinks.shard_cache import TeeDataStore
+from tests.dump_generator import DumpGenerator
+from tests.test_shard_cache import RecordingDataStore
+from utils import name_index
+from utils.name_index import NameIndex, NameIndexBuilder, normalize, title_artist, trigrams
+from utils.xml_handler import ArtistParser, XMLDataHandler
+
+ARTISTS = [
+    {"id": 1, "name": "Aphex Twin", "namevariations": ["AFX", "Aphex Twin", "The Aphex Twin"]},
+    {"id": 2, "name": "Björk", "namevariations": ["Bjork"]},
+    {"id": 3, "name": "John Smith (2)", "namevariations": None},
+    {"id": 4, "name": "John Smith", "namevariations": []},
+    {"id": 5, "name": None},
+]
+
+
+def build(tmp_path, records):
+    builder = NameIndexBuilder(str(tmp_path / "names.idx"))
+    builder.insert(records)
+    return builder.finish()
+
+
+def brute_force(records, query, min_similarity):
+    grams = trigrams(normalize(query))
+    best = {}
+    for record in records:
+        for name in [record["name"]] + (record.get("namevariations") or []):
+            name_grams = trigrams(normalize(name))
+            similarity = len(grams & name_grams) / len(grams | name_grams)
+            if similarity >= min_similarity:
+                best[record["id"]] = max(best.get(record["id"], 0), round(similarity, 4))
+    return best
+
+
+def test_normalize():
+    assert normalize("Björk") == "bjork"
+    assert normalize("John Smith (2)") == "john smith"
+    assert normalize("  Mr. Oizo_&_Friends* ") == "mr oizo friends"
+    assert title_artist("Aphex Twin - Selected Ambient Works 85-92 (2xLP, Album)") == "Aphex Twin"
+    assert title_artist("Untitled") == "Untitled"
+
+
+def test_search_ranks_names_and_variations(tmp_path):
+    index = build(tmp_path, ARTISTS)
+
+    # Duplicate variations are stored once; the record without a name is skipped
+    assert len(index) == 6
+    assert index.search("aphex twin")[0] == (1, "Aphex Twin", 1.0)
+    assert index.search("Bjork") == [(2, "Björk", 1.0)]
+    assert [artist_id for artist_id, _, _ in index.search("John Smith")] == [3, 4]
+    assert index.search("Aphex Twim", limit=1)[0][:2] == (1, "Aphex Twin")
+    assert index.search("zzzz") == [] and index.search("") == [] and index.search("!!") == []
+    assert index.search_many(["AFX", "Björk", "afx", None]) == [[(1, "AFX", 1.0)], [(2, "Björk", 1.0)],
+                                                               [(1, "AFX", 1.0)], []]
+    index.close()
+
+    reopened = NameIndex(str(tmp_path / "names.idx"))
+    assert reopened.search("the aphex twin", limit=1) == [(1, "The Aphex Twin", 1.0)]
+    reopened.close()
+
+
+def test_search_matches_brute_force(tmp_path, monkeypatch):
+    path = tmp_path / "artists.xml.gz"
+    DumpGenerator("artist").write(path, records=400)
+    recorded, builder = RecordingDataStore(), NameIndexBuilder(str(tmp_path / "names.idx"))
+    XMLDataHandler(f"file://{path}", str(tmp_path), data_store=TeeDataStore(recorded, builder),
+                   parser_class=ArtistParser(), keep_file=True).parse_xml()
+    index = builder.finish()
+    monkeypatch.setattr(name_index, "NAME_SEARCH_MAX_POSTINGS", 10**9)
+    monkeypatch.setattr(name_index, "NAME_SEARCH_CANDIDATES", 10**9)
+
+    rng = random.Random(0)
+    queries = [rng.choice(recorded.records)["name"] for _ in range(20)]
+    queries += [query[:-2] + "qz" for query in queries] + ["Deep Night", "velvet"]
+    for query, matches in zip(queries, index.search_many(queries, limit=1000)):
+        assert {artist_id: similarity for artist_id, _, similarity in matches} == brute_force(recorded.records, query, 0.3)
+        assert [similarity for _, _, similarity in matches] == sorted((similarity for _, _, similarity in matches), reverse=True)
+    # With a limit the best matches come first; workers give the same results
+    assert index.search_many(queries, limit=3, workers=2) == [index.search(query, limit=3) for query in queries]
+    index.close()
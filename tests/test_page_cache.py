@@ -0,0 +1,59 @@
+import os
+import time
+from unittest.mock import MagicMock
+import pytest
+from utils.page_cache import PageCache
+from models.discogs_objects import DiscogsRelease
+
+@pytest.fixture
+def cache(tmp_path):
+    return PageCache(str(tmp_path / "cache"))
+
+def test_round_trip(cache):
+    cache.set("https://www.discogs.com/release/1", "<html>release</html>", "release")
+    assert cache.get("https://www.discogs.com/release/1", "release") == "<html>release</html>"
+    assert cache.hits == 1
+
+def test_miss_for_unknown_url(cache):
+    assert cache.get("https://www.discogs.com/release/2", "release") is None
+    assert cache.misses == 1
+
+def test_expired_entry_is_ignored(tmp_path):
+    cache = PageCache(str(tmp_path / "cache"), ttls={"sellers": 0})
+    cache.set("https://www.discogs.com/sell/release/1", "<html>sellers</html>", "sellers")
+    time.sleep(0.01)
+    assert cache.get("https://www.discogs.com/sell/release/1", "sellers") is None
+
+def test_offline_mode_ignores_ttl(tmp_path):
+    directory = str(tmp_path / "cache")
+    PageCache(directory).set("https://www.discogs.com/release/1", "<html>old</html>", "release")
+    offline = PageCache(directory, ttls={"release": 0}, offline=True)
+    time.sleep(0.01)
+    assert offline.get("https://www.discogs.com/release/1", "release") == "<html>old</html>"
+
+def test_eviction_keeps_cache_under_max_bytes(tmp_path):
+    cache = PageCache(str(tmp_path / "cache"), max_bytes=2000)
+    for i in range(20):
+        cache.set(f"https://www.discogs.com/release/{i}", os.urandom(200).hex(), "release")
+    assert cache.total_bytes <= 2000
+    assert cache.get("https://www.discogs.com/release/19", "release") is not None
+
+def test_page_uses_cache_before_session(tmp_path):
+    cache = PageCache(str(tmp_path / "cache"))
+    session_manager = MagicMock()
+    session = MagicMock()
+    session.get.return_value.text = "<html>fresh</html>"
+    session_manager.get_session.return_value = (session, None)
+
+    first = DiscogsRelease(1, session_manager, cache=cache)
+    assert first.fetch_page_content() == "<html>fresh</html>"
+    second = DiscogsRelease(1, session_manager, cache=cache)
+    assert second.fetch_page_content() == "<html>fresh</html>"
+    assert session.get.call_count == 1
+
+def test_offline_page_does_not_request_session(tmp_path):
+    cache = PageCache(str(tmp_path / "cache"), offline=True)
+    session_manager = MagicMock()
+    page = DiscogsRelease(1, session_manager, cache=cache)
+    assert page.fetch_page_content() is None
+    session_manager.get_session.assert_not_called()
@@ -0,0 +1,25 @@
+import pickle
+import pytest
+from models.records import Listing, ReleaseStats
+
+
+def test_records_have_no_instance_dict():
+    listing = Listing(seller="carol", price=12.5)
+    assert not hasattr(listing, "__dict__")
+    with pytest.raises(AttributeError):
+        listing.colour = "red"
+    assert listing.to_dict()["seller"] == "carol"
+    assert listing.as_tuple()[Listing.__slots__.index("price")] == 12.5
+
+
+def test_records_compare_by_value_and_pickle():
+    stats = ReleaseStats(have=3, want=4)
+    assert stats == ReleaseStats(have=3, want=4)
+    assert stats != ReleaseStats(have=3)
+    # Results travel back from the parse process pool pickled
+    assert pickle.loads(pickle.dumps(stats)) == stats
+
+
+def test_unknown_fields_are_rejected():
+    with pytest.raises(TypeError):
+        ReleaseStats(colour="red")
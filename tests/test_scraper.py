@@ -1,30 +1,210 @@
+import re
 from unittest.mock import patch, MagicMock
 import pytest
-from scraper.scraper import Scraper
+from pathlib import Path
+from scraper.scraper import Scraper, parse_release_pages
+from models import discogs_objects
+from tests.stub_discogs import StubDiscogs
 
 @pytest.fixture
 def mock_dependencies():
     with patch('scraper.scraper.ProxyManager') as MockProxyManager, \
-         patch('scraper.scraper.SessionManager') as MockSessionManager, \
-         patch('concurrent.futures.ThreadPoolExecutor') as MockThreadPoolExecutor:
+         patch('scraper.scraper.SessionManager') as MockSessionManager:
         # Configure the mocks as needed
         MockProxyManager.return_value = MagicMock()
         MockSessionManager.return_value = MagicMock()
-        # MockThreadPoolExecutor setup if necessary
-        yield MockProxyManager, MockSessionManager, MockThreadPoolExecutor
+        yield MockProxyManager, MockSessionManager
 
-def test_scraper_run(mock_dependencies):
-    # Unpack the mocks
-    MockProxyManager, MockSessionManager, MockThreadPoolExecutor = mock_dependencies
+@pytest.mark.parametrize("parse_workers", [0, 1])
+def test_scraper_run(mock_dependencies, parse_workers):
+    scraper = Scraper("http://proxy-list.com", max_workers=2, parse_workers=parse_workers)
+    requested = {}
+    def fetch_release_pages(release_id, watermark):
+        requested[release_id] = watermark
+        # Release 2's pages can't be fetched
+        if release_id == 2:
+            return None
+        return {"release_id": release_id, "release": None, "stats": None, "sellers": [], "watermark": watermark}
+    scraper.fetch_release_pages = fetch_release_pages
+    try:
+        results = scraper.run([1, 2, 3], {3: 100})
+    finally:
+        scraper.close()
 
-    # Setup the return value for the future object
-    mock_future = MagicMock()
-    mock_future.result.return_value = {"release_id": "12345", "release": {}, "stats": {}, "sellers": []}
-    MockThreadPoolExecutor.return_value.submit.return_value = mock_future
+    assert requested == {1: None, 2: None, 3: 100}
+    assert sorted(result.release_id for result in results) == [1, 3]
+    assert all(result.release is None and result.sellers == [] for result in results)
+    assert scraper.stage_stats["fetch"].count == 3
+    assert scraper.stage_stats["parse"].count == 2
 
+@pytest.mark.parametrize("parse_workers", [0, 2])
+def test_scraper_parses_fetched_pages(mock_dependencies, parse_workers):
+    fixtures = Path(__file__).parent / "fixtures"
+    pages = {name: (fixtures / f"{name}.html").read_text(encoding="utf-8") for name in ("release", "stats", "sellers")}
+
+    pages["sellers"] = [pages["sellers"]]
+
+    scraper = Scraper("http://proxy-list.com", max_workers=2, parse_workers=parse_workers)
+    scraper.fetch_release_pages = lambda release_id, watermark: dict(pages, release_id=release_id)
+    try:
+        results = scraper.run([1, 2, 3])
+    finally:
+        scraper.close()
+
+    assert sorted(result.release_id for result in results) == [1, 2, 3]
+    assert results[0].release.have == 1234
+    assert results[0].stats.want == ["frank", "grace", "heidi", "ivan&co"]
+    assert len(results[0].sellers) == 5
+    assert results[0].listing_count == 5
+    assert scraper.stage_stats["fetch"].count == 3
+    assert scraper.stage_stats["parse"].count == 3
+
+def listing_page(page, total, ids):
+    html = (Path(__file__).parent / "fixtures" / "sellers.html").read_text(encoding="utf-8")
+    html = html.replace("1 &ndash; 5 of 5", f"{(page - 1) * 250 + 1} &ndash; {page * 250} of {total:,}")
+    listing_ids = iter(ids)
+    return re.sub(r"/sell/item/\d+", lambda _: f"/sell/item/{next(listing_ids)}", html)
+
+@pytest.fixture
+def paged_scraper(mock_dependencies):
+    scraper = Scraper("http://proxy-list.com", max_workers=1, page_workers=2)
+    total = 1100
+    # Newest listings first: page 1 holds ids 1000..996, page 2 995..991, ...
+    scraper.requested_pages = []
+    def fetch_listing_page(release_id, page):
+        scraper.requested_pages.append(page)
+        first_id = 1000 - (page - 1) * 5
+        return listing_page(page, total, range(first_id, first_id - 5, -1))
+    scraper._fetch_listing_page = fetch_listing_page
+    yield scraper
+    scraper.close()
+
+def test_fetch_listing_pages_reads_every_page(paged_scraper):
+    pages = paged_scraper.fetch_listing_pages(1)
+    assert len(pages) == 5
+    assert sorted(paged_scraper.requested_pages) == [1, 2, 3, 4, 5]
+
+def test_fetch_listing_pages_stops_at_watermark(paged_scraper):
+    assert len(paged_scraper.fetch_listing_pages(1, watermark=998)) == 1
+    assert paged_scraper.requested_pages == [1]
+
+def test_only_full_listing_walks_are_complete(paged_scraper):
+    parse = lambda pages, watermark: parse_release_pages(
+        {"release_id": 1, "release": None, "stats": None, "sellers": pages, "watermark": watermark})
+    assert parse(paged_scraper.fetch_listing_pages(1), None).listings_complete
+    assert not parse(paged_scraper.fetch_listing_pages(1, watermark=993), 993).listings_complete
+    paged_scraper.max_listing_pages = 3
+    assert not parse(paged_scraper.fetch_listing_pages(1), None).listings_complete
+
+def test_failed_listing_page_fails_the_whole_fetch(paged_scraper):
+    fetch_listing_page = paged_scraper._fetch_listing_page
+    paged_scraper._fetch_listing_page = lambda release_id, page: None if page == 3 else fetch_listing_page(release_id, page)
+    assert paged_scraper.fetch_listing_pages(1) is None
+    assert 5 not in paged_scraper.requested_pages
+
+def test_watermark_filters_seen_listings(paged_scraper):
+    pages = paged_scraper.fetch_listing_pages(1, watermark=993)
+    assert sorted(paged_scraper.requested_pages) == [1, 2, 3]
+    result = parse_release_pages({"release_id": 1, "release": None, "stats": None, "sellers": pages, "watermark": 993})
+    assert [item.listing_id for item in result.sellers] == [1000, 999, 998, 997, 996, 995, 994]
+
+def test_single_page_release_needs_one_request(mock_dependencies):
+    scraper = Scraper("http://proxy-list.com", max_workers=1)
+    scraper._fetch_listing_page = MagicMock(return_value=listing_page(1, 5, range(5)))
+    assert len(scraper.fetch_listing_pages(1)) == 1
+    scraper._fetch_listing_page.assert_called_once_with(1, 1)
+    scraper.close()
+
+@pytest.mark.parametrize("failed_page", ["release", "stats", "listings"])
+def test_release_with_a_failed_page_is_not_returned(mock_dependencies, failed_page):
     scraper = Scraper("http://proxy-list.com", max_workers=1)
-    results = scraper.run(['12345'])
+    pages = {"release": "<html>release</html>", "stats": "<html>stats</html>"}
+    pages[failed_page] = None
+    with patch("scraper.scraper.DiscogsRelease") as release_page, \
+         patch("scraper.scraper.DiscogsStatsPage") as stats_page:
+        release_page.return_value.fetch_page_content.return_value = pages.get("release")
+        stats_page.return_value.fetch_page_content.return_value = pages.get("stats")
+        scraper._fetch_listing_page = MagicMock(
+            return_value=None if failed_page == "listings" else listing_page(1, 5, range(5)))
+        try:
+            assert scraper.fetch_release_pages(1) is None
+            assert scraper.run([1]) == []
+        finally:
+            scraper.close()
+
+def test_run_sellers_groups_listings_by_release(mock_dependencies):
+    scraper = Scraper("http://proxy-list.com", max_workers=2)
+    inventories = {
+        "bob_records": listing_page(1, 5, range(500, 495, -1)).replace('data-release-id="12345"', 'data-release-id="111"', 2),
+        "carol": listing_page(1, 5, range(400, 395, -1)),
+    }
+    scraper._fetch_inventory_page = lambda username, page: inventories[username]
+    try:
+        releases = scraper.run_sellers(["bob_records", "carol"])
+    finally:
+        scraper.close()
+
+    by_release = {release.release_id: release.sellers for release in releases}
+    assert set(by_release) == {111, 12345}
+    assert {item.seller: item.listing_id for item in by_release[111]} == {"bob_records": 500, "carol": 499}
+    # Every copy a seller lists is kept
+    assert sorted(item.listing_id for item in by_release[12345]) == [396, 397, 398, 399, 400, 496, 497, 498]
+
+def test_run_skips_completed_releases(mock_dependencies):
+    scraper = Scraper("http://proxy-list.com", max_workers=2, completed={1, 3})
+    scraper.fetch_release_pages = MagicMock(return_value=None)
+    try:
+        scraper.run([1, 2, 3, 4])
+    finally:
+        scraper.close()
+    assert sorted(call.args[0] for call in scraper.fetch_release_pages.call_args_list) == [2, 4]
+
+def test_scraper_end_to_end_against_stub_server(monkeypatch):
+    monkeypatch.setattr(discogs_objects, "RETRY_BACKOFF_SECONDS", 0)
+    monkeypatch.setattr(discogs_objects, "MAX_RETRIES", 10)
+    discogs_objects.fetch_stats.reset()
+    with StubDiscogs(rate_limit_rate=0.2, error_rate=0.1, proxies=3, seed=7) as stub:
+        monkeypatch.setattr(discogs_objects, "DISCOGS_BASE_URL", stub.base_url)
+        scraper = Scraper(stub.proxy_list_url, max_workers=4)
+        scraper.session_manager.rate_limit_per_minute = 60000
+        try:
+            results = scraper.run(list(range(1, 11)))
+        finally:
+            scraper.close()
+
+    assert sorted(result.release_id for result in results) == list(range(1, 11))
+    assert all(result.release.have == 1234 and len(result.sellers) == 5 for result in results)
+    assert len(scraper.session_manager.sessions) == 3
+    injected = stub.counts["rate_limited"] + stub.counts["errors"]
+    assert injected > 0
+    assert discogs_objects.fetch_stats.retries == injected
+    assert discogs_objects.fetch_stats.rate_limited == stub.counts["rate_limited"]
+
+def test_banned_proxy_is_replaced(monkeypatch):
+    monkeypatch.setattr(discogs_objects, "RETRY_BACKOFF_SECONDS", 0)
+    banned, fresh = MagicMock(), MagicMock()
+    banned.get.return_value = MagicMock(status_code=403, headers={})
+    fresh.get.return_value = MagicMock(status_code=200, headers={}, text="<html></html>")
+    session_manager = MagicMock()
+    session_manager.get_session.return_value = (banned, "http://banned:8080")
+    session_manager.replace_proxy.return_value = (fresh, "http://fresh:8080")
+
+    page = discogs_objects.DiscogsRelease(1, session_manager)
+    assert page.fetch_page_content() == "<html></html>"
+    session_manager.replace_proxy.assert_called_once_with("http://banned:8080")
+    assert page.proxy == "http://fresh:8080"
+
+def test_rate_limited_request_rotates_proxy(monkeypatch):
+    monkeypatch.setattr(discogs_objects, "RETRY_BACKOFF_SECONDS", 0)
+    limited, other = MagicMock(), MagicMock()
+    limited.get.return_value = MagicMock(status_code=429, headers={"Retry-After": "30"})
+    other.get.return_value = MagicMock(status_code=200, headers={}, text="<html></html>")
+    session_manager = MagicMock()
+    session_manager.get_session.side_effect = [(limited, "http://limited:8080"), (other, "http://other:8080")]
 
-    # Assertions
-    assert len(results) == 1, "Expected a single result"
-    assert results[0]["release_id"] == "12345", "Result should contain the correct release_id"
+    page = discogs_objects.DiscogsRelease(1, session_manager)
+    with patch("time.sleep") as sleep:
+        assert page.fetch_page_content() == "<html></html>"
+    session_manager.back_off.assert_called_once_with("http://limited:8080", 30.0)
+    assert page.proxy == "http://other:8080"
+    assert all(call.args[0] == 0 for call in sleep.call_args_list)
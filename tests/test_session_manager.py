@@ -2,6 +2,7 @@ import pytest
 from unittest.mock import patch, MagicMock
 from managers.session_manager import SessionManager
 from managers.proxy_manager import ProxyManager
+import threading
 import time
 
 @pytest.fixture
@@ -48,3 +49,69 @@ def test_unique_session_per_proxy_key(mock_proxy_manager, use_proxy):
     session2 = session_manager.get_session(use_proxy=not use_proxy)
     
     assert session1 != session2, "Sessions should differ based on proxy use."
+
+def test_sessions_are_pooled_per_proxy(mock_proxy_manager):
+    session_manager = SessionManager(mock_proxy_manager, rate_limit_per_minute=6000, pool_maxsize=32)
+    session, proxy = session_manager.get_session()
+    mock_proxy_manager.get_proxy.return_value = 'http://otherproxy:8080'
+    other_session, _ = session_manager.get_session()
+    mock_proxy_manager.get_proxy.return_value = 'http://mockproxy:8080'
+
+    assert session_manager.get_session()[0] is session
+    assert other_session is not session
+    assert session.proxies == {"http": proxy, "https": proxy}
+    assert session.get_adapter("https://www.discogs.com")._pool_maxsize == 32
+
+def test_idle_sessions_are_evicted_keeping_cookies(mock_proxy_manager):
+    session_manager = SessionManager(mock_proxy_manager, idle_seconds=0)
+    session, _ = session_manager.get_session()
+    session.cookies.set("cf_clearance", "solved", domain="www.discogs.com")
+    session_manager.local.sessions['http://mockproxy:8080']['last_used'] -= 1
+
+    new_session, _ = session_manager.get_session()
+    assert new_session is not session
+    assert new_session.cookies.get("cf_clearance") == "solved"
+
+def test_threads_do_not_share_sessions(mock_proxy_manager):
+    session_manager = SessionManager(mock_proxy_manager, rate_limit_per_minute=6000)
+    session, _ = session_manager.get_session()
+    session.cookies.set("cf_clearance", "solved", domain="www.discogs.com")
+    session_manager._close_session('http://mockproxy:8080')
+    session, _ = session_manager.get_session()
+    other_thread_sessions = []
+    thread = threading.Thread(target=lambda: other_thread_sessions.append(session_manager.get_session()[0]))
+    thread.start()
+    thread.join()
+
+    assert other_thread_sessions[0] is not session
+    assert other_thread_sessions[0].cookies.get("cf_clearance") == "solved"
+    assert session_manager.sessions['http://mockproxy:8080']['request_count'] == 3
+
+def test_replace_proxy_drops_it_from_the_rotation(mock_proxy_manager):
+    mock_proxy_manager.proxies = ['http://mockproxy:8080', 'http://otherproxy:8080']
+    session_manager = SessionManager(mock_proxy_manager, rate_limit_per_minute=6000)
+    session, proxy = session_manager.get_session()
+    mock_proxy_manager.get_proxy.return_value = 'http://otherproxy:8080'
+
+    new_session, new_proxy = session_manager.replace_proxy(proxy)
+
+    mock_proxy_manager.remove_proxy.assert_called_once_with('http://mockproxy:8080')
+    assert new_proxy == 'http://otherproxy:8080' and new_session is not session
+    assert 'http://mockproxy:8080' not in session_manager.sessions
+    assert 'http://mockproxy:8080' not in session_manager.local.sessions
+
+def test_replace_proxy_keeps_the_last_proxy(mock_proxy_manager):
+    mock_proxy_manager.proxies = ['http://mockproxy:8080']
+    session_manager = SessionManager(mock_proxy_manager, rate_limit_per_minute=6000)
+    _, proxy = session_manager.get_session()
+
+    assert session_manager.replace_proxy(proxy)[1] == proxy
+    mock_proxy_manager.remove_proxy.assert_not_called()
+
+def test_back_off_holds_the_proxy(mock_proxy_manager):
+    session_manager = SessionManager(mock_proxy_manager, rate_limit_per_minute=6000)
+    session_manager.back_off('http://mockproxy:8080', 30)
+
+    with patch('time.sleep', autospec=True) as mock_sleep:
+        session_manager.get_session()
+    assert mock_sleep.call_args[0][0] == pytest.approx(30, abs=1)
@@ -0,0 +1,88 @@
+from functools import partial
+import glob
+import gzip
+import json
+import os
+
+from models.sinks.db import BaseDataStore
+from models.sinks.shard_cache import ShardedFileStore, ShardReader, TeeDataStore, shard_path
+from tests.dump_generator import DumpGenerator
+from utils import xml_handler
+from utils.xml_handler import ReleaseParser, XMLDataHandler
+
+
+class RecordingDataStore(BaseDataStore):
+    def __init__(self):
+        self.records = []
+
+    def connect(self):
+        pass
+
+    def insert(self, records):
+        self.records.extend(records)
+
+
+class FileDataStore(BaseDataStore):
+    """Appends records to a file per process, so replays in worker processes can be checked."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def connect(self):
+        pass
+
+    def insert(self, records):
+        with open(os.path.join(self.directory, f"{os.getpid()}.ndjson"), "a") as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+
+
+def cache_releases(tmp_path, monkeypatch, records=50, shards=3):
+    monkeypatch.setattr(xml_handler, "BATCH_SIZE", 7)
+    path = tmp_path / "releases.xml.gz"
+    DumpGenerator("release").write(path, records=records)
+    recorded, cache = RecordingDataStore(), ShardedFileStore(str(tmp_path / "cache"), shards=shards)
+    XMLDataHandler(f"file://{path}", str(tmp_path), data_store=TeeDataStore(recorded, cache),
+                   parser_class=ReleaseParser(), keep_file=True).parse_xml()
+    cache.finish(url="file://releases.xml.gz")
+    return recorded.records, cache
+
+
+def test_cache_round_trips_parsed_records(tmp_path, monkeypatch):
+    parsed, cache = cache_releases(tmp_path, monkeypatch)
+
+    assert ShardReader.complete(cache.directory)
+    reader = ShardReader(cache.directory)
+    assert reader.manifest["url"] == "file://releases.xml.gz"
+    assert reader.records == 50 and len(reader.paths) == 3
+    assert sorted(reader, key=lambda record: int(record["id"])) == parsed
+    # Each batch is its own gzip member
+    with open(shard_path(cache.directory, 0), "rb") as f:
+        assert f.read().count(b"\x1f\x8b\x08") >= 3
+    assert [len(batch) for batch in ShardReader.read_shard(shard_path(cache.directory, 0), batch_size=5)] == [5, 5, 5, 5, 1]
+
+
+def test_replay_loads_every_shard_in_parallel(tmp_path, monkeypatch):
+    parsed, cache = cache_releases(tmp_path, monkeypatch)
+    out = tmp_path / "out"
+    out.mkdir()
+
+    count = ShardReader(cache.directory).replay(partial(FileDataStore, str(out)), workers=2)
+
+    replayed = [json.loads(line) for path in glob.glob(str(out / "*.ndjson")) for line in open(path)]
+    assert count == 50
+    assert sorted(replayed, key=lambda record: int(record["id"])) == parsed
+
+
+def test_writing_a_cache_replaces_the_previous_one(tmp_path, monkeypatch):
+    _, cache = cache_releases(tmp_path, monkeypatch)
+
+    again = ShardedFileStore(cache.directory, shards=2)
+    assert ShardReader.complete(cache.directory)
+    again.insert([{"id": 1}])
+    assert not ShardReader.complete(cache.directory)
+    again.finish()
+
+    assert list(ShardReader(cache.directory)) == [{"id": 1}]
+    assert sorted(os.listdir(cache.directory)) == ["manifest.json", "part-00000.ndjson.gz"]
+    with gzip.open(shard_path(cache.directory, 0)) as f:
+        assert f.read() == b'{"id":1}\n'
@@ -0,0 +1,117 @@
+import os
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+import pytest
+from models.records import ReleaseResult, ReleaseStats
+from models.snapshots import ReleaseDetailsStore
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+requires_postgres = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+def result(release_id, have=None, **fields):
+    stats = ReleaseStats(have=have, **fields) if have is not None else None
+    return ReleaseResult(release_id=release_id, release=stats)
+
+
+def test_write_only_changed_releases():
+    data_store = MagicMock()
+    cursor = data_store.transaction.return_value.__enter__.return_value
+    cursor.fetchall.return_value = [(1, *ReleaseStats(have=10).as_tuple()), (2, *ReleaseStats(have=20).as_tuple())]
+    now = datetime(2024, 1, 15, tzinfo=timezone.utc)
+    store = ReleaseDetailsStore(data_store)
+
+    with patch("models.snapshots.execute_values") as execute_values:
+        changed = store.write([result(1, 10), result(2, 21), result(3, 30), result(4)], now=now)
+
+    assert changed == 2
+    data_store.transaction.assert_called_once()
+    assert sorted(cursor.execute.call_args_list[0][0][1][0]) == [1, 2, 3]
+    assert cursor.execute.call_args_list[1][0] == ("SELECT release_detail_snapshot_partition(%s)", (now,))
+    snapshots, details = (call[0][2] for call in execute_values.call_args_list)
+    assert [row[:3] for row in snapshots] == [(2, now, 21), (3, now, 30)]
+    assert [row[:2] for row in details] == [(2, 21), (3, 30)]
+    assert store.partitions == {(2024, 1)}
+
+
+def test_write_nothing_when_unchanged():
+    data_store = MagicMock()
+    cursor = data_store.transaction.return_value.__enter__.return_value
+    cursor.fetchall.return_value = [(1, *ReleaseStats(have=10).as_tuple())]
+
+    with patch("models.snapshots.execute_values") as execute_values:
+        assert ReleaseDetailsStore(data_store).write([result(1, 10)]) == 0
+        assert ReleaseDetailsStore(data_store).write([result(2)]) == 0
+    execute_values.assert_not_called()
+
+
+def test_failed_write_raises_and_creates_the_partition_again():
+    data_store = MagicMock()
+    cursor = data_store.transaction.return_value.__enter__.return_value
+    cursor.fetchall.return_value = []
+    store = ReleaseDetailsStore(data_store)
+    now = datetime(2024, 1, 15, tzinfo=timezone.utc)
+
+    with patch("models.snapshots.execute_values", side_effect=RuntimeError("insert failed")):
+        with pytest.raises(RuntimeError):
+            store.write([result(1, 10)], now=now)
+    assert store.partitions == set()
+    with patch("models.snapshots.execute_values"):
+        store.write([result(1, 10)], now=now)
+    partition_calls = [call for call in cursor.execute.call_args_list if "partition" in call[0][0]]
+    assert len(partition_calls) == 2
+
+
+@requires_postgres
+def test_history_and_downsample():
+    import psycopg2
+    from models.sinks.postgres import PostgresDataStore
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS release_details, release_detail_snapshots, release_detail_snapshot_downsampling CASCADE")
+        cursor.execute("""
+            CREATE TABLE release_details (
+                release_id INT PRIMARY KEY, have INT, want INT, avg_rating FLOAT, ratings INT,
+                last_sold DATE, low FLOAT, median FLOAT, high FLOAT,
+                created_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("INSERT INTO release_details (release_id, have, created_time) VALUES (1, 5, '2023-12-01T00:00:00Z')")
+        cursor.execute(open(os.path.join(os.path.dirname(__file__), "..", "db", "snapshots.sql")).read())
+    p = PostgresDataStore(TEST_DATABASE_URL, "release_details")
+    store = ReleaseDetailsStore(p)
+    start = datetime(2024, 1, 1, 6, tzinfo=timezone.utc)
+
+    # Four scrapes a day for a month and a half; have changes once a day, the rest never does.
+    for hour in range(0, 45 * 24, 6):
+        now = start + timedelta(hours=hour)
+        store.write([result(1, 10 + hour // 24, want=3, last_sold=date(2023, 11, 2))], now=now)
+
+    history = store.history(1)
+    assert len(history) == 1 + 45
+    assert history[0][1] == ReleaseStats(have=5)
+    assert store.current([1])[1] == ReleaseStats(have=54, want=3, last_sold=date(2023, 11, 2))
+    assert store.as_of(1, datetime(2024, 1, 3, tzinfo=timezone.utc)).have == 11
+    assert store.as_of(1, datetime(2023, 1, 1, tzinfo=timezone.utc)) is None
+
+    # Several changes within a day collapse to the day's last value once old enough.
+    for hour in range(4):
+        store.write([result(2, hour)], now=start + timedelta(hours=hour * 5))
+    assert store.downsample(now=start + timedelta(days=31)) == 3
+    assert [stats.have for _, stats in store.history(2)] == [3]
+    # A snapshot inside the window already thinned out isn't looked at again.
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("INSERT INTO release_detail_snapshots (release_id, snapshot_time, have) VALUES (2, %s, 7)",
+                       (start + timedelta(hours=1),))
+    conn.close()
+    assert store.downsample(now=start + timedelta(days=31)) == 0
+
+    # Over a year on, only the last snapshot of each week is kept.
+    store.downsample(now=start + timedelta(days=500))
+    with psycopg2.connect(TEST_DATABASE_URL) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT unit, downsampled_until FROM release_detail_snapshot_downsampling ORDER BY unit")
+        assert cursor.fetchall() == [("day", datetime(2025, 4, 15, tzinfo=timezone.utc)),
+                                     ("week", datetime(2024, 5, 13, tzinfo=timezone.utc))]
+    conn.close()
+    weeks = {snapshot_time.isocalendar()[:2] for snapshot_time, _ in store.history(1)}
+    assert len(store.history(1)) == len(weeks)
+    assert store.history(1)[-1][1].have == 54
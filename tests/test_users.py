@@ -0,0 +1,59 @@
+from unittest.mock import MagicMock
+import pytest
+from models.users import UserDirectory
+
+
+def resolving(*results):
+    data_store = MagicMock()
+    cursor = data_store.transaction.return_value.__enter__.return_value
+    cursor.fetchall.side_effect = results
+    return data_store, cursor
+
+
+@pytest.fixture
+def data_store():
+    data_store = MagicMock()
+    user_ids = {"alice": 1, "bob": 2, "carol": 3}
+    cursor = data_store.transaction.return_value.__enter__.return_value
+    cursor.execute.side_effect = lambda query, params: setattr(
+        cursor, "rows", [(username, user_ids[username]) for username in params[0]]
+    )
+    cursor.fetchall.side_effect = lambda: cursor.rows
+    return data_store
+
+
+def test_ids_are_cached(data_store):
+    users = UserDirectory(data_store)
+    assert users.ids(["alice", "bob", "alice", None]) == {"alice": 1, "bob": 2}
+    assert users.id("alice") == 1
+    assert data_store.transaction.call_count == 1
+    assert (users.hits, users.misses) == (1, 2)
+
+
+def test_least_recently_used_ids_are_evicted(data_store):
+    users = UserDirectory(data_store, cache_size=2)
+    users.ids(["alice", "bob"])
+    users.id("alice")
+    users.id("carol")
+    assert list(users.cache) == ["alice", "carol"]
+
+
+def test_unresolved_usernames_are_retried():
+    data_store, cursor = resolving([("alice", 1)], [("bob", 2)])
+    assert UserDirectory(data_store).ids(["alice", "bob"]) == {"alice": 1, "bob": 2}
+    assert cursor.execute.call_args[0][1][0] == ["bob"]
+
+
+def test_unresolvable_usernames_raise():
+    data_store, _ = resolving([("alice", 1)], [])
+    users = UserDirectory(data_store)
+    with pytest.raises(RuntimeError):
+        users.ids(["alice", "bob"])
+    assert not users.cache
+
+
+def test_database_errors_raise():
+    data_store = MagicMock()
+    data_store.transaction.return_value.__enter__.return_value.execute.side_effect = RuntimeError("connection lost")
+    with pytest.raises(RuntimeError):
+        UserDirectory(data_store).ids(["alice"])
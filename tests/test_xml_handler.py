@@ -0,0 +1,112 @@
+import pytest
+from lxml import etree
+
+from models.sinks.db import BaseDataStore
+from tests.dump_generator import DumpGenerator
+from utils import xml_handler
+from utils.xml_handler import PARSERS, RecordFilter, XMLDataHandler
+
+
+class RecordingDataStore(BaseDataStore):
+    def __init__(self):
+        self.batches = []
+
+    def connect(self):
+        pass
+
+    def insert(self, records):
+        self.batches.append(records)
+
+
+class FailingDataStore(RecordingDataStore):
+    def insert(self, records):
+        raise RuntimeError("insert failed")
+
+
+def load(tmp_path, kind, records, record_filter=None, **generator_args):
+    path = tmp_path / f"{kind}s.xml.gz"
+    DumpGenerator(kind, **generator_args).write(path, records=records)
+    data_store = RecordingDataStore()
+    XMLDataHandler(f"file://{path}", str(tmp_path), data_store=data_store,
+                   parser_class=PARSERS[kind](), keep_file=True, record_filter=record_filter).parse_xml()
+    return data_store.batches
+
+
+@pytest.mark.parametrize("kind", sorted(PARSERS))
+def test_parse_xml_loads_every_record_in_batches(tmp_path, monkeypatch, kind):
+    monkeypatch.setattr(xml_handler, "BATCH_SIZE", 20)
+
+    batches = load(tmp_path, kind, 50)
+
+    assert [len(batch) for batch in batches] == [20, 20, 10]
+    records = [record for batch in batches for record in batch]
+    assert [int(record["id"]) for record in records] == list(range(1, 51))
+    assert all(record["name" if kind in ("artist", "label") else "title"] for record in records)
+
+
+def test_release_parser_reads_nested_children(tmp_path):
+    release = load(tmp_path, "release", 1, children={"tracks": 5})[0][0]
+
+    assert release["status"] == "Accepted"
+    assert release["artists"] and release["artists"][0]["name"]
+    assert release["labels"][0]["catno"]
+    assert release["formats"][0]["descriptions"] == ['12"', "33 ⅓ RPM"]
+    assert release["genres"]
+    assert release["tracklist"][0]["position"] == "A1"
+    assert release["is_main_release"] in ("true", "false")
+
+
+def test_label_sublabels_are_not_loaded_as_labels(tmp_path):
+    labels = load(tmp_path, "label", 10, children={"sublabels": 5})[0]
+
+    assert len(labels) == 10
+    assert any(label["sublabels"] for label in labels)
+
+
+def test_record_filter_loads_only_matching_releases(tmp_path):
+    everything = load(tmp_path, "release", 200)[0]
+    record_filter = RecordFilter(genres=["Electronic"], years=(1990, 2009))
+
+    filtered = load(tmp_path, "release", 200, record_filter)[0]
+
+    expected = [
+        release for release in everything
+        if "Electronic" in release["genres"] and 1990 <= int(release["released"]) <= 2009
+    ]
+    assert 0 < len(filtered) < len(everything)
+    assert filtered == expected
+
+
+def test_record_filter_checks():
+    release = etree.fromstring(
+        '<release id="1"><genres><genre>Jazz</genre></genres><styles><style>Dub</style></styles>'
+        '<formats><format name="CD"/></formats><country>UK</country><released>1999-03-00</released></release>'
+    )
+
+    assert RecordFilter()(release)
+    assert RecordFilter(genres=["Rock", "Jazz"], styles=["Dub"], formats=["CD"], countries=["UK"], years=(1999, 1999))(release)
+    assert not RecordFilter(genres=["Electronic"])(release)
+    assert not RecordFilter(formats=["Vinyl"])(release)
+    assert not RecordFilter(countries=["US"])(release)
+    assert not RecordFilter(years=(2000, 2010))(release)
+    assert RecordFilter(years=(1990, 2000))(etree.fromstring("<master><year>1995</year></master>"))
+
+
+def test_record_filter_applies_only_to_kinds_with_its_criteria(tmp_path):
+    record_filter = RecordFilter(genres=["Electronic"], countries=["UK"])
+
+    assert record_filter.for_kind("release").countries == {"UK"}
+    master_filter = record_filter.for_kind("master")
+    assert master_filter.genres == {"Electronic"} and not master_filter.countries
+    assert record_filter.for_kind("artist") is None
+    assert len(load(tmp_path, "artist", 10, record_filter)[0]) == 10
+    assert len(load(tmp_path, "label", 10, record_filter)[0]) == 10
+
+
+def test_failed_insert_fails_the_load(tmp_path):
+    path = tmp_path / "artists.xml.gz"
+    DumpGenerator("artist").write(path, records=10)
+    handler = XMLDataHandler(f"file://{path}", str(tmp_path), data_store=FailingDataStore(),
+                             parser_class=PARSERS["artist"](), keep_file=True)
+
+    assert handler.parse_xml() is None